@@ -0,0 +1,109 @@
+"""
+Консольные утилиты сервиса
+
+Примеры:
+    python -m app.cli cache stats
+    python -m app.cli cache inspect --limit 50
+    python -m app.cli cache purge --expired
+    python -m app.cli cache warm texts.txt --style продающий
+"""
+import argparse
+import asyncio
+import json
+import sys
+from typing import List, Dict, Any
+
+from app.utils.cache import response_cache
+from app.utils.http_client import http_client
+
+def _print_json(data: Any) -> None:
+    print(json.dumps(data, ensure_ascii=False, indent=2))
+
+def _require_disk_cache():
+    if response_cache.disk is None:
+        print("Дисковый кэш отключен (DISK_CACHE_ENABLED=False)", file=sys.stderr)
+        sys.exit(1)
+    return response_cache.disk
+
+def _read_warm_items(path: str, style: str, length: str) -> List[Dict[str, Any]]:
+    """
+    Читает тексты для прогрева: по одному на строку, либо JSON-объекты
+    с полями text, style, length
+    """
+    items = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                item = json.loads(line)
+                item.setdefault("style", style)
+                item.setdefault("length", length)
+            else:
+                item = {"text": line, "style": style, "length": length}
+            items.append(item)
+    return items
+
+async def _warm(items: List[Dict[str, Any]], concurrency: int) -> Dict[str, int]:
+    """Прогоняет тексты через сервис улучшения, сохраняя ответы в кэш"""
+    from app.services.gigachat import gigachat_service
+
+    semaphore = asyncio.Semaphore(concurrency)
+    counters = {"total": len(items), "cached": 0, "fetched": 0, "failed": 0}
+
+    async def warm_one(item: Dict[str, Any]) -> None:
+        async with semaphore:
+            try:
+                result = await gigachat_service.enhance_text_detailed(
+                    item["text"], item.get("style"), item.get("length")
+                )
+                counters["cached" if result["cached"] else "fetched"] += 1
+            except Exception as e:
+                counters["failed"] += 1
+                print(f"Ошибка прогрева '{item['text'][:40]}': {str(e)}", file=sys.stderr)
+
+    try:
+        await asyncio.gather(*(warm_one(item) for item in items))
+    finally:
+        await http_client.close()
+    return counters
+
+def cache_command(args: argparse.Namespace) -> None:
+    if args.action == "stats":
+        _print_json(_require_disk_cache().summary_sync())
+    elif args.action == "inspect":
+        _print_json(_require_disk_cache().inspect_sync(args.limit))
+    elif args.action == "purge":
+        removed = _require_disk_cache().purge_sync(expired_only=args.expired)
+        print(f"Удалено записей: {removed}")
+    elif args.action == "warm":
+        items = _read_warm_items(args.file, args.style, args.length)
+        _print_json(asyncio.run(_warm(items, args.concurrency)))
+    response_cache.close()
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Утилиты сервиса улучшения текста")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cache = commands.add_parser("cache", help="Управление постоянным кэшем ответов")
+    actions = cache.add_subparsers(dest="action", required=True)
+    actions.add_parser("stats", help="Размер и количество записей")
+    inspect = actions.add_parser("inspect", help="Последние использованные записи")
+    inspect.add_argument("--limit", type=int, default=20)
+    purge = actions.add_parser("purge", help="Очистка кэша")
+    purge.add_argument("--expired", action="store_true", help="Удалить только истекшие записи")
+    warm = actions.add_parser("warm", help="Прогрев кэша текстами из файла")
+    warm.add_argument("file", help="Файл с текстами (по одному на строку или JSON-объекты)")
+    warm.add_argument("--style", default=None)
+    warm.add_argument("--length", default=None)
+    warm.add_argument("--concurrency", type=int, default=4)
+    cache.set_defaults(handler=cache_command)
+    return parser
+
+def main() -> None:
+    args = build_parser().parse_args()
+    args.handler(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 from pydantic import BaseModel
 import os
+import tempfile
 from dotenv import load_dotenv
-from typing import Optional
+from typing import Optional, List
 
 # Загрузка переменных окружения из файла .env
 load_dotenv()
@@ -12,18 +13,289 @@ class GigaChatConfig(BaseModel):
     client_secret: str = os.getenv("GIGACHAT_CLIENT_SECRET", "")
     auth_key: str = os.getenv("GIGACHAT_AUTH_KEY", "")
     scope: str = os.getenv("GIGACHAT_SCOPE", "GIGACHAT_API_PERS")
-    api_base_url: str = "https://gigachat.devices.sberbank.ru/api/v1"
-    auth_url: str = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
+    # Адреса API можно переопределить, например для локальной замены tools/mock_gigachat.py
+    api_base_url: str = os.getenv("GIGACHAT_API_BASE_URL", "https://gigachat.devices.sberbank.ru/api/v1")
+    auth_url: str = os.getenv("GIGACHAT_AUTH_URL", "https://ngw.devices.sberbank.ru:9443/api/v2/oauth")
     model: str = os.getenv("GIGACHAT_MODEL", "GigaChat")
     temperature: float = float(os.getenv("GIGACHAT_TEMPERATURE", "0.7"))
     max_tokens: int = int(os.getenv("GIGACHAT_MAX_TOKENS", "1500"))
+    # За сколько секунд до истечения токена запускать его обновление
+    token_refresh_margin: float = float(os.getenv("GIGACHAT_TOKEN_REFRESH_MARGIN", "60"))
+    token_max_refresh_attempts: int = int(os.getenv("GIGACHAT_TOKEN_MAX_REFRESH_ATTEMPTS", "3"))
+    token_backoff_base: float = float(os.getenv("GIGACHAT_TOKEN_BACKOFF_BASE", "1"))
+    token_backoff_max: float = float(os.getenv("GIGACHAT_TOKEN_BACKOFF_MAX", "30"))
+    # Хранилище токена: memory (в процессе) или sqlite (общее для воркеров на одном хосте)
+    token_store: str = os.getenv("GIGACHAT_TOKEN_STORE", "memory")
+    token_store_path: str = os.getenv("GIGACHAT_TOKEN_STORE_PATH", os.path.join(tempfile.gettempdir(), "gigachat_token.sqlite3"))
+    # Время, на которое воркер захватывает право обновления токена; аренда продлевается
+    # перед каждой попыткой, поэтому должна покрывать одну попытку (таймаут OAuth 30 с) и паузу перед ней
+    token_lease_ttl: float = float(os.getenv("GIGACHAT_TOKEN_LEASE_TTL", "60"))
 
 class AssistantConfig(BaseModel):
     """Конфигурация для ассистента"""
     model: str = os.getenv("ASSISTANT_MODEL", "GigaChat")
     temperature: float = float(os.getenv("ASSISTANT_TEMPERATURE", "0.5"))
     max_tokens: int = int(os.getenv("ASSISTANT_MAX_TOKENS", "1000"))
+    # Файлы базы знаний в формате Markdown (несколько - через запятую)
     platform_info: str = os.getenv("PLATFORM_INFO_PATH", "documentation.md")
+    # Шаблон системного промпта ассистента
+    system_prompt_path: str = os.getenv("ASSISTANT_SYSTEM_PROMPT_PATH", "prompts/assistant_system.md")
+    # Период проверки изменения файлов промпта и базы знаний (0 - не проверять)
+    assets_reload_interval: float = float(os.getenv("PROMPT_ASSETS_RELOAD_INTERVAL", "2"))
+    # Число разделов документации в промпте и их суммарный размер
+    context_top_k: int = int(os.getenv("ASSISTANT_CONTEXT_TOP_K", "3"))
+    context_max_chars: int = int(os.getenv("ASSISTANT_CONTEXT_MAX_CHARS", "4000"))
+    # Число разделов в ответе эндпоинта поиска
+    search_top_k: int = int(os.getenv("ASSISTANT_SEARCH_TOP_K", "5"))
+    # Кэширование контекста на стороне GigaChat через заголовок X-Session-ID
+    session_cache: bool = os.getenv("ASSISTANT_SESSION_CACHE", "True").lower() in ('true', '1', 't')
+    # Сессия пользователя сменяется после указанного времени бездействия (секунды)
+    session_ttl: float = float(os.getenv("ASSISTANT_SESSION_TTL", "1800"))
+    # Сколько сессий хранить в памяти
+    session_max_entries: int = int(os.getenv("ASSISTANT_SESSION_MAX_ENTRIES", "50000"))
+
+    @property
+    def knowledge_paths(self) -> List[str]:
+        return [path.strip() for path in self.platform_info.split(",") if path.strip()]
+
+class EmbeddingsConfig(BaseModel):
+    """Конфигурация семантического поиска по документации"""
+    # gigachat - эндпоинт /embeddings, local - локальный векторизатор без API, none - только BM25.
+    # По умолчанию выключено: с gigachat каждый новый запрос поиска и контекста /ask - лишний вызов API
+    provider: str = os.getenv("EMBEDDINGS_PROVIDER", "none").lower()
+    model: str = os.getenv("EMBEDDINGS_MODEL", "Embeddings")
+    # Сколько ждать вектор запроса (секунды); дольше - поиск только по BM25
+    query_timeout: float = float(os.getenv("EMBEDDINGS_QUERY_TIMEOUT", "0.5"))
+    # Каталог с векторами разделов (файл NumPy, открывается через memory-mapping)
+    index_path: str = os.getenv("EMBEDDINGS_INDEX_PATH", "data/embeddings")
+    batch_size: int = int(os.getenv("EMBEDDINGS_BATCH_SIZE", "16"))
+    # Размерность векторов локального векторизатора
+    local_dim: int = int(os.getenv("EMBEDDINGS_LOCAL_DIM", "512"))
+    # Сколько векторов запросов хранить в памяти
+    query_cache_size: int = int(os.getenv("EMBEDDINGS_QUERY_CACHE_SIZE", "1024"))
+
+class ConversationConfig(BaseModel):
+    """Конфигурация памяти диалогов ассистента (по user_id)"""
+    enabled: bool = os.getenv("CONVERSATION_ENABLED", "True").lower() in ('true', '1', 't')
+    # Бюджет токенов на историю диалога в промпте
+    history_tokens: int = int(os.getenv("CONVERSATION_HISTORY_TOKENS", "1500"))
+    # Сколько последних реплик хранить на пользователя
+    max_turns: int = int(os.getenv("CONVERSATION_MAX_TURNS", "10"))
+    # Ответы длиннее этого размера сохраняются обрезанными
+    max_turn_chars: int = int(os.getenv("CONVERSATION_MAX_TURN_CHARS", "1000"))
+    # Диалог забывается после указанного времени бездействия (секунды)
+    ttl: float = float(os.getenv("CONVERSATION_TTL", "1800"))
+    # Ограничения памяти процесса: число диалогов и их суммарный размер
+    max_users: int = int(os.getenv("CONVERSATION_MAX_USERS", "50000"))
+    max_bytes: int = int(os.getenv("CONVERSATION_MAX_BYTES", str(64 * 1024 * 1024)))
+    # memory - только в памяти процесса, sqlite - с сохранением в файл
+    store: str = os.getenv("CONVERSATION_STORE", "memory").lower()
+    store_path: str = os.getenv("CONVERSATION_STORE_PATH", "data/conversations.sqlite3")
+
+class TokensConfig(BaseModel):
+    """Конфигурация учета токенов и бюджета промпта"""
+    # Максимальный размер промпта (оценка в токенах) перед отправкой в API
+    max_prompt_tokens: int = int(os.getenv("TOKENS_MAX_PROMPT", "4000"))
+    # Действие при превышении бюджета: trim - сократить промпт, reject - отклонить запрос
+    overflow: str = os.getenv("TOKENS_OVERFLOW", "trim").lower()
+    # Уточнение оценки по эндпоинту /tokens/count на выборке промптов
+    calibrate: bool = os.getenv("TOKENS_CALIBRATE", "True").lower() in ('true', '1', 't')
+    # Каждый какой промпт отправлять на точный подсчет
+    calibration_every: int = int(os.getenv("TOKENS_CALIBRATION_EVERY", "50"))
+    # Сколько точных подсчетов текстов хранить в памяти
+    count_cache_size: int = int(os.getenv("TOKENS_COUNT_CACHE_SIZE", "1024"))
+    # Сколько пользователей учитывать в счетчиках по user_id (давно неактивные вытесняются)
+    usage_max_users: int = int(os.getenv("TOKENS_USAGE_MAX_USERS", "10000"))
+
+class HTTPClientConfig(BaseModel):
+    """Конфигурация общего HTTP-клиента для запросов к GigaChat API"""
+    max_connections: int = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+    max_keepalive_connections: int = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    keepalive_expiry: float = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+    http2: bool = os.getenv("HTTP_HTTP2", "False").lower() in ('true', '1', 't')
+    connect_timeout: float = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+    read_timeout: float = float(os.getenv("HTTP_READ_TIMEOUT", "60"))
+    write_timeout: float = float(os.getenv("HTTP_WRITE_TIMEOUT", "10"))
+    pool_timeout: float = float(os.getenv("HTTP_POOL_TIMEOUT", "10"))
+    # Проверка SSL отключена для тестовых сертификатов GigaChat
+    verify_ssl: bool = os.getenv("HTTP_VERIFY_SSL", "False").lower() in ('true', '1', 't')
+
+class LimiterConfig(BaseModel):
+    """Конфигурация адаптивного ограничения одновременных запросов к GigaChat API"""
+    enabled: bool = os.getenv("UPSTREAM_LIMIT_ENABLED", "True").lower() in ('true', '1', 't')
+    initial_limit: float = float(os.getenv("UPSTREAM_LIMIT_INITIAL", "8"))
+    min_limit: float = float(os.getenv("UPSTREAM_LIMIT_MIN", "1"))
+    max_limit: float = float(os.getenv("UPSTREAM_LIMIT_MAX", "64"))
+    # Во сколько раз уменьшать лимит при ответе 429
+    backoff_ratio: float = float(os.getenv("UPSTREAM_LIMIT_BACKOFF_RATIO", "0.5"))
+    # Во сколько раз уменьшать лимит при всплеске задержки
+    latency_backoff_ratio: float = float(os.getenv("UPSTREAM_LIMIT_LATENCY_BACKOFF_RATIO", "0.9"))
+    # Всплеск: задержка больше средней в указанное число раз
+    latency_tolerance: float = float(os.getenv("UPSTREAM_LIMIT_LATENCY_TOLERANCE", "3"))
+
+class ResilienceConfig(BaseModel):
+    """Конфигурация автоматического выключателя и повторов запросов к GigaChat API"""
+    breaker_enabled: bool = os.getenv("BREAKER_ENABLED", "True").lower() in ('true', '1', 't')
+    # Выключатель размыкается, если среди последних BREAKER_WINDOW запросов доля ошибок
+    # (429, 5xx, сетевые ошибки) не меньше BREAKER_FAILURE_RATIO, а запросов не меньше BREAKER_MIN_CALLS
+    breaker_window: int = int(os.getenv("BREAKER_WINDOW", "20"))
+    breaker_min_calls: int = int(os.getenv("BREAKER_MIN_CALLS", "10"))
+    breaker_failure_ratio: float = float(os.getenv("BREAKER_FAILURE_RATIO", "0.5"))
+    # Через сколько секунд после размыкания пропустить пробный запрос
+    breaker_open_seconds: float = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+    # Число попыток запроса при 429, 5xx и сетевых ошибках (включая первую)
+    retry_max_attempts: int = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+    retry_backoff_base: float = float(os.getenv("RETRY_BACKOFF_BASE", "0.5"))
+    retry_backoff_max: float = float(os.getenv("RETRY_BACKOFF_MAX", "8"))
+    # Бюджет повторов: не больше указанной доли от запросов за окно (плюс минимум в секунду)
+    retry_budget_ratio: float = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+    retry_budget_min_per_second: float = float(os.getenv("RETRY_BUDGET_MIN_PER_SECOND", "1"))
+    retry_budget_window: float = float(os.getenv("RETRY_BUDGET_WINDOW", "10"))
+
+class HedgingConfig(BaseModel):
+    """Конфигурация дублирования (hedging) медленных запросов к GigaChat API"""
+    # Выключено по умолчанию: каждый дубль - дополнительный платный запрос к API
+    enabled: bool = os.getenv("HEDGE_ENABLED", "False").lower() in ('true', '1', 't')
+    # Эндпоинты сервиса (шаблоны путей через запятую, например /api/enhance), запросы которых дублируются
+    endpoints: str = os.getenv("HEDGE_ENDPOINTS", "")
+    # Дубль отправляется, если ответа нет дольше указанного перцентиля недавних задержек эндпоинта
+    percentile: float = float(os.getenv("HEDGE_PERCENTILE", "95"))
+    # Минимальная задержка перед отправкой дубля (секунды)
+    min_delay: float = float(os.getenv("HEDGE_MIN_DELAY", "1"))
+    # Сколько последних задержек учитывать и сколько нужно до первого дубля
+    latency_window: int = int(os.getenv("HEDGE_LATENCY_WINDOW", "200"))
+    min_samples: int = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+    # Бюджет: дублей не больше указанной доли от запросов за последние HEDGE_BUDGET_WINDOW секунд
+    budget_ratio: float = float(os.getenv("HEDGE_BUDGET_RATIO", "0.05"))
+    budget_window: float = float(os.getenv("HEDGE_BUDGET_WINDOW", "60"))
+
+    @property
+    def endpoint_paths(self) -> List[str]:
+        return [path.strip() for path in self.endpoints.split(",") if path.strip()]
+
+class MetricsConfig(BaseModel):
+    """Конфигурация метрик Prometheus и заголовка Server-Timing"""
+    enabled: bool = os.getenv("METRICS_ENABLED", "True").lower() in ('true', '1', 't')
+    # Добавлять к ответам заголовок Server-Timing с разбивкой времени запроса по фазам
+    server_timing: bool = os.getenv("METRICS_SERVER_TIMING", "True").lower() in ('true', '1', 't')
+
+class ProfilingConfig(BaseModel):
+    """Конфигурация выборочного профилирования запросов и контроля блокировок цикла событий"""
+    # Профилирование доли запросов (можно включить во время работы через /api/admin/profiling)
+    enabled: bool = os.getenv("PROFILING_ENABLED", "False").lower() in ('true', '1', 't')
+    sample_rate: float = float(os.getenv("PROFILING_SAMPLE_RATE", "0.01"))
+    # Интервал между снимками стека (миллисекунды)
+    interval_ms: float = float(os.getenv("PROFILING_INTERVAL_MS", "5"))
+    # Каталог для профилей в формате свернутых стеков (flamegraph.pl, speedscope)
+    output_dir: str = os.getenv("PROFILING_DIR", "profiles")
+    max_files: int = int(os.getenv("PROFILING_MAX_FILES", "200"))
+    # Секрет для эндпоинта /api/admin/profiling и заголовка X-Profile; пустой - управление отключено
+    secret: str = os.getenv("PROFILING_SECRET", "")
+    # Предупреждение со стеком, если цикл событий заблокирован дольше LOOP_LAG_THRESHOLD_MS
+    loop_monitor: bool = os.getenv("LOOP_LAG_MONITOR", "True").lower() in ('true', '1', 't')
+    loop_lag_threshold_ms: float = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "100"))
+
+class LoggingConfig(BaseModel):
+    """Конфигурация логирования"""
+    # Уровень логирования (можно изменить во время работы через /api/admin/logging)
+    level: str = os.getenv("LOG_LEVEL", "INFO").upper()
+    # Формат записей: json (по записи JSON на строку) или text
+    format: str = os.getenv("LOG_FORMAT", "json").lower()
+    # Размер очереди записей фонового писателя; при переполнении записи отбрасываются
+    queue_size: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    # Не больше LOG_TRACEBACK_LIMIT стеков одной и той же ошибки за LOG_TRACEBACK_WINDOW секунд
+    traceback_limit: int = int(os.getenv("LOG_TRACEBACK_LIMIT", "5"))
+    traceback_window: float = float(os.getenv("LOG_TRACEBACK_WINDOW", "60"))
+
+class CaptureConfig(BaseModel):
+    """Конфигурация журнала запросов для воспроизведения нагрузки (tools/replay.py)"""
+    enabled: bool = os.getenv("CAPTURE_ENABLED", "False").lower() in ('true', '1', 't')
+    # Доля записываемых запросов
+    sample_rate: float = float(os.getenv("CAPTURE_SAMPLE_RATE", "1.0"))
+    # Эндпоинты (пути или их начала через запятую), запросы которых записываются
+    endpoints: str = os.getenv("CAPTURE_ENDPOINTS", "/api/enhance,/api/assistant/ask,/api/assistant/search")
+    # Файл журнала в формате JSONL; при превышении CAPTURE_MAX_BYTES он переименовывается в .1, .2 и т.д.
+    path: str = os.getenv("CAPTURE_PATH", "logs/capture.jsonl")
+    max_bytes: int = int(os.getenv("CAPTURE_MAX_BYTES", str(64 * 1024 * 1024)))
+    backup_count: int = int(os.getenv("CAPTURE_BACKUP_COUNT", "5"))
+    # Записывать параметры и тело запроса (без них остаются только хэш и длина промпта, воспроизведение невозможно)
+    payloads: bool = os.getenv("CAPTURE_PAYLOADS", "True").lower() in ('true', '1', 't')
+    # Тело запроса больше этого размера (байты) не сохраняется
+    max_body_bytes: int = int(os.getenv("CAPTURE_MAX_BODY_BYTES", str(64 * 1024)))
+    # Записи сбрасываются в файл пакетами: по CAPTURE_BATCH_SIZE или раз в CAPTURE_FLUSH_INTERVAL секунд
+    batch_size: int = int(os.getenv("CAPTURE_BATCH_SIZE", "200"))
+    flush_interval: float = float(os.getenv("CAPTURE_FLUSH_INTERVAL", "1"))
+    # Размер очереди записей; при переполнении записи отбрасываются
+    queue_size: int = int(os.getenv("CAPTURE_QUEUE_SIZE", "10000"))
+
+    @property
+    def endpoint_prefixes(self) -> List[str]:
+        return [path.strip() for path in self.endpoints.split(",") if path.strip()]
+
+class CacheConfig(BaseModel):
+    """Конфигурация кэша ответов на запросы улучшения текста"""
+    enabled: bool = os.getenv("RESPONSE_CACHE_ENABLED", "True").lower() in ('true', '1', 't')
+    max_entries: int = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+    max_bytes: int = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+    ttl: float = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+
+class SemanticCacheConfig(BaseModel):
+    """Конфигурация семантического кэша ответов ассистента"""
+    enabled: bool = os.getenv("SEMANTIC_CACHE_ENABLED", "True").lower() in ('true', '1', 't')
+    # Минимальная похожесть вопросов (оценка коэффициента Жаккара по MinHash, 0..1)
+    threshold: float = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.8"))
+    max_entries: int = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000"))
+    ttl: float = float(os.getenv("SEMANTIC_CACHE_TTL", "86400"))
+    # Число хэш-функций MinHash (кратно SEMANTIC_CACHE_BANDS)
+    num_perm: int = int(os.getenv("SEMANTIC_CACHE_NUM_PERM", "64"))
+    bands: int = int(os.getenv("SEMANTIC_CACHE_BANDS", "16"))
+
+class DiskCacheConfig(BaseModel):
+    """Конфигурация постоянного (дискового) уровня кэша ответов"""
+    enabled: bool = os.getenv("DISK_CACHE_ENABLED", "True").lower() in ('true', '1', 't')
+    path: str = os.getenv("DISK_CACHE_PATH", "data/response_cache.sqlite3")
+    max_bytes: int = int(os.getenv("DISK_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+    ttl: float = float(os.getenv("DISK_CACHE_TTL", str(7 * 24 * 3600)))
+    compression_level: int = int(os.getenv("DISK_CACHE_COMPRESSION_LEVEL", "6"))
+
+class BatchConfig(BaseModel):
+    """Конфигурация пакетной обработки текстов"""
+    max_items: int = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+    # Количество одновременных запросов к GigaChat API для одного пакета
+    concurrency: int = int(os.getenv("BATCH_CONCURRENCY", "8"))
+    max_concurrency: int = int(os.getenv("BATCH_MAX_CONCURRENCY", "32"))
+
+class LongTextConfig(BaseModel):
+    """Конфигурация улучшения длинных текстов по частям"""
+    # Максимальный размер части текста (символы); части разделяются по абзацам и предложениям
+    chunk_chars: int = int(os.getenv("LONG_TEXT_CHUNK_CHARS", "3000"))
+    # Количество одновременных запросов к GigaChat API для одного текста
+    concurrency: int = int(os.getenv("LONG_TEXT_CONCURRENCY", "4"))
+    max_concurrency: int = int(os.getenv("LONG_TEXT_MAX_CONCURRENCY", "16"))
+    # Максимальный размер тела запроса (байты)
+    max_bytes: int = int(os.getenv("LONG_TEXT_MAX_BYTES", str(10 * 1024 * 1024)))
+    # Итоговый проход, согласующий стиль частей (если результат помещается в один запрос)
+    consistency_pass: bool = os.getenv("LONG_TEXT_CONSISTENCY_PASS", "True").lower() in ('true', '1', 't')
+
+class JobsConfig(BaseModel):
+    """Конфигурация фоновых заданий на улучшение текста"""
+    store_path: str = os.getenv("JOBS_STORE_PATH", "data/jobs.sqlite3")
+    workers: int = int(os.getenv("JOBS_WORKERS", "2"))
+    # Максимальное число одновременных запросов к GigaChat от всех заданий
+    max_in_flight: int = int(os.getenv("JOBS_MAX_IN_FLIGHT", "8"))
+    max_items: int = int(os.getenv("JOBS_MAX_ITEMS", "10000"))
+    # Сколько секунд хранить завершенные задания
+    retention: float = float(os.getenv("JOBS_RETENTION", str(7 * 24 * 3600)))
+    callback_timeout: float = float(os.getenv("JOBS_CALLBACK_TIMEOUT", "10"))
+    callback_attempts: int = int(os.getenv("JOBS_CALLBACK_ATTEMPTS", "3"))
+    # Хосты, на которые разрешены уведомления (через запятую). Если не заданы - любые, кроме внутренних адресов
+    callback_hosts: str = os.getenv("JOBS_CALLBACK_HOSTS", "")
+    # Аренда задания процессом (секунды): после ее истечения задание подбирает другой процесс
+    lease_seconds: float = float(os.getenv("JOBS_LEASE_SECONDS", "60"))
+
+    @property
+    def callback_host_list(self) -> List[str]:
+        return [host.strip().lower() for host in self.callback_hosts.split(",") if host.strip()]
 
 class APIConfig(BaseModel):
     """Основная конфигурация API"""
@@ -37,4 +309,21 @@ class APIConfig(BaseModel):
 # Создание экземпляров конфигурации
 gigachat_config = GigaChatConfig()
 assistant_config = AssistantConfig()
+embeddings_config = EmbeddingsConfig()
+conversation_config = ConversationConfig()
+tokens_config = TokensConfig()
+http_client_config = HTTPClientConfig()
+limiter_config = LimiterConfig()
+resilience_config = ResilienceConfig()
+hedging_config = HedgingConfig()
+metrics_config = MetricsConfig()
+profiling_config = ProfilingConfig()
+logging_config = LoggingConfig()
+capture_config = CaptureConfig()
+cache_config = CacheConfig()
+semantic_cache_config = SemanticCacheConfig()
+disk_cache_config = DiskCacheConfig()
+batch_config = BatchConfig()
+long_text_config = LongTextConfig()
+jobs_config = JobsConfig()
 api_config = APIConfig() 
\ No newline at end of file
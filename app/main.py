@@ -1,30 +1,137 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 import uvicorn
 import warnings
 import ssl
-import traceback
+import logging
 import time
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 import asyncio
+from contextlib import asynccontextmanager
 
-from app.config import api_config
-from app.routers import text_enhancer, assistant
+from app.config import api_config, metrics_config, capture_config
+from app.utils.log import logging_manager, RequestIdMiddleware
+
+# Логирование настраивается до импорта остальных модулей: они пишут в лог при создании объектов
+logging_manager.setup()
+
+from app.routers import text_enhancer, assistant, jobs, admin
+from app.services.conversations import conversation_store
+from app.services.jobs import job_service
+from app.services.knowledge import knowledge_base
+from app.services.prompt_assets import prompt_assets
+from app.services.sessions import upstream_sessions
 from app.utils.auth import token_manager
+from app.utils.http_client import http_client
+from app.utils.cache import response_cache
+from app.utils.capture import capture_log, CaptureMiddleware
+from app.utils.coalesce import request_coalescer
+from app.utils.semantic_cache import semantic_cache
+from app.utils.hedging import hedge_policy
+from app.utils.limiter import upstream_limiter
+from app.utils.metrics import MetricsMiddleware, render_metrics, METRICS_CONTENT_TYPE
+from app.utils.profiling import sampling_profiler, loop_monitor
+from app.utils.resilience import upstream_breaker, retry_policy, CircuitOpenError
+from app.utils.tokens import token_counter
+from app.utils.usage import token_usage, UsageContextMiddleware
+
+logger = logging.getLogger("app")
 
 # Отключаем предупреждения SSL
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 ssl._create_default_https_context = ssl._create_unverified_context
 
+# Создаем планировщик
+scheduler = AsyncIOScheduler()
+
+# Функция для обновления токена
+async def refresh_token_job():
+    """Задача для планировщика: обновляет токен, только если он скоро истечет"""
+    try:
+        if token_manager.needs_refresh():
+            await token_manager.refresh_token()
+            logger.info("[Планировщик] Токен успешно обновлен в %s", time.strftime('%H:%M:%S'))
+    except Exception as e:
+        logger.error("[Планировщик] Ошибка обновления токена: %s", e)
+
+async def purge_conversations_job():
+    """Задача для планировщика: удаляет диалоги без активности дольше CONVERSATION_TTL"""
+    try:
+        await conversation_store.purge()
+    except Exception as e:
+        logger.error("[Планировщик] Ошибка очистки истории диалогов: %s", e)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Действия при запуске и остановке приложения"""
+    # Создаем общий пул соединений к GigaChat API
+    await http_client.start()
+
+    # Загружаем промпт ассистента и строим индекс документации; далее файлы
+    # перечитываются при изменении, а документация векторизуется в фоне
+    await prompt_assets.start()
+
+    # Каждую минуту проверяем, не пора ли обновить токен
+    scheduler.add_job(
+        refresh_token_job,
+        IntervalTrigger(minutes=1),
+        id="refresh_token_job",
+        replace_existing=True
+    )
+    scheduler.add_job(
+        purge_conversations_job,
+        IntervalTrigger(minutes=5),
+        id="purge_conversations_job",
+        replace_existing=True
+    )
+    # Запускаем планировщик
+    scheduler.start()
+    logger.info("Запущен планировщик проверки токена (каждую минуту)")
+    
+    # Получаем первоначальный токен
+    await token_manager.get_token()
+
+    # Запускаем воркеры фоновых заданий
+    await job_service.start()
+
+    # Следим за блокировками цикла событий (синхронный код в асинхронных обработчиках)
+    await loop_monitor.start()
+
+    # Запускаем запись журнала запросов (если включена)
+    await capture_log.start()
+
+    yield
+
+    await loop_monitor.stop()
+
+    # Дописываем в файл записи журнала запросов из очереди
+    await capture_log.stop()
+
+    await prompt_assets.stop()
+
+    # Останавливаем воркеры заданий (незавершенные задания продолжатся после перезапуска)
+    await job_service.stop()
+
+    # Останавливаем планировщик
+    if scheduler.running:
+        scheduler.shutdown()
+        logger.info("Планировщик обновления токена остановлен")
+
+    # Закрываем соединения пула, файл дискового кэша и хранилище диалогов
+    await http_client.close()
+    response_cache.close()
+    conversation_store.close()
+
 # Создаем экземпляр FastAPI
 app = FastAPI(
     title=api_config.title,
     description=api_config.description,
     version=api_config.version,
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # Добавляем middleware для CORS
@@ -36,28 +143,41 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Создаем планировщик
-scheduler = AsyncIOScheduler()
+# Журнал запросов для воспроизведения нагрузки (внутри учета токенов, чтобы записать расход запроса)
+if capture_config.enabled:
+    app.add_middleware(CaptureMiddleware)
 
-# Функция для обновления токена
-async def refresh_token_job():
-    """Задача для планировщика по обновлению токена"""
-    try:
-        await token_manager.refresh_token()
-        print(f"[Планировщик] Токен успешно обновлен в {time.strftime('%H:%M:%S')}")
-    except Exception as e:
-        print(f"[Планировщик] Ошибка обновления токена: {str(e)}")
+# Учет токенов по эндпоинтам: запросы к API связываются с вызвавшим их эндпоинтом
+app.add_middleware(UsageContextMiddleware)
+
+# Время запросов по эндпоинтам и фазам запросов к API (метрики и заголовок Server-Timing)
+if metrics_config.enabled:
+    app.add_middleware(MetricsMiddleware)
+
+# Идентификатор запроса в записях лога и заголовке X-Request-ID
+app.add_middleware(RequestIdMiddleware)
 
 # Регистрируем роутеры
 app.include_router(text_enhancer.router)
 app.include_router(assistant.router)
+app.include_router(jobs.router)
+app.include_router(admin.router)
+
+# API недоступен: отвечаем сразу, клиент может повторить запрос позже
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, exc: CircuitOpenError):
+    return JSONResponse(
+        status_code=503,
+        content={"error": str(exc)},
+        headers=exc.headers
+    )
 
 # Обработчик исключений
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     """Глобальный обработчик исключений"""
     error_message = f"Внутренняя ошибка сервера: {str(exc)}"
-    traceback.print_exc()
+    logger.exception("Необработанная ошибка при обработке запроса %s %s", request.method, request.url.path)
     return JSONResponse(
         status_code=500,
         content={"error": error_message}
@@ -78,38 +198,48 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Проверка работоспособности сервиса"""
-    token_status = "active" if token_manager.access_token and token_manager.token_expires_at > time.time() else "expired"
+    token_status = "active" if token_manager.is_valid() else "expired"
     return {
         "status": "ok",
         "token_status": token_status,
-        "expires_in": int(token_manager.token_expires_at - time.time()) if token_manager.token_expires_at else None,
-        "scheduler": "running" if scheduler.running else "stopped"
+        "expires_in": token_manager.expires_in(),
+        "token": token_manager.stats(),
+        "scheduler": "running" if scheduler.running else "stopped",
+        "http_pool": http_client.stats(),
+        "response_cache": response_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "tokens": dict(token_usage.stats(), estimator=token_counter.stats()),
+        "conversations": conversation_store.stats(),
+        "upstream_sessions": upstream_sessions.stats(),
+        "coalescing": request_coalescer.stats(),
+        "upstream_limiter": upstream_limiter.stats(),
+        "upstream_breaker": dict(upstream_breaker.stats(), retries=retry_policy.stats()),
+        "hedging": hedge_policy.stats(),
+        "profiling": dict(sampling_profiler.stats(), loop_monitor=loop_monitor.stats()),
+        "capture": capture_log.stats(),
+        "logging": logging_manager.stats(),
+        "knowledge": knowledge_base.stats(),
+        "prompt": prompt_assets.stats(),
+        "jobs": job_service.stats()
     }
 
-@app.on_event("startup")
-async def startup_event():
-    """Действия при запуске приложения"""
-    # Добавляем задачу обновления токена каждую минуту
-    scheduler.add_job(
-        refresh_token_job,
-        IntervalTrigger(minutes=1),
-        id="refresh_token_job",
-        replace_existing=True
-    )
-    # Запускаем планировщик
-    scheduler.start()
-    print("Запущен планировщик обновления токена (каждую минуту)")
-    
-    # Получаем первоначальный токен
-    await token_manager.refresh_token()
+# Расход токенов GigaChat (рейтинг пользователей - только в /api/admin/usage)
+@app.get("/usage")
+async def usage():
+    """Счетчики токенов из блока usage ответов API: всего и по эндпоинтам"""
+    return {
+        "totals": token_usage.totals,
+        "endpoints": token_usage.endpoints,
+        "users": token_usage.stats()["users"],
+        "estimator": token_counter.stats()
+    }
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Действия при остановке приложения"""
-    # Останавливаем планировщик
-    if scheduler.running:
-        scheduler.shutdown()
-        print("Планировщик обновления токена остановлен")
+# Метрики в формате Prometheus
+if metrics_config.enabled:
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        """Гистограммы задержек эндпоинтов и фаз запросов к GigaChat API, счетчики кэшей, повторов и токенов"""
+        return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
 
 # Запуск приложения
 if __name__ == "__main__":
@@ -0,0 +1,108 @@
+from fastapi import APIRouter, HTTPException, Depends, Header, Query
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any
+
+from app.config import profiling_config
+from app.utils.log import logging_manager
+from app.utils.profiling import sampling_profiler, loop_monitor, secret_matches
+from app.utils.usage import token_usage
+
+# Создаем роутер
+router = APIRouter(prefix="/api/admin", tags=["admin"])
+
+# Модели данных
+class ProfilingSettings(BaseModel):
+    """Изменение настроек профилирования (незаданные поля не меняются)"""
+    enabled: Optional[bool] = Field(None, description="Профилировать долю запросов")
+    sample_rate: Optional[float] = Field(None, ge=0, le=1, description="Доля профилируемых запросов")
+    loop_monitor: Optional[bool] = Field(None, description="Контроль блокировок цикла событий")
+    loop_lag_threshold_ms: Optional[float] = Field(None, gt=0, description="Порог блокировки цикла событий, мс")
+
+class LoggingSettings(BaseModel):
+    """Изменение уровней логирования"""
+    level: Optional[str] = Field(None, description="Уровень корневого логгера: DEBUG, INFO, WARNING, ERROR")
+    loggers: Dict[str, str] = Field({}, description="Уровни отдельных логгеров, например {\"upstream\": \"DEBUG\"}")
+
+async def require_admin(x_admin_secret: Optional[str] = Header(None, description="Значение PROFILING_SECRET")) -> None:
+    """Проверяет секрет администратора"""
+    if not profiling_config.secret:
+        raise HTTPException(status_code=403, detail="Административные эндпоинты отключены: не задан PROFILING_SECRET")
+    if not secret_matches(x_admin_secret, profiling_config.secret):
+        raise HTTPException(status_code=403, detail="Неверный секрет администратора")
+
+def _profiling_status() -> Dict[str, Any]:
+    return {
+        "profiler": sampling_profiler.stats(),
+        "loop_monitor": loop_monitor.stats(),
+        "output_dir": sampling_profiler.output_dir,
+        "recent_profiles": sampling_profiler.recent()
+    }
+
+@router.get("/profiling", dependencies=[Depends(require_admin)])
+async def get_profiling() -> Dict[str, Any]:
+    """
+    Возвращает настройки профилирования и последние сохраненные профили.
+    """
+    return _profiling_status()
+
+@router.post("/profiling", dependencies=[Depends(require_admin)])
+async def update_profiling(settings: ProfilingSettings) -> Dict[str, Any]:
+    """
+    Включает или выключает профилирование без перезапуска сервиса.
+
+    Настройки действуют до перезапуска процесса и только в нем
+    (при нескольких воркерах запрос нужно отправить каждому).
+    """
+    if settings.sample_rate is not None:
+        sampling_profiler.sample_rate = settings.sample_rate
+    if settings.enabled is not None:
+        sampling_profiler.enabled = settings.enabled
+    if settings.loop_lag_threshold_ms is not None:
+        loop_monitor.threshold = settings.loop_lag_threshold_ms / 1000
+    if settings.loop_monitor is not None:
+        loop_monitor.enabled = settings.loop_monitor
+        if settings.loop_monitor:
+            await loop_monitor.start()
+        else:
+            await loop_monitor.stop()
+    return _profiling_status()
+
+@router.get("/logging", dependencies=[Depends(require_admin)])
+async def get_logging() -> Dict[str, Any]:
+    """
+    Возвращает уровни логирования и состояние очереди записей.
+    """
+    return dict(logging_manager.stats(), levels=logging_manager.levels())
+
+@router.post("/logging", dependencies=[Depends(require_admin)])
+async def update_logging(settings: LoggingSettings) -> Dict[str, Any]:
+    """
+    Меняет уровень логирования без перезапуска сервиса.
+
+    Как и настройки профилирования, действует только в текущем процессе.
+    """
+    levels = dict(settings.loggers)
+    if settings.level is not None:
+        levels[""] = settings.level
+    try:
+        levels = {name: logging_manager.validate_level(level) for name, level in levels.items()}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    for name, level in levels.items():
+        logging_manager.set_level(level, name or None)
+    return dict(logging_manager.stats(), levels=logging_manager.levels())
+
+@router.get("/usage", dependencies=[Depends(require_admin)])
+async def get_usage(
+    limit: int = Query(100, ge=1, le=10000, description="Сколько пользователей с наибольшим расходом вернуть")
+) -> Dict[str, Any]:
+    """
+    Возвращает счетчики токенов, включая пользователей с наибольшим расходом.
+
+    Рейтинг содержит реальные user_id, поэтому доступен только администратору.
+    """
+    return {
+        "totals": token_usage.totals,
+        "endpoints": token_usage.endpoints,
+        "users": token_usage.top_users(limit)
+    }
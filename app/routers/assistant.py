@@ -1,38 +1,65 @@
 from fastapi import APIRouter, Query, HTTPException, Depends, Body
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Optional, Dict, Any, List
-import traceback
+import logging
 import time
 
 from app.services.assistant import assistant_service
+from app.services.conversations import conversation_store
+from app.services.sessions import upstream_sessions
 from app.utils.auth import token_manager
+from app.utils.cache import CACHE_USE
+from app.utils.profiling import profile_request
+from app.utils.resilience import CircuitOpenError
+from app.utils.tokens import PromptTooLargeError
+from app.utils.sse import sse_response
+
+# Описание параметра режима кэша
+CACHE_FIELD_DESCRIPTION = "Режим кэша: use (использовать), bypass (не использовать), refresh (обновить запись)"
+CACHE_MODE_PATTERN = "^(use|bypass|refresh)$"
+
+logger = logging.getLogger("assistant_api")
 
 # Создаем роутер
-router = APIRouter(prefix="/api/assistant", tags=["assistant"])
+router = APIRouter(prefix="/api/assistant", tags=["assistant"], dependencies=[Depends(profile_request)])
 
 # Модели данных
 class AssistantRequest(BaseModel):
     """Модель запроса к ассистенту"""
     query: str = Field(..., description="Вопрос пользователя")
     context: Optional[str] = Field(None, description="Контекст взаимодействия (страница, раздел сайта)")
-    user_id: Optional[str] = Field(None, description="Идентификатор пользователя для персонализации")
+    user_id: Optional[str] = Field(None, description="Идентификатор пользователя: по нему хранится история диалога")
+    cache: str = Field(CACHE_USE, description=CACHE_FIELD_DESCRIPTION, pattern=CACHE_MODE_PATTERN)
 
 class AssistantResponse(BaseModel):
     """Модель ответа ассистента"""
     answer: str = Field(..., description="Ответ ассистента")
     user_query: str = Field(..., description="Исходный вопрос пользователя")
     context: Optional[str] = Field(None, description="Контекст взаимодействия")
+    cached: bool = Field(False, description="Ответ получен из кэша")
+    similarity: Optional[float] = Field(None, description="Похожесть на ранее заданный вопрос (ответ из семантического кэша)")
+    matched_query: Optional[str] = Field(None, description="Ранее заданный вопрос, ответ на который был возвращен")
 
 class SearchRequest(BaseModel):
     """Модель запроса поиска информации"""
     query: str = Field(..., description="Поисковый запрос")
 
+class SearchMatch(BaseModel):
+    """Модель найденного раздела документации"""
+    title: str = Field(..., description="Заголовок раздела с путем от корня документа")
+    source: str = Field(..., description="Файл базы знаний")
+    score: float = Field(..., description="Итоговая оценка релевантности")
+    bm25: Optional[float] = Field(None, description="Оценка BM25 по ключевым словам")
+    similarity: Optional[float] = Field(None, description="Косинусная близость эмбеддингов")
+    text: str = Field(..., description="Текст раздела")
+
 class SearchResponse(BaseModel):
     """Модель ответа с результатами поиска"""
     query: str = Field(..., description="Исходный поисковый запрос")
     result: str = Field(..., description="Результат поиска")
     relevant_sections: List[str] = Field([], description="Релевантные разделы платформы")
+    matches: List[SearchMatch] = Field([], description="Найденные разделы по убыванию релевантности")
 
 # Базовый эндпоинт для получения ответа от ассистента
 @router.post("/ask", response_model=AssistantResponse)
@@ -50,20 +77,28 @@ async def ask_assistant(
     """
     try:
         # Вызываем сервис для получения ответа
-        answer = await assistant_service.get_answer(
+        result = await assistant_service.get_answer_detailed(
             query=request.query,
             context=request.context,
-            user_id=request.user_id
+            user_id=request.user_id,
+            cache_mode=request.cache
         )
         
         # Формируем и возвращаем ответ
         return AssistantResponse(
-            answer=answer,
+            answer=result["answer"],
             user_query=request.query,
-            context=request.context
+            context=request.context,
+            cached=result["cached"],
+            similarity=result.get("similarity"),
+            matched_query=result.get("matched_query")
         )
+    except PromptTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers=e.headers)
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("Ошибка обработки запроса к ассистенту")
         raise HTTPException(status_code=500, detail=f"Ошибка обработки запроса к ассистенту: {str(e)}")
 
 # Альтернативный GET эндпоинт для более простых запросов
@@ -71,7 +106,8 @@ async def ask_assistant(
 async def ask_assistant_get(
     query: str = Query(..., description="Вопрос пользователя"),
     context: Optional[str] = Query(None, description="Контекст взаимодействия"),
-    user_id: Optional[str] = Query(None, description="Идентификатор пользователя")
+    user_id: Optional[str] = Query(None, description="Идентификатор пользователя"),
+    cache: str = Query(CACHE_USE, description=CACHE_FIELD_DESCRIPTION, pattern=CACHE_MODE_PATTERN)
 ) -> AssistantResponse:
     """
     GET-версия эндпоинта для получения ответа от ассистента.
@@ -80,28 +116,90 @@ async def ask_assistant_get(
         query: Вопрос пользователя
         context: Контекст взаимодействия
         user_id: Идентификатор пользователя
+        cache: Режим кэша
     
     Returns:
         Ответ ассистента
     """
     try:
         # Вызываем сервис для получения ответа
-        answer = await assistant_service.get_answer(
+        result = await assistant_service.get_answer_detailed(
             query=query,
             context=context,
-            user_id=user_id
+            user_id=user_id,
+            cache_mode=cache
         )
         
         # Формируем и возвращаем ответ
         return AssistantResponse(
-            answer=answer,
+            answer=result["answer"],
             user_query=query,
-            context=context
+            context=context,
+            cached=result["cached"],
+            similarity=result.get("similarity"),
+            matched_query=result.get("matched_query")
         )
+    except PromptTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers=e.headers)
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("Ошибка обработки запроса к ассистенту")
         raise HTTPException(status_code=500, detail=f"Ошибка обработки запроса к ассистенту: {str(e)}")
 
+# Потоковый эндпоинт ответа ассистента (Server-Sent Events)
+@router.post("/ask/stream")
+async def ask_assistant_stream(
+    request: AssistantRequest
+) -> StreamingResponse:
+    """
+    Получает ответ ассистента, передавая его по частям по мере генерации (text/event-stream).
+    
+    События:
+        chunk: очередной фрагмент ответа
+        replace: ответ целиком заменен (сработал фильтр внешних сервисов),
+            клиент должен показать текст этого события вместо полученных фрагментов
+        done: итоговое событие с полным ответом и временем генерации
+        error: ошибка во время генерации
+    """
+    # Промпт и выключатель проверяются до начала ответа: 413 и 503 вместо события error
+    try:
+        events = await assistant_service.stream_answer(
+            query=request.query,
+            context=request.context,
+            user_id=request.user_id,
+            cache_mode=request.cache
+        )
+    except PromptTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers=e.headers)
+    return sse_response(events)
+
+# GET-версия потокового эндпоинта (для EventSource в браузере)
+@router.get("/ask/stream")
+async def ask_assistant_stream_get(
+    query: str = Query(..., description="Вопрос пользователя"),
+    context: Optional[str] = Query(None, description="Контекст взаимодействия"),
+    user_id: Optional[str] = Query(None, description="Идентификатор пользователя"),
+    cache: str = Query(CACHE_USE, description=CACHE_FIELD_DESCRIPTION, pattern=CACHE_MODE_PATTERN)
+) -> StreamingResponse:
+    """
+    GET-версия потокового эндпоинта ассистента. События те же, что у POST /api/assistant/ask/stream.
+    """
+    try:
+        events = await assistant_service.stream_answer(
+            query=query,
+            context=context,
+            user_id=user_id,
+            cache_mode=cache
+        )
+    except PromptTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers=e.headers)
+    return sse_response(events)
+
 # Эндпоинт для поиска информации по платформе
 @router.post("/search", response_model=SearchResponse)
 async def search_info(
@@ -124,10 +222,11 @@ async def search_info(
         return SearchResponse(
             query=request.query,
             result=search_results["result"],
-            relevant_sections=search_results["relevant_sections"]
+            relevant_sections=search_results["relevant_sections"],
+            matches=search_results["matches"]
         )
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("Ошибка поиска информации")
         raise HTTPException(status_code=500, detail=f"Ошибка поиска информации: {str(e)}")
 
 # Альтернативный GET эндпоинт для поиска
@@ -152,12 +251,33 @@ async def search_info_get(
         return SearchResponse(
             query=query,
             result=search_results["result"],
-            relevant_sections=search_results["relevant_sections"]
+            relevant_sections=search_results["relevant_sections"],
+            matches=search_results["matches"]
         )
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("Ошибка поиска информации")
         raise HTTPException(status_code=500, detail=f"Ошибка поиска информации: {str(e)}")
 
+# Эндпоинт для сброса истории диалога
+@router.delete("/conversations/{user_id}")
+async def clear_conversation(user_id: str):
+    """
+    Забывает историю диалога пользователя: следующий вопрос будет задан без предыдущих реплик.
+    
+    Args:
+        user_id: Идентификатор пользователя
+    
+    Returns:
+        Статус операции
+    """
+    try:
+        await conversation_store.clear(user_id)
+        upstream_sessions.forget(user_id)
+        return {"status": "success", "user_id": user_id}
+    except Exception as e:
+        logger.exception("Ошибка сброса истории диалога")
+        raise HTTPException(status_code=500, detail=f"Ошибка сброса истории диалога: {str(e)}")
+
 # Эндпоинт для обновления токена доступа
 @router.post("/refresh-token")
 async def refresh_auth_token():
@@ -172,7 +292,7 @@ async def refresh_auth_token():
         await token_manager.refresh_token()
         return {"status": "success", "message": "Токен успешно обновлен"}
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("Ошибка обновления токена")
         raise HTTPException(status_code=500, detail=f"Ошибка обновления токена: {str(e)}")
 
 # Эндпоинт для проверки работоспособности сервиса
@@ -186,13 +306,13 @@ async def health_check():
     """
     try:
         # Проверяем, есть ли токен и не истек ли он
-        token_status = "active" if token_manager.access_token and token_manager.token_expires_at > time.time() else "expired"
+        token_status = "active" if token_manager.is_valid() else "expired"
         
         return {
             "status": "ok",
             "token_status": token_status,
-            "expires_in": int(token_manager.token_expires_at - time.time()) if token_manager.token_expires_at else None
+            "expires_in": token_manager.expires_in()
         }
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("Ошибка проверки состояния")
         raise HTTPException(status_code=500, detail=f"Ошибка проверки состояния: {str(e)}") 
\ No newline at end of file
@@ -0,0 +1,77 @@
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any, List
+import logging
+
+from app.config import jobs_config
+from app.routers.text_enhancer import BatchItem, CACHE_QUERY_DESCRIPTION, CACHE_MODE_PATTERN
+from app.services.jobs import job_service, CallbackURLError
+from app.utils.cache import CACHE_USE
+
+logger = logging.getLogger("jobs_api")
+
+# Создаем роутер
+router = APIRouter(prefix="/api/jobs", tags=["jobs"])
+
+# Модели данных
+class JobRequest(BaseModel):
+    """Модель запроса на создание фонового задания"""
+    items: List[BatchItem] = Field(..., min_length=1, description="Элементы для улучшения")
+    callback_url: Optional[str] = Field(None, description="Адрес для POST-уведомления о завершении задания")
+    cache: str = Field(CACHE_USE, description=CACHE_QUERY_DESCRIPTION, pattern=CACHE_MODE_PATTERN)
+
+class JobResponse(BaseModel):
+    """Модель состояния фонового задания"""
+    id: str = Field(..., description="Идентификатор задания")
+    status: str = Field(..., description="Статус: pending, running, done, failed")
+    total: int = Field(..., description="Количество элементов")
+    completed: int = Field(..., description="Количество обработанных элементов")
+    result: Optional[List[Dict[str, Any]]] = Field(None, description="Результаты по элементам (для завершенного задания)")
+    error: Optional[str] = Field(None, description="Ошибка выполнения задания")
+    callback_url: Optional[str] = Field(None, description="Адрес уведомления о завершении")
+    callback_status: Optional[str] = Field(None, description="Статус отправки уведомления: delivered, failed")
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+# Создание фонового задания
+@router.post("", response_model=JobResponse, status_code=202)
+async def submit_job(
+    request: JobRequest
+) -> JobResponse:
+    """
+    Ставит пакет текстов в очередь на улучшение и сразу возвращает идентификатор задания.
+
+    Статус задания доступен по GET /api/jobs/{id}. Если указан callback_url,
+    по завершении на него будет отправлен POST-запрос с заданием.
+    """
+    if len(request.items) > jobs_config.max_items:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Слишком много элементов в задании: {len(request.items)} (максимум {jobs_config.max_items})"
+        )
+    try:
+        job = await job_service.submit(
+            [item.model_dump() for item in request.items],
+            callback_url=request.callback_url,
+            cache_mode=request.cache
+        )
+        return JobResponse(**job)
+    except CallbackURLError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception("Ошибка создания задания")
+        raise HTTPException(status_code=500, detail=f"Ошибка создания задания: {str(e)}")
+
+# Получение состояния задания
+@router.get("/{job_id}", response_model=JobResponse)
+async def get_job(
+    job_id: str
+) -> JobResponse:
+    """
+    Возвращает статус, прогресс и результат фонового задания.
+    """
+    job = await job_service.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return JobResponse(**job)
@@ -1,45 +1,99 @@
-from fastapi import APIRouter, Query, HTTPException, Depends
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
-import traceback
+from fastapi import APIRouter, Query, HTTPException, Depends, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any, List
+import json
+import logging
 
+from app.config import batch_config, long_text_config
 from app.services.gigachat import gigachat_service
+from app.utils.cache import CACHE_USE
+from app.utils.chunking import iter_text_chunks, BodyTooLargeError
+from app.utils.profiling import profile_request
+from app.utils.resilience import CircuitOpenError
+from app.utils.tokens import PromptTooLargeError
+from app.utils.sse import sse_response
+
+# Описание параметра режима кэша для всех эндпоинтов
+CACHE_QUERY_DESCRIPTION = "Режим кэша: use (использовать), bypass (не использовать), refresh (обновить запись)"
+CACHE_MODE_PATTERN = "^(use|bypass|refresh)$"
+
+logger = logging.getLogger("text_enhancer")
 
 # Создаем роутер
-router = APIRouter(prefix="/api", tags=["text-enhancement"])
+router = APIRouter(prefix="/api", tags=["text-enhancement"], dependencies=[Depends(profile_request)])
 
 # Модели данных
 class EnhancedTextResponse(BaseModel):
     """Модель ответа с улучшенным текстом"""
     original_text: str
     enhanced_text: str
+    cached: bool = False
+
+class LongTextChunk(BaseModel):
+    """Сведения об обработке одной части длинного текста"""
+    index: int = Field(..., description="Номер части")
+    chars: int = Field(..., description="Размер части в символах")
+    started_at: float = Field(..., description="Начало обработки части от начала запроса (секунды)")
+    duration: float = Field(..., description="Время обработки части (секунды)")
+    cached: bool = Field(False, description="Ответ для части получен из кэша")
+    error: Optional[str] = Field(None, description="Ошибка; вместо улучшенной части оставлен исходный текст")
+
+class LongTextResponse(BaseModel):
+    """Модель ответа с улучшенным длинным текстом"""
+    enhanced_text: str
+    chunks: List[LongTextChunk] = Field([], description="Части текста в исходном порядке")
+    consistency_pass: Dict[str, Any] = Field({}, description="Итоговый проход, согласующий стиль частей")
+    duration: float = Field(..., description="Общее время обработки (секунды)")
+
+class BatchItem(BaseModel):
+    """Элемент пакетного запроса"""
+    id: Optional[str] = Field(None, description="Идентификатор элемента на стороне клиента")
+    text: str = Field(..., description="Текст (или описание компании) для улучшения")
+    style: Optional[str] = Field(None, description="Стиль текста")
+    length: Optional[str] = Field(None, description="Желаемая длина результата")
+    industry: Optional[str] = Field(None, description="Отрасль компании")
+    target_audience: Optional[str] = Field(None, description="Целевая аудитория")
+    unique_features: Optional[str] = Field(None, description="Уникальные особенности компании")
+
+class BatchRequest(BaseModel):
+    """Модель пакетного запроса на улучшение текстов"""
+    items: List[BatchItem] = Field(..., min_length=1, description="Элементы для улучшения")
+    concurrency: Optional[int] = Field(None, ge=1, description="Число одновременных запросов к GigaChat")
+    cache: str = Field(CACHE_USE, description=CACHE_QUERY_DESCRIPTION, pattern=CACHE_MODE_PATTERN)
 
 # Базовый эндпоинт для улучшения текста
 @router.get("/enhance", response_model=EnhancedTextResponse)
 async def enhance_text(
-    text: str = Query(..., description="Текст для улучшения")
+    text: str = Query(..., description="Текст для улучшения"),
+    cache: str = Query(CACHE_USE, description=CACHE_QUERY_DESCRIPTION, pattern=CACHE_MODE_PATTERN)
 ) -> EnhancedTextResponse:
     """
     Улучшает текст, делая его более красочным, грамотным и продающим.
     
     Args:
         text: Исходный текст для улучшения
+        cache: Режим кэша
     
     Returns:
         Исходный и улучшенный тексты
     """
     try:
         # Вызываем сервис для улучшения текста
-        enhanced_text = await gigachat_service.enhance_text(text)
+        result = await gigachat_service.enhance_text_detailed(text, cache_mode=cache)
         
         # Формируем и возвращаем ответ
         return EnhancedTextResponse(
             original_text=text,
-            enhanced_text=enhanced_text
+            enhanced_text=result["text"],
+            cached=result["cached"]
         )
+    except PromptTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers=e.headers)
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("Ошибка обработки текста")
         raise HTTPException(status_code=500, detail=f"Ошибка обработки текста: {str(e)}")
 
 # Расширенный эндпоинт с дополнительными параметрами
@@ -47,7 +101,8 @@ async def enhance_text(
 async def enhance_text_advanced(
     text: str = Query(..., description="Текст для улучшения"),
     style: Optional[str] = Query(None, description="Стиль текста (продающий, информационный, эмоциональный и т.д.)"),
-    length: Optional[str] = Query(None, description="Желаемая длина результата (короткий, средний, длинный)")
+    length: Optional[str] = Query(None, description="Желаемая длина результата (короткий, средний, длинный)"),
+    cache: str = Query(CACHE_USE, description=CACHE_QUERY_DESCRIPTION, pattern=CACHE_MODE_PATTERN)
 ) -> EnhancedTextResponse:
     """
     Улучшает текст с дополнительными настройками стиля и длины.
@@ -56,21 +111,27 @@ async def enhance_text_advanced(
         text: Исходный текст для улучшения
         style: Стиль текста (продающий, информационный, эмоциональный и т.д.)
         length: Желаемая длина результата (короткий, средний, длинный)
+        cache: Режим кэша
     
     Returns:
         Исходный и улучшенный тексты
     """
     try:
         # Вызываем сервис для улучшения текста с дополнительными параметрами
-        enhanced_text = await gigachat_service.enhance_text(text, style, length)
+        result = await gigachat_service.enhance_text_detailed(text, style, length, cache_mode=cache)
         
         # Формируем и возвращаем ответ
         return EnhancedTextResponse(
             original_text=text,
-            enhanced_text=enhanced_text
+            enhanced_text=result["text"],
+            cached=result["cached"]
         )
+    except PromptTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers=e.headers)
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("Ошибка обработки текста")
         raise HTTPException(status_code=500, detail=f"Ошибка обработки текста: {str(e)}")
 
 # Эндпоинт для улучшения описаний компаний
@@ -79,7 +140,8 @@ async def enhance_company_description(
     text: str = Query(..., description="Описание компании для улучшения"),
     industry: Optional[str] = Query(None, description="Отрасль компании"),
     target_audience: Optional[str] = Query(None, description="Целевая аудитория"),
-    unique_features: Optional[str] = Query(None, description="Уникальные особенности компании")
+    unique_features: Optional[str] = Query(None, description="Уникальные особенности компании"),
+    cache: str = Query(CACHE_USE, description=CACHE_QUERY_DESCRIPTION, pattern=CACHE_MODE_PATTERN)
 ) -> EnhancedTextResponse:
     """
     Улучшает описание компании, делая его более привлекательным и информативным.
@@ -89,31 +151,144 @@ async def enhance_company_description(
         industry: Отрасль компании
         target_audience: Целевая аудитория
         unique_features: Уникальные особенности компании
+        cache: Режим кэша
     
     Returns:
         Исходное и улучшенное описание компании
     """
     try:
         # Формируем промпт с учетом специфики компании
-        prompt = "Улучши описание компании, сделав его более привлекательным и информативным. "
-        
-        if industry:
-            prompt += f"\nОтрасль: {industry}"
-        if target_audience:
-            prompt += f"\nЦелевая аудитория: {target_audience}"
-        if unique_features:
-            prompt += f"\nУникальные особенности: {unique_features}"
-            
-        prompt += f"\n\nИсходное описание: \"{text}\"\n\nУлучшенное описание:"
+        prompt = gigachat_service.build_company_prompt(text, industry, target_audience, unique_features)
         
         # Вызываем сервис для улучшения текста
-        enhanced_text = await gigachat_service.enhance_text(prompt)
+        result = await gigachat_service.enhance_text_detailed(prompt, cache_mode=cache)
         
         # Формируем и возвращаем ответ
         return EnhancedTextResponse(
             original_text=text,
-            enhanced_text=enhanced_text
+            enhanced_text=result["text"],
+            cached=result["cached"]
         )
+    except PromptTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers=e.headers)
     except Exception as e:
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Ошибка обработки описания компании: {str(e)}") 
\ No newline at end of file
+        logger.exception("Ошибка обработки описания компании")
+        raise HTTPException(status_code=500, detail=f"Ошибка обработки описания компании: {str(e)}")
+
+# Потоковый эндпоинт улучшения текста (Server-Sent Events)
+@router.get("/enhance/stream")
+async def enhance_text_stream(
+    text: str = Query(..., description="Текст для улучшения"),
+    style: Optional[str] = Query(None, description="Стиль текста (продающий, информационный, эмоциональный и т.д.)"),
+    length: Optional[str] = Query(None, description="Желаемая длина результата (короткий, средний, длинный)"),
+    cache: str = Query(CACHE_USE, description=CACHE_QUERY_DESCRIPTION, pattern=CACHE_MODE_PATTERN)
+) -> StreamingResponse:
+    """
+    Улучшает текст, передавая ответ по частям по мере генерации (text/event-stream).
+    
+    События:
+        chunk: очередной фрагмент улучшенного текста
+        done: итоговое событие с полным текстом и временем генерации
+        error: ошибка во время генерации
+    """
+    # Промпт и выключатель проверяются до начала ответа: 413 и 503 вместо события error
+    try:
+        prompt = gigachat_service.build_prompt(text, style, length)
+        events = await gigachat_service.stream_enhance_text(prompt, cache_mode=cache)
+    except PromptTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers=e.headers)
+    return sse_response(events)
+
+# Потоковый эндпоинт улучшения описаний компаний
+@router.get("/enhance/company/stream")
+async def enhance_company_description_stream(
+    text: str = Query(..., description="Описание компании для улучшения"),
+    industry: Optional[str] = Query(None, description="Отрасль компании"),
+    target_audience: Optional[str] = Query(None, description="Целевая аудитория"),
+    unique_features: Optional[str] = Query(None, description="Уникальные особенности компании"),
+    cache: str = Query(CACHE_USE, description=CACHE_QUERY_DESCRIPTION, pattern=CACHE_MODE_PATTERN)
+) -> StreamingResponse:
+    """
+    Улучшает описание компании в потоковом режиме (text/event-stream).
+    
+    События те же, что у /api/enhance/stream.
+    """
+    try:
+        prompt = gigachat_service.build_prompt(
+            gigachat_service.build_company_prompt(text, industry, target_audience, unique_features)
+        )
+        events = await gigachat_service.stream_enhance_text(prompt, cache_mode=cache)
+    except PromptTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers=e.headers)
+    return sse_response(events)
+
+# Улучшение длинного текста по частям
+@router.post("/enhance/long", response_model=LongTextResponse)
+async def enhance_long_text(
+    request: Request,
+    style: Optional[str] = Query(None, description="Стиль текста (продающий, информационный, эмоциональный и т.д.)"),
+    length: Optional[str] = Query(None, description="Желаемая длина результата (короткий, средний, длинный)"),
+    concurrency: Optional[int] = Query(None, ge=1, description="Число одновременных запросов к GigaChat"),
+    cache: str = Query(CACHE_USE, description=CACHE_QUERY_DESCRIPTION, pattern=CACHE_MODE_PATTERN)
+) -> LongTextResponse:
+    """
+    Улучшает длинный текст (каталог, профиль компании), переданный в теле запроса как text/plain (UTF-8).
+    
+    Текст делится на части по абзацам и предложениям, части улучшаются
+    параллельно по мере загрузки тела и склеиваются в исходном порядке,
+    после чего итоговый проход согласует их стиль. Ответ содержит время
+    обработки каждой части.
+    """
+    concurrency = min(concurrency or long_text_config.concurrency, long_text_config.max_concurrency)
+    chunks = iter_text_chunks(request.stream(), long_text_config.chunk_chars, long_text_config.max_bytes)
+    try:
+        result = await gigachat_service.enhance_long_text(chunks, style, length, concurrency, cache_mode=cache)
+    except BodyTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers=e.headers)
+    except Exception as e:
+        logger.exception("Ошибка обработки длинного текста")
+        raise HTTPException(status_code=500, detail=f"Ошибка обработки длинного текста: {str(e)}")
+    if not result["chunks"]:
+        raise HTTPException(status_code=422, detail="Текст для улучшения не передан")
+    return LongTextResponse(
+        enhanced_text=result["text"],
+        chunks=result["chunks"],
+        consistency_pass=result["consistency_pass"],
+        duration=result["duration"]
+    )
+
+# Пакетное улучшение текстов
+@router.post("/enhance/batch")
+async def enhance_batch(
+    request: BatchRequest
+) -> StreamingResponse:
+    """
+    Улучшает пакет текстов. Элементы обрабатываются параллельно (не более
+    concurrency одновременных запросов), одинаковые элементы отправляются
+    в GigaChat один раз.
+    
+    Результаты возвращаются в формате NDJSON (по одному JSON-объекту на строку)
+    в порядке завершения. Каждая строка содержит index и id элемента и либо
+    enhanced_text, либо error - ошибка одного элемента не прерывает пакет.
+    """
+    if len(request.items) > batch_config.max_items:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Слишком много элементов в пакете: {len(request.items)} (максимум {batch_config.max_items})"
+        )
+    concurrency = min(request.concurrency or batch_config.concurrency, batch_config.max_concurrency)
+    items = [item.model_dump() for item in request.items]
+
+    async def lines():
+        async for result in gigachat_service.enhance_batch(items, concurrency, cache_mode=request.cache):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -1,11 +1,72 @@
-import httpx
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, AsyncIterator
 import json
-import os
-import traceback
+import time
+import logging
 
-from app.config import gigachat_config, assistant_config
-from app.utils.auth import token_manager
+from app.config import assistant_config, conversation_config
+from app.services.conversations import conversation_store, Turn
+from app.services.knowledge import knowledge_base
+from app.services.prompt_assets import prompt_assets
+from app.services.sessions import upstream_sessions
+from app.services.upstream import gigachat_upstream
+from app.utils.cache import response_cache, make_cache_key, normalize_prompt, CACHE_USE, CACHE_BYPASS
+from app.utils.coalesce import request_coalescer
+from app.utils.limiter import priority_lane, PRIORITY_INTERACTIVE
+from app.utils.resilience import upstream_breaker, CircuitOpenError
+from app.utils.semantic_cache import semantic_cache
+from app.utils.tokens import token_counter, PromptTooLargeError
+from app.utils.usage import set_usage_user
+
+logger = logging.getLogger("assistant")
+
+# Ответ, который возвращается, если API не вернул ни одного варианта
+EMPTY_RESPONSE_MESSAGE = "Не удалось получить ответ от ассистента."
+
+# Результат поиска, если в документации нет подходящих разделов
+NOT_FOUND_MESSAGE = "По вашему запросу ничего не найдено."
+
+# Ответ вместо сообщений с информацией о внешних сервисах
+FALLBACK_ANSWER = "По этому вопросу лучше обратиться к нашему менеджеру в Telegram: @isayalotof"
+UNWANTED_TERMS = ["фнс", "налоговой", "госуслуги", "мфц", "документац", "github"]
+
+class UnwantedTermsFilter:
+    """
+    Фильтр нежелательных терминов для потокового ответа
+
+    Последние len(самого длинного термина) - 1 символов придерживаются до
+    прихода следующего фрагмента, поэтому клиенту никогда не уходит начало
+    термина, разорванного между фрагментами. При срабатывании весь ответ
+    заменяется на FALLBACK_ANSWER.
+    """
+
+    def __init__(self, terms: List[str] = UNWANTED_TERMS):
+        self.terms = terms
+        self.holdback = max(len(term) for term in terms) - 1
+        self.text = ""
+        self.emitted = 0
+        self.triggered = False
+
+    def feed(self, chunk: str) -> str:
+        """Добавляет фрагмент и возвращает часть текста, которую можно отправить клиенту"""
+        if self.triggered:
+            return ""
+        self.text += chunk
+        lowered = self.text.lower()
+        if any(term in lowered for term in self.terms):
+            self.triggered = True
+            return ""
+        safe_end = max(self.emitted, len(self.text) - self.holdback)
+        released = self.text[self.emitted:safe_end]
+        self.emitted = safe_end
+        return released
+
+    def flush(self) -> str:
+        """Возвращает придержанный остаток в конце потока"""
+        if self.triggered:
+            return ""
+        released = self.text[self.emitted:]
+        self.emitted = len(self.text)
+        return released
 
 class AssistantService:
     """Сервис для работы с ассистентом на базе GigaChat API"""
@@ -13,143 +74,297 @@ class AssistantService:
     async def get_answer(self, 
                         query: str, 
                         context: Optional[str] = None, 
-                        user_id: Optional[str] = None) -> str:
+                        user_id: Optional[str] = None,
+                        cache_mode: str = CACHE_USE) -> str:
         """
         Получает ответ от ассистента на вопрос пользователя
         
         Args:
             query: Вопрос пользователя
             context: Контекст взаимодействия (откуда задан вопрос, текущая страница)
-            user_id: Идентификатор пользователя для персонализации
+            user_id: Идентификатор пользователя; по нему хранится история диалога
+            cache_mode: Режим кэша (use, bypass, refresh)
             
         Returns:
             Ответ ассистента
         """
+        result = await self.get_answer_detailed(query, context, user_id, cache_mode)
+        return result["answer"]
+
+    async def get_answer_detailed(self, 
+                                  query: str, 
+                                  context: Optional[str] = None, 
+                                  user_id: Optional[str] = None,
+                                  cache_mode: str = CACHE_USE) -> Dict[str, Any]:
+        """
+        Получает ответ ассистента и сообщает, был ли он взят из кэша
+        
+        Returns:
+            Словарь с ключами answer (ответ ассистента), cached (ответ из кэша),
+            а для ответа из семантического кэша - similarity и matched_query
+        """
+        set_usage_user(user_id)
         try:
+            turns = await conversation_store.history(user_id)
+            # Похожий вопрос на той же странице уже задавали - промпт не нужен.
+            # Ответ в середине диалога зависит от истории, поэтому там семантический кэш не используется
+            namespace = self._semantic_namespace(context)
+            if cache_mode == CACHE_USE and not turns:
+                hit = semantic_cache.lookup(query, namespace, prompt_assets.version)
+                if hit is not None:
+                    await self._remember(user_id, query, hit.answer)
+                    return {
+                        "answer": hit.answer,
+                        "cached": True,
+                        "similarity": hit.similarity,
+                        "matched_query": hit.question
+                    }
+
             # Формируем промпт в зависимости от переданных параметров
-            messages = self._build_prompt(query, context)
+            messages = await self._build_prompt(query, context, turns)
+            cache_key = self._cache_key(messages)
+
+            if cache_mode == CACHE_USE:
+                cached = await response_cache.get(cache_key)
+                if cached is not None:
+                    await self._remember(user_id, query, cached)
+                    return {"answer": cached, "cached": True}
             
-            # Получаем ответ от API
-            response = await self._send_chat_request(messages)
+            # Сессия GigaChat пользователя: API не обрабатывает заново закэшированное начало промпта
+            session_id = upstream_sessions.session_id(user_id, prompt_assets.version)
+
+            async def fetch() -> str:
+                # Получаем ответ от API и сохраняем его в кэш
+                response = await self._send_chat_request(messages, session_id)
+                if cache_mode != CACHE_BYPASS and response != EMPTY_RESPONSE_MESSAGE:
+                    await response_cache.set(cache_key, response)
+                    if not turns:
+                        semantic_cache.store(query, namespace, prompt_assets.version, response)
+                return response
+
+            # Одинаковые одновременные вопросы ожидают один общий вызов API.
+            # Вопросы к ассистенту обслуживаются в приоритетной полосе
+            with priority_lane(PRIORITY_INTERACTIVE):
+                response = await request_coalescer.run(cache_key, fetch)
+            await self._remember(user_id, query, response)
             
             # Возвращаем ответ
-            return response
+            return {"answer": response, "cached": False}
+        except (PromptTooLargeError, CircuitOpenError):
+            raise
         except Exception as e:
-            traceback.print_exc()
+            logger.exception("Ошибка обработки запроса к ассистенту")
             raise Exception(f"Ошибка обработки запроса к ассистенту: {str(e)}")
     
-    def _build_prompt(self, query: str, context: Optional[str] = None) -> List[Dict[str, str]]:
-        """
-        Формирует промпт для GigaChat API на основе параметров
+    async def stream_answer(self, 
+                            query: str, 
+                            context: Optional[str] = None, 
+                            user_id: Optional[str] = None,
+                            cache_mode: str = CACHE_USE) -> AsyncIterator[Dict[str, Any]]:
         """
-        system_prompt = """Ты - полезный ассистент для веб-интерфейса бизнес-платформы.
-Твоя главная задача - максимально просто объяснять пользователям, как выполнить конкретные действия ТОЛЬКО В РАМКАХ НАШЕГО ВЕБ-ИНТЕРФЕЙСА.
-
-О НАШЕЙ ПЛАТФОРМЕ:
-Наша платформа помогает бизнесу найти клиентов. Каждый предприниматель может зарегистрировать свой бизнес в нашей системе, чтобы присоединиться к платформе и начать получать клиентов. Основная ценность - удобный поиск новых клиентов и продвижение услуг бизнеса.
-
-СТРОГИЕ ПРАВИЛА:
-1. ОТВЕЧАЙ ТОЛЬКО О ФУНКЦИЯХ НАШЕГО ВЕБ-ИНТЕРФЕЙСА. НИКОГДА не давай советы о внешних сервисах (например, ФНС, госуслуги и т.д.).
-2. Если вопрос не относится к функциям нашего сайта или ты не знаешь ответа, ВСЕГДА отвечай: "По этому вопросу лучше обратиться к нашему менеджеру в Telegram: @isayalotof"
-3. Всегда описывай, где именно находится элемент интерфейса (в каком углу, какого цвета)
-4. Давай только конкретные пошаговые инструкции по принципу "нажмите сюда → перейдите туда → увидите это"
-5. Давай короткие ответы - не более 5-7 шагов
-
-Примеры хороших ответов:
-- "Чтобы зарегистрировать свой бизнес: 1. Нажмите на синюю кнопку 'Регистрация бизнеса' в правом верхнем углу главной страницы. 2. Заполните форму с информацией о вашем бизнесе. 3. Загрузите логотип компании. 4. Нажмите зеленую кнопку 'Создать'."
-- "Для поиска клиентов: 1. Нажмите на вкладку 'Клиенты' в верхнем меню. 2. Используйте фильтры слева для уточнения параметров поиска. 3. Нажмите синюю кнопку 'Найти'."
-- "По этому вопросу лучше обратиться к нашему менеджеру в Telegram: @isayalotof"
-
-Основные модули интерфейса:
-1. Бизнес-модуль (для обычных пользователей):
-   - Раздел "Компании" - в верхнем меню, значок здания
-   - Раздел "Услуги" - в верхнем меню, значок календаря
-   - Раздел "Аналитика" - в верхнем меню, значок графика
-   - Раздел "Настройки" - в правом верхнем углу, значок шестеренки
-
-2. Административная панель (для администраторов):
-   - Раздел "Управление" - в левом меню, первый пункт
-   - Раздел "Пользователи" - в левом меню, значок людей
-   - Раздел "Логи" - в левом меню, значок списка
-   - Раздел "Настройки системы" - в левом меню, значок шестеренки
-"""
+        Получает ответ ассистента в потоковом режиме
         
-        # Если доступен файл с информацией о платформе, загружаем его содержимое
-        platform_info_path = assistant_config.platform_info
-        if os.path.exists(platform_info_path):
-            try:
-                with open(platform_info_path, 'r', encoding='utf-8') as file:
-                    platform_info = file.read()
-                    system_prompt += f"\n\nДополнительная информация о веб-интерфейсе:\n{platform_info[:4000]}"
-            except Exception as e:
-                print(f"Ошибка при чтении файла с информацией о платформе: {str(e)}")
+        История диалога и кэши проверяются, а промпт формируется до начала
+        ответа: PromptTooLargeError и CircuitOpenError (разомкнутый выключатель)
+        поднимаются здесь, и эндпоинт отвечает 413 или 503, а не событием error
+        в потоке.
         
-        # Если контекст задан, добавляем его в промпт
-        if context:
-            system_prompt += f"\nТекущая страница пользователя: {context}"
+        Returns:
+            Поток событий: chunk с фрагментами ответа, replace, если ответ
+            заменен фильтром нежелательных терминов, и итоговое событие done
+        """
+        started_at = time.monotonic()
+        set_usage_user(user_id)
+        turns = await conversation_store.history(user_id)
+        namespace = self._semantic_namespace(context)
+        if cache_mode == CACHE_USE and not turns:
+            hit = semantic_cache.lookup(query, namespace, prompt_assets.version)
+            if hit is not None:
+                return self._stream_cached(query, user_id, hit.answer, started_at, {
+                    "similarity": hit.similarity,
+                    "matched_query": hit.question
+                })
+
+        messages = await self._build_prompt(query, context, turns)
+        cache_key = self._cache_key(messages)
+        if cache_mode == CACHE_USE:
+            cached = await response_cache.get(cache_key)
+            if cached is not None:
+                return self._stream_cached(query, user_id, cached, started_at)
+        # Разомкнутый выключатель - ответ 503 с Retry-After до начала потока
+        upstream_breaker.check()
+        return self._stream_generation(query, user_id, turns, namespace, messages, cache_key, cache_mode, started_at)
+
+    async def _stream_cached(self,
+                             query: str,
+                             user_id: Optional[str],
+                             answer: str,
+                             started_at: float,
+                             extra: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+        await self._remember(user_id, query, answer)
+        yield {"event": "chunk", "data": {"text": answer}}
+        yield {"event": "done", "data": {
+            "answer": answer,
+            "cached": True,
+            "filtered": False,
+            **(extra or {}),
+            "chunks": 1,
+            "duration": round(time.monotonic() - started_at, 4)
+        }}
+
+    async def _stream_generation(self,
+                                 query: str,
+                                 user_id: Optional[str],
+                                 turns: List[Turn],
+                                 namespace: str,
+                                 messages: List[Dict[str, str]],
+                                 cache_key: str,
+                                 cache_mode: str,
+                                 started_at: float) -> AsyncIterator[Dict[str, Any]]:
+        """Поток событий ответа модели на готовый промпт"""
+        terms_filter = UnwantedTermsFilter()
+        chunks = 0
+        first_chunk_at: Optional[float] = None
+        usage = None
+        stream = gigachat_upstream.stream_chat_completions(
+            self._build_request_data(messages),
+            priority=PRIORITY_INTERACTIVE,
+            session_id=upstream_sessions.session_id(user_id, prompt_assets.version)
+        )
+        try:
+            async for chunk in stream:
+                usage = chunk.get("usage") or usage
+                delta = gigachat_upstream.extract_delta(chunk)
+                if not delta:
+                    continue
+                chunks += 1
+                if first_chunk_at is None:
+                    first_chunk_at = time.monotonic()
+                released = terms_filter.feed(delta)
+                if released:
+                    yield {"event": "chunk", "data": {"text": released}}
+                if terms_filter.triggered:
+                    # Ответ заменяется целиком - дальнейшая генерация не нужна
+                    break
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            raise Exception(f"Ошибка взаимодействия с GigaChat API: {str(e)}")
+        finally:
+            # Закрываем соединение с API, в том числе при досрочном выходе
+            await stream.aclose()
+        upstream_sessions.record_usage(usage)
+
+        if terms_filter.triggered:
+            answer = FALLBACK_ANSWER
+            yield {"event": "replace", "data": {"text": answer}}
+        else:
+            tail = terms_filter.flush()
+            if tail:
+                yield {"event": "chunk", "data": {"text": tail}}
+            answer = terms_filter.text.strip() or EMPTY_RESPONSE_MESSAGE
+
+        if cache_mode != CACHE_BYPASS and answer != EMPTY_RESPONSE_MESSAGE:
+            await response_cache.set(cache_key, answer)
+            if not turns:
+                semantic_cache.store(query, namespace, prompt_assets.version, answer)
+        await self._remember(user_id, query, answer)
+
+        yield {"event": "done", "data": {
+            "answer": answer,
+            "cached": False,
+            "filtered": terms_filter.triggered,
+            "chunks": chunks,
+            "time_to_first_chunk": round(first_chunk_at - started_at, 4) if first_chunk_at else None,
+            "duration": round(time.monotonic() - started_at, 4),
+            "usage": usage
+        }}
+
+    def _semantic_namespace(self, context: Optional[str]) -> str:
+        """Пространство имен семантического кэша: ответы зависят от страницы пользователя"""
+        return normalize_prompt(context or "").lower()
+
+    def _cache_key(self, messages: List[Dict[str, str]]) -> str:
+        """Ключ кэша: сообщения запроса и параметры генерации"""
+        return make_cache_key(
+            "assistant",
+            messages,
+            assistant_config.model,
+            assistant_config.temperature,
+            assistant_config.max_tokens
+        )
+
+    async def _remember(self, user_id: Optional[str], query: str, answer: str) -> None:
+        """Сохраняет реплику в историю диалога пользователя"""
+        if user_id and answer != EMPTY_RESPONSE_MESSAGE:
+            await conversation_store.append(user_id, query, answer)
+
+    async def _build_prompt(self,
+                            query: str,
+                            context: Optional[str] = None,
+                            turns: Optional[List[Turn]] = None) -> List[Dict[str, str]]:
+        """
+        Формирует промпт для GigaChat API на основе параметров
+
+        Предыдущие реплики диалога добавляются между системным промптом и
+        вопросом в пределах бюджета токенов; не поместившиеся старые реплики
+        кратко упоминаются в системном промпте. Если промпт целиком превышает
+        TOKENS_MAX_PROMPT, история отбрасывается, а затем сокращается вопрос.
+        """
+        # Добавляем только разделы документации, релевантные вопросу
+        platform_info = await knowledge_base.build_context(
+            f"{query} {context or ''}",
+            assistant_config.context_top_k,
+            assistant_config.context_max_chars
+        )
+        # Системный промпт загружен заранее, здесь только подставляются разделы и страница
+        system_prompt = prompt_assets.template.render(platform_info, context)
+        history = conversation_store.build_messages(turns or [], conversation_config.history_tokens)
+        if history["summary"]:
+            system_prompt += f"\n\n{history['summary']}"
         
         # Формируем сообщения для API
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": query}
-        ]
+        messages = [{"role": "system", "content": system_prompt}]
+        messages.extend(history["messages"])
+        messages.append({"role": "user", "content": query})
         
-        return messages
+        return token_counter.fit_messages(messages)
     
-    async def _send_chat_request(self, messages: List[Dict[str, str]]) -> str:
+    def _build_request_data(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """
+        Формирует тело запроса к /chat/completions
+        """
+        return {
+            "model": assistant_config.model,
+            "messages": messages,
+            "temperature": assistant_config.temperature,
+            "max_tokens": assistant_config.max_tokens
+        }
+
+    async def _send_chat_request(self, messages: List[Dict[str, str]], session_id: Optional[str] = None) -> str:
         """
         Отправляет запрос к GigaChat API и возвращает ответ
         """
+        request_data = self._build_request_data(messages)
+
         try:
-            # Получаем токен авторизации
-            auth_token = await token_manager.get_token()
-            
-            # Формируем запрос
-            request_data = {
-                "model": assistant_config.model,
-                "messages": messages,
-                "temperature": assistant_config.temperature,
-                "max_tokens": assistant_config.max_tokens
-            }
-            
-            # Отправляем запрос к API
-            async with httpx.AsyncClient(verify=False, timeout=60.0) as client:
-                response = await client.post(
-                    f"{gigachat_config.api_base_url}/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {auth_token}",
-                        "Content-Type": "application/json",
-                        "Accept": "application/json"
-                    },
-                    json=request_data
-                )
-                
-                response.raise_for_status()
-                response_data = response.json()
-                
-                # Извлекаем текст ответа
-                if response_data.get("choices") and len(response_data["choices"]) > 0:
-                    message = response_data["choices"][0].get("message", {})
-                    content = message.get("content", "").strip()
-                    
-                    # Проверяем, не содержит ли ответ информации о внешних сервисах
-                    unwanted_terms = ["фнс", "налоговой", "госуслуги", "мфц", "документац", "github"]
-                    if any(term in content.lower() for term in unwanted_terms):
-                        return "По этому вопросу лучше обратиться к нашему менеджеру в Telegram: @isayalotof"
-                    
-                    return content
-                    
-                return "Не удалось получить ответ от ассистента."
-                
-        except httpx.HTTPStatusError as e:
-            if e.response.status_code == 401:
-                # Если токен истек, пробуем обновить его и повторить запрос
-                await token_manager.refresh_token()
-                return await self._send_chat_request(messages)
-            else:
-                raise Exception(f"Ошибка взаимодействия с GigaChat API: {str(e)}")
+            response_data = await gigachat_upstream.chat_completions(request_data, session_id)
+        except CircuitOpenError:
+            raise
         except Exception as e:
             raise Exception(f"Ошибка взаимодействия с GigaChat API: {str(e)}")
+        upstream_sessions.record_usage(response_data.get("usage"))
+
+        # Извлекаем текст ответа
+        content = gigachat_upstream.extract_content(response_data)
+        if content is None:
+            return EMPTY_RESPONSE_MESSAGE
+
+        # Проверяем, не содержит ли ответ информации о внешних сервисах
+        if any(term in content.lower() for term in UNWANTED_TERMS):
+            return FALLBACK_ANSWER
+
+        return content
     
     async def search_platform_info(self, query: str) -> Dict[str, Any]:
         """
@@ -159,14 +374,16 @@ class AssistantService:
             query: Поисковый запрос
             
         Returns:
-            Словарь с результатами поиска
+            Словарь с результатами поиска: result (текст лучших разделов),
+            relevant_sections (заголовки разделов) и matches (разделы с оценками)
         """
-        # Здесь можно реализовать поиск по документации или базе знаний
-        # Пока возвращаем заглушку
+        matches = await knowledge_base.retrieve(query, assistant_config.search_top_k)
         return {
             "query": query,
-            "results": [],
-            "total": 0
+            "result": "\n\n".join(match["text"] for match in matches) or NOT_FOUND_MESSAGE,
+            "relevant_sections": [match["title"] for match in matches],
+            "matches": matches,
+            "total": len(matches)
         }
 
 # Глобальный экземпляр сервиса
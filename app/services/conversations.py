@@ -0,0 +1,283 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Any, Optional, List, NamedTuple, Deque
+import logging
+
+from app.config import conversation_config, ConversationConfig
+from app.utils.tokens import estimate_tokens
+
+logger = logging.getLogger("conversations")
+
+# Сколько символов вопроса оставлять в кратком изложении вытесненных реплик
+SUMMARY_QUESTION_CHARS = 120
+
+class Turn(NamedTuple):
+    """Одна реплика диалога: вопрос пользователя и ответ ассистента"""
+    question: str
+    answer: str
+    created_at: float
+
+    @property
+    def size(self) -> int:
+        return len(self.question.encode("utf-8")) + len(self.answer.encode("utf-8"))
+
+class _Conversation:
+    __slots__ = ("turns", "last_active", "size")
+
+    def __init__(self, max_turns: int):
+        self.turns: Deque[Turn] = deque(maxlen=max_turns)
+        self.last_active = time.time()
+        self.size = 0
+
+class ConversationDB:
+    """Сохранение реплик в локальном файле SQLite (общий для воркеров, переживает перезапуск)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS turns ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, "
+                "question TEXT NOT NULL, answer TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS turns_user ON turns (user_id, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS turns_created_at ON turns (created_at)")
+            self._conn = conn
+        return self._conn
+
+    def load(self, user_id: str, limit: int, since: float) -> List[Turn]:
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT question, answer, created_at FROM turns WHERE user_id = ? AND created_at > ? "
+                "ORDER BY id DESC LIMIT ?",
+                (user_id, since, limit)
+            ).fetchall()
+        return [Turn(*row) for row in reversed(rows)]
+
+    def append(self, user_id: str, turn: Turn, keep: int) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT INTO turns (user_id, question, answer, created_at) VALUES (?, ?, ?, ?)",
+                (user_id, turn.question, turn.answer, turn.created_at)
+            )
+            # Храним не больше keep последних реплик пользователя
+            conn.execute(
+                "DELETE FROM turns WHERE user_id = ? AND id NOT IN "
+                "(SELECT id FROM turns WHERE user_id = ? ORDER BY id DESC LIMIT ?)",
+                (user_id, user_id, keep)
+            )
+
+    def delete(self, user_id: str) -> None:
+        with self._lock:
+            self._connection().execute("DELETE FROM turns WHERE user_id = ?", (user_id,))
+
+    def purge(self, older_than: float) -> int:
+        """Удаляет реплики диалогов, неактивных с older_than (unix-время)"""
+        with self._lock:
+            cursor = self._connection().execute(
+                "DELETE FROM turns WHERE user_id IN "
+                "(SELECT user_id FROM turns GROUP BY user_id HAVING MAX(created_at) <= ?)",
+                (older_than,)
+            )
+            return cursor.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+class ConversationStore:
+    """
+    Память диалогов ассистента по user_id
+
+    Последние max_turns реплик каждого пользователя хранятся в памяти
+    процесса в LRU-структуре: число диалогов и их суммарный размер
+    ограничены, давно неактивные диалоги вытесняются первыми, а диалоги
+    без активности дольше ttl забываются. С CONVERSATION_STORE=sqlite
+    реплики также сохраняются в файл, и вытесненный из памяти диалог
+    подгружается обратно при следующем вопросе.
+    """
+
+    def __init__(self, config: ConversationConfig = conversation_config):
+        self.config = config
+        self.enabled = config.enabled
+        self.db = ConversationDB(config.store_path) if config.store == "sqlite" else None
+        self._conversations: "OrderedDict[str, _Conversation]" = OrderedDict()
+        self._bytes = 0
+
+        self.turns_total = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.db_errors = 0
+
+    async def history(self, user_id: Optional[str]) -> List[Turn]:
+        """Реплики диалога пользователя от старых к новым"""
+        if not self.enabled or not user_id:
+            return []
+        self._expire()
+        conversation = self._conversations.get(user_id)
+        if conversation is None and self.db is not None:
+            conversation = await self._load(user_id)
+        if conversation is None:
+            return []
+        self._conversations.move_to_end(user_id)
+        return list(conversation.turns)
+
+    async def append(self, user_id: Optional[str], question: str, answer: str) -> None:
+        """Добавляет реплику в диалог пользователя"""
+        if not self.enabled or not user_id:
+            return
+        limit = self.config.max_turn_chars
+        turn = Turn(question[:limit], answer[:limit], time.time())
+        conversation = self._conversations.get(user_id)
+        if conversation is None:
+            conversation = _Conversation(self.config.max_turns)
+            self._conversations[user_id] = conversation
+        if len(conversation.turns) == conversation.turns.maxlen:
+            dropped = conversation.turns[0]
+            conversation.size -= dropped.size
+            self._bytes -= dropped.size
+        conversation.turns.append(turn)
+        conversation.size += turn.size
+        conversation.last_active = turn.created_at
+        self._bytes += turn.size
+        self._conversations.move_to_end(user_id)
+        self.turns_total += 1
+        self._evict()
+
+        if self.db is not None:
+            try:
+                await asyncio.to_thread(self.db.append, user_id, turn, self.config.max_turns)
+            except Exception as e:
+                self.db_errors += 1
+                logger.warning("Не удалось сохранить реплику диалога: %s", e)
+
+    async def clear(self, user_id: str) -> None:
+        """Забывает диалог пользователя"""
+        self._discard(user_id)
+        if self.db is not None:
+            await asyncio.to_thread(self.db.delete, user_id)
+
+    def build_messages(self, turns: List[Turn], budget: int) -> Dict[str, Any]:
+        """
+        Собирает историю диалога в пределах бюджета токенов
+
+        Реплики добавляются от новых к старым, пока помещаются в бюджет.
+        Не поместившиеся старые реплики сворачиваются в краткое изложение
+        из начал вопросов, если на него хватает бюджета.
+
+        Returns:
+            Словарь messages (сообщения user/assistant от старых к новым),
+            summary (краткое изложение или пустая строка) и tokens (оценка размера)
+        """
+        messages: List[Dict[str, str]] = []
+        used = 0
+        included = 0
+        for turn in reversed(turns):
+            cost = estimate_tokens(turn.question) + estimate_tokens(turn.answer)
+            if used + cost > budget:
+                break
+            messages[:0] = [
+                {"role": "user", "content": turn.question},
+                {"role": "assistant", "content": turn.answer}
+            ]
+            used += cost
+            included += 1
+
+        summary = ""
+        older = turns[:len(turns) - included]
+        if older:
+            questions = [turn.question[:SUMMARY_QUESTION_CHARS] for turn in older]
+            summary = "Ранее пользователь спрашивал: " + "; ".join(questions)
+            while questions and used + estimate_tokens(summary) > budget:
+                # Не помещается - оставляем только более поздние вопросы
+                questions.pop(0)
+                summary = "Ранее пользователь спрашивал: " + "; ".join(questions) if questions else ""
+            used += estimate_tokens(summary)
+        return {"messages": messages, "summary": summary, "tokens": used}
+
+    async def _load(self, user_id: str) -> Optional[_Conversation]:
+        try:
+            turns = await asyncio.to_thread(
+                self.db.load, user_id, self.config.max_turns, time.time() - self.config.ttl
+            )
+        except Exception as e:
+            self.db_errors += 1
+            logger.warning("Не удалось загрузить диалог из хранилища: %s", e)
+            return None
+        if not turns or user_id in self._conversations:
+            return self._conversations.get(user_id)
+        conversation = _Conversation(self.config.max_turns)
+        for turn in turns:
+            conversation.turns.append(turn)
+            conversation.size += turn.size
+        conversation.last_active = turns[-1].created_at
+        self._conversations[user_id] = conversation
+        self._bytes += conversation.size
+        self._evict()
+        return conversation
+
+    def _discard(self, user_id: str) -> None:
+        conversation = self._conversations.pop(user_id, None)
+        if conversation is not None:
+            self._bytes -= conversation.size
+
+    def _expire(self) -> None:
+        """Удаляет диалоги без активности дольше ttl (самые давние - в начале LRU)"""
+        deadline = time.time() - self.config.ttl
+        while self._conversations:
+            user_id, conversation = next(iter(self._conversations.items()))
+            if conversation.last_active > deadline:
+                break
+            self._discard(user_id)
+            self.expirations += 1
+
+    def _evict(self) -> None:
+        while self._conversations and (
+            len(self._conversations) > self.config.max_users or self._bytes > self.config.max_bytes
+        ):
+            self._discard(next(iter(self._conversations)))
+            self.evictions += 1
+
+    async def purge(self) -> int:
+        """Удаляет устаревшие диалоги из памяти и хранилища"""
+        self._expire()
+        if self.db is None:
+            return 0
+        return await asyncio.to_thread(self.db.purge, time.time() - self.config.ttl)
+
+    def close(self) -> None:
+        if self.db is not None:
+            self.db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика памяти диалогов для эндпоинта /health"""
+        return {
+            "enabled": self.enabled,
+            "store": "sqlite" if self.db is not None else "memory",
+            "conversations": len(self._conversations),
+            "bytes": self._bytes,
+            "turns_total": self.turns_total,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "db_errors": self.db_errors
+        }
+
+# Глобальная память диалогов ассистента
+conversation_store = ConversationStore()
@@ -0,0 +1,75 @@
+import math
+import zlib
+from typing import List, Optional
+import logging
+
+from app.config import embeddings_config, EmbeddingsConfig
+from app.services.upstream import gigachat_upstream
+from app.utils.text_search import tokenize
+from app.utils.vector_index import numpy_available
+
+logger = logging.getLogger("embeddings")
+
+class Embedder:
+    """Векторизатор текстов для семантического поиска"""
+
+    # Идентификатор модели; векторы разных моделей несовместимы
+    name = ""
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+class GigaChatEmbedder(Embedder):
+    """Векторы через эндпоинт /embeddings GigaChat API"""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.name = f"gigachat:{model}"
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        return await gigachat_upstream.embeddings(texts, self.model)
+
+class HashingEmbedder(Embedder):
+    """
+    Локальный векторизатор без обращения к API
+
+    Основы слов и их символьные триграммы раскладываются хэшированием по dim
+    координатам. Подходит для офлайн-проверки и тестов: близость отражает
+    общие слова и их части, а не смысл, как у настоящей модели эмбеддингов.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.name = f"local:hashing-{dim}"
+
+    def _features(self, text: str) -> List[str]:
+        features = []
+        for token in tokenize(text):
+            features.append(token)
+            padded = f"#{token}#"
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def embed_one(self, text: str) -> List[float]:
+        vector = [0.0] * self.dim
+        for feature in self._features(text):
+            digest = zlib.crc32(feature.encode("utf-8"))
+            vector[digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_one(text) for text in texts]
+
+def create_embedder(config: EmbeddingsConfig = embeddings_config) -> Optional[Embedder]:
+    """Создает векторизатор по настройкам или None, если семантический поиск отключен"""
+    if config.provider == "none":
+        return None
+    if not numpy_available():
+        logger.warning("Семантический поиск включен в настройках, но пакет numpy не установлен. Используется только BM25")
+        return None
+    if config.provider == "local":
+        return HashingEmbedder(config.local_dim)
+    if config.provider != "gigachat":
+        logger.warning("Неизвестный EMBEDDINGS_PROVIDER=%s, используется gigachat", config.provider)
+    return GigaChatEmbedder(config.model)
@@ -1,18 +1,31 @@
-import httpx
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, AsyncIterator
+import asyncio
 import json
 import logging
+import time
 
-from app.config import gigachat_config
-from app.utils.auth import token_manager
+from app.config import gigachat_config, long_text_config
+from app.services.upstream import gigachat_upstream
+from app.utils.cache import response_cache, normalize_prompt, make_cache_key, CACHE_USE, CACHE_BYPASS
+from app.utils.coalesce import request_coalescer
+from app.utils.limiter import priority_lane, PRIORITY_BATCH
+from app.utils.resilience import upstream_breaker, CircuitOpenError
+from app.utils.tokens import token_counter, MESSAGE_OVERHEAD_TOKENS
 
 # Настройка логирования
 logger = logging.getLogger("gigachat")
 
+# Ответ, который возвращается, если API не вернул ни одного варианта
+EMPTY_RESPONSE_MESSAGE = "Не удалось получить ответ от ассистента."
+
 class GigaChatService:
     """Сервис для взаимодействия с GigaChat API"""
     
-    async def enhance_text(self, text: str, style: Optional[str] = None, length: Optional[str] = None) -> str:
+    async def enhance_text(self, 
+                           text: str, 
+                           style: Optional[str] = None, 
+                           length: Optional[str] = None,
+                           cache_mode: str = CACHE_USE) -> str:
         """
         Улучшает текст с помощью GigaChat API
         
@@ -20,23 +33,398 @@ class GigaChatService:
             text: Исходный текст для улучшения
             style: Стиль текста (продающий, информационный, эмоциональный и т.д.)
             length: Желаемая длина результата (короткий, средний, длинный)
+            cache_mode: Режим кэша (use, bypass, refresh)
             
         Returns:
             Улучшенный текст
         """
-        # Формируем промпт в зависимости от переданных параметров
-        prompt = self._build_prompt(text, style, length)
+        result = await self.enhance_text_detailed(text, style, length, cache_mode)
+        return result["text"]
+
+    async def enhance_text_detailed(self, 
+                                    text: str, 
+                                    style: Optional[str] = None, 
+                                    length: Optional[str] = None,
+                                    cache_mode: str = CACHE_USE) -> Dict[str, Any]:
+        """
+        Улучшает текст и сообщает, был ли ответ взят из кэша
+        
+        Returns:
+            Словарь с ключами text (улучшенный текст) и cached (ответ из кэша)
+        """
+        # Формируем промпт в зависимости от параметров
+        prompt = self.build_prompt(text, style, length)
+        return await self._complete(prompt, cache_mode)
+
+    async def _complete(self, prompt: str, cache_mode: str = CACHE_USE) -> Dict[str, Any]:
+        """Получает ответ на готовый промпт с учетом кэша и объединения одинаковых запросов"""
+        cache_key = self._cache_key(prompt)
+
+        if cache_mode == CACHE_USE:
+            cached = await response_cache.get(cache_key)
+            if cached is not None:
+                return {"text": cached, "cached": True}
+        
+        async def fetch() -> str:
+            # Получаем ответ от API и сохраняем его в кэш
+            response = await self._send_chat_request(prompt)
+            if cache_mode != CACHE_BYPASS and response != EMPTY_RESPONSE_MESSAGE:
+                await response_cache.set(cache_key, response)
+            return response
+
+        # Одинаковые одновременные запросы ожидают один общий вызов API
+        response = await request_coalescer.run(cache_key, fetch)
+        
+        return {"text": response, "cached": False}
+
+    async def stream_enhance_text(self, 
+                                  prompt: str, 
+                                  cache_mode: str = CACHE_USE) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Улучшает текст в потоковом режиме
+        
+        Кэш и выключатель проверяются до начала ответа: при разомкнутом
+        выключателе CircuitOpenError поднимается здесь, и эндпоинт отвечает
+        503 с Retry-After, а не событием error в потоке.
+        
+        Args:
+            prompt: Готовый промпт (build_prompt). Промпт формируется до начала
+                ответа, чтобы превышение бюджета токенов вернуло клиенту 413
+            cache_mode: Режим кэша (use, bypass, refresh)
+        
+        Returns:
+            Поток событий {"event": "chunk", "data": {"text": ...}} по мере генерации
+            и итоговое событие {"event": "done", "data": {...}} с полным текстом
+        """
+        started_at = time.monotonic()
+        cache_key = self._cache_key(prompt)
+
+        if cache_mode == CACHE_USE:
+            cached = await response_cache.get(cache_key)
+            if cached is not None:
+                return self._stream_cached(cached, started_at)
+        upstream_breaker.check()
+        return self._stream_generation(prompt, cache_key, cache_mode, started_at)
+
+    async def _stream_cached(self, text: str, started_at: float) -> AsyncIterator[Dict[str, Any]]:
+        yield {"event": "chunk", "data": {"text": text}}
+        yield {"event": "done", "data": {
+            "text": text,
+            "cached": True,
+            "chunks": 1,
+            "duration": round(time.monotonic() - started_at, 4)
+        }}
+
+    async def _stream_generation(self,
+                                 prompt: str,
+                                 cache_key: str,
+                                 cache_mode: str,
+                                 started_at: float) -> AsyncIterator[Dict[str, Any]]:
+        parts: List[str] = []
+        first_chunk_at: Optional[float] = None
+        usage = None
+        try:
+            async for chunk in gigachat_upstream.stream_chat_completions(self._build_request_data(prompt)):
+                usage = chunk.get("usage") or usage
+                delta = gigachat_upstream.extract_delta(chunk)
+                if not delta:
+                    continue
+                if first_chunk_at is None:
+                    first_chunk_at = time.monotonic()
+                parts.append(delta)
+                yield {"event": "chunk", "data": {"text": delta}}
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error("Ошибка при потоковом запросе к API: %s", e)
+            raise Exception(f"Ошибка взаимодействия с GigaChat API: {str(e)}")
+
+        response = "".join(parts).strip() or EMPTY_RESPONSE_MESSAGE
+        if cache_mode != CACHE_BYPASS and response != EMPTY_RESPONSE_MESSAGE:
+            await response_cache.set(cache_key, response)
+
+        yield {"event": "done", "data": {
+            "text": response,
+            "cached": False,
+            "chunks": len(parts),
+            "time_to_first_chunk": round(first_chunk_at - started_at, 4) if first_chunk_at else None,
+            "duration": round(time.monotonic() - started_at, 4),
+            "usage": usage
+        }}
+
+    async def enhance_batch(self, 
+                            items: List[Dict[str, Any]], 
+                            concurrency: int,
+                            cache_mode: str = CACHE_USE) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Улучшает пакет текстов с ограниченным числом одновременных запросов
+        
+        Одинаковые элементы пакета отправляются в API один раз. Ошибка одного
+        элемента не прерывает обработку остальных.
+        
+        Args:
+            items: Элементы пакета (text, style, length, industry, target_audience,
+                unique_features, id)
+            concurrency: Максимальное число одновременных запросов к API
+            cache_mode: Режим кэша (use, bypass, refresh)
+            
+        Yields:
+            Результаты по элементам в порядке завершения
+        """
+        # Группируем одинаковые элементы, чтобы отправить каждый только один раз
+        groups: Dict[str, List[int]] = {}
+        requests: Dict[str, Dict[str, Any]] = {}
+        for index, item in enumerate(items):
+            request = self._resolve_batch_item(item)
+            key = make_cache_key(request["text"], request["style"], request["length"])
+            if key not in groups:
+                groups[key] = []
+                requests[key] = request
+            groups[key].append(index)
+
+        pending: asyncio.Queue = asyncio.Queue()
+        for key in groups:
+            pending.put_nowait(key)
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def worker() -> None:
+            while True:
+                try:
+                    key = pending.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                request = requests[key]
+                started_at = time.monotonic()
+                try:
+                    # Пакетные запросы уступают место интерактивным в очереди к API
+                    with priority_lane(PRIORITY_BATCH):
+                        result = await self.enhance_text_detailed(
+                            request["text"], request["style"], request["length"], cache_mode
+                        )
+                    outcome = {"enhanced_text": result["text"], "cached": result["cached"]}
+                except Exception as e:
+                    outcome = {"error": str(e)}
+                outcome["duration"] = round(time.monotonic() - started_at, 4)
+                await results.put((key, outcome))
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(min(concurrency, len(groups)))]
+        try:
+            for _ in range(len(groups)):
+                key, outcome = await results.get()
+                for position, index in enumerate(groups[key]):
+                    yield dict(
+                        outcome,
+                        index=index,
+                        id=items[index].get("id"),
+                        deduplicated=position > 0
+                    )
+        finally:
+            # Клиент мог отключиться - останавливаем необработанные элементы
+            for task in workers:
+                task.cancel()
+
+    async def enhance_long_text(self, 
+                                chunks: AsyncIterator[str], 
+                                style: Optional[str] = None, 
+                                length: Optional[str] = None,
+                                concurrency: int = long_text_config.concurrency,
+                                cache_mode: str = CACHE_USE) -> Dict[str, Any]:
+        """
+        Улучшает длинный текст по частям (map-reduce)
+        
+        Части улучшаются параллельно по мере поступления, не дожидаясь всего
+        текста: очередь частей ограничена, поэтому при медленной обработке
+        чтение входного текста приостанавливается. Улучшенные части
+        склеиваются в исходном порядке; если результат помещается в один
+        запрос, итоговый проход согласует стиль и стыки частей. Ошибка части
+        не прерывает обработку - вместо нее остается исходный текст.
+        
+        Args:
+            chunks: Части исходного текста по мере поступления
+            style: Стиль текста
+            length: Желаемая длина результата
+            concurrency: Максимальное число одновременных запросов к API
+            cache_mode: Режим кэша (use, bypass, refresh)
+            
+        Returns:
+            Словарь с улучшенным текстом (text), сведениями о частях (chunks),
+            итоговом проходе (consistency_pass) и общей длительностью (duration)
+        """
+        started_at = time.monotonic()
+        pending: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+        results: Dict[int, str] = {}
+        reports: Dict[int, Dict[str, Any]] = {}
+        circuit_errors: List[CircuitOpenError] = []
+
+        async def worker() -> None:
+            while True:
+                item = await pending.get()
+                if item is None:
+                    return
+                index, chunk = item
+                chunk_started_at = time.monotonic()
+                report: Dict[str, Any] = {
+                    "index": index,
+                    "chars": len(chunk),
+                    "started_at": round(chunk_started_at - started_at, 4)
+                }
+                try:
+                    prompt = self._build_chunk_prompt(chunk, style, length)
+                    result = await self._complete(prompt, cache_mode)
+                    if result["text"] == EMPTY_RESPONSE_MESSAGE:
+                        raise ValueError(EMPTY_RESPONSE_MESSAGE)
+                    results[index] = result["text"]
+                    report["cached"] = result["cached"]
+                except CircuitOpenError as e:
+                    circuit_errors.append(e)
+                    results[index] = chunk
+                    report["error"] = str(e)
+                except Exception as e:
+                    logger.error("Ошибка улучшения части %s длинного текста: %s", index, e)
+                    results[index] = chunk
+                    report["error"] = str(e)
+                report["duration"] = round(time.monotonic() - chunk_started_at, 4)
+                reports[index] = report
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+        try:
+            index = 0
+            async for chunk in chunks:
+                await pending.put((index, chunk))
+                index += 1
+            for _ in workers:
+                await pending.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            # Клиент мог отключиться или тело оказалось слишком большим
+            for task in workers:
+                task.cancel()
+
+        if circuit_errors:
+            # API недоступен - неполный результат не возвращаем
+            raise circuit_errors[-1]
+
+        merged = "\n\n".join(results[i] for i in range(index))
+        consistency = await self._consistency_pass(merged, index, cache_mode)
+        return {
+            "text": consistency.pop("text", None) or merged,
+            "chunks": [reports[i] for i in range(index)],
+            "consistency_pass": consistency,
+            "duration": round(time.monotonic() - started_at, 4)
+        }
+
+    async def _consistency_pass(self, merged: str, chunks: int, cache_mode: str) -> Dict[str, Any]:
+        """Согласует стиль склеенных частей одним запросом, если текст помещается в промпт и ответ"""
+        if chunks < 2:
+            return {"applied": False, "reason": "single_chunk"}
+        if not long_text_config.consistency_pass:
+            return {"applied": False, "reason": "disabled"}
+        prompt = self._render_consistency_prompt(merged)
+        tokens = token_counter.estimate(merged)
+        if (token_counter.estimate(prompt) + MESSAGE_OVERHEAD_TOKENS > token_counter.config.max_prompt_tokens
+                or tokens > gigachat_config.max_tokens):
+            # Ответ не поместится в один запрос - оставляем склеенные части
+            return {"applied": False, "reason": "too_long"}
+        started_at = time.monotonic()
+        try:
+            result = await self._complete(prompt, cache_mode)
+        except Exception as e:
+            logger.error("Ошибка итогового прохода длинного текста: %s", e)
+            return {"applied": False, "reason": "error", "error": str(e)}
+        duration = round(time.monotonic() - started_at, 4)
+        if result["text"] == EMPTY_RESPONSE_MESSAGE:
+            return {"applied": False, "reason": "empty_response", "duration": duration}
+        return {"applied": True, "cached": result["cached"], "duration": duration, "text": result["text"]}
+
+    def _build_chunk_prompt(self, text: str, style: Optional[str] = None, length: Optional[str] = None) -> str:
+        """
+        Формирует промпт для улучшения одной части длинного текста
+        """
+        text = token_counter.fit_text(text, self._render_chunk_prompt("", style, length))
+        return self._render_chunk_prompt(text, style, length)
+
+    def _render_chunk_prompt(self, text: str, style: Optional[str] = None, length: Optional[str] = None) -> str:
+        prompt = ("Преобразуй следующий фрагмент длинного текста в красочное, грамотное и продающее описание. "
+                  "Сохрани все факты и порядок изложения, не добавляй вступление и заключение:")
+        
+        if style:
+            prompt += f"\nСтиль описания: {style}."
+            
+        if length:
+            prompt += f"\nЖелаемая длина: {length}."
+            
+        prompt += f"\n\nФрагмент: \"{text}\"\n\nУлучшенный фрагмент:"
+        
+        return prompt
+
+    def _render_consistency_prompt(self, text: str) -> str:
+        return ("Текст ниже улучшали по частям. Согласуй стиль и терминологию между частями, "
+                "убери повторы на стыках, сохрани содержание, структуру и длину. "
+                f"Верни только итоговый текст.\n\nТекст:\n{text}\n\nИтоговый текст:")
+
+    def _resolve_batch_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Приводит элемент пакета к параметрам enhance_text (описание компании или обычный текст)"""
+        if item.get("industry") or item.get("target_audience") or item.get("unique_features"):
+            prompt = self.build_company_prompt(
+                item["text"], item.get("industry"), item.get("target_audience"), item.get("unique_features")
+            )
+            return {"text": prompt, "style": None, "length": None}
+        return {"text": item["text"], "style": item.get("style"), "length": item.get("length")}
+
+    def build_company_prompt(self, 
+                             text: str, 
+                             industry: Optional[str] = None, 
+                             target_audience: Optional[str] = None, 
+                             unique_features: Optional[str] = None) -> str:
+        """
+        Формирует текст запроса для улучшения описания компании
+
+        Слишком длинное описание сокращается так, чтобы итоговый промпт
+        (вместе с общей инструкцией улучшения текста) уложился в бюджет токенов.
+        """
+        template = self._render_company_prompt("", industry, target_audience, unique_features)
+        text = token_counter.fit_text(text, template + self._render_prompt(""))
+        return self._render_company_prompt(text, industry, target_audience, unique_features)
+
+    def _render_company_prompt(self, 
+                               text: str, 
+                               industry: Optional[str] = None, 
+                               target_audience: Optional[str] = None, 
+                               unique_features: Optional[str] = None) -> str:
+        prompt = "Улучши описание компании, сделав его более привлекательным и информативным. "
         
-        # Получаем ответ от API
-        response = await self._send_chat_request(prompt)
+        if industry:
+            prompt += f"\nОтрасль: {industry}"
+        if target_audience:
+            prompt += f"\nЦелевая аудитория: {target_audience}"
+        if unique_features:
+            prompt += f"\nУникальные особенности: {unique_features}"
+            
+        prompt += f"\n\nИсходное описание: \"{text}\"\n\nУлучшенное описание:"
         
-        # Извлекаем и возвращаем улучшенный текст
-        return response
+        return prompt
+
+    def _cache_key(self, prompt: str) -> str:
+        """Ключ кэша: нормализованный промпт и параметры генерации"""
+        return make_cache_key(
+            "enhance",
+            normalize_prompt(prompt),
+            gigachat_config.model,
+            gigachat_config.temperature,
+            gigachat_config.max_tokens
+        )
     
-    def _build_prompt(self, text: str, style: Optional[str] = None, length: Optional[str] = None) -> str:
+    def build_prompt(self, text: str, style: Optional[str] = None, length: Optional[str] = None) -> str:
         """
         Формирует промпт для GigaChat API на основе параметров
+
+        Исходный текст сокращается (или запрос отклоняется), если промпт
+        не укладывается в бюджет токенов
         """
+        text = token_counter.fit_text(text, self._render_prompt("", style, length))
+        return self._render_prompt(text, style, length)
+
+    def _render_prompt(self, text: str, style: Optional[str] = None, length: Optional[str] = None) -> str:
         prompt = f"Преобразуй следующий текст в красочное, грамотное и продающее описание:"
         
         if style:
@@ -49,70 +437,41 @@ class GigaChatService:
         
         return prompt
     
+    def _build_request_data(self, prompt: str) -> Dict[str, Any]:
+        """
+        Формирует тело запроса к /chat/completions
+        """
+        return {
+            "model": gigachat_config.model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "temperature": gigachat_config.temperature,
+            "max_tokens": gigachat_config.max_tokens
+        }
+    
     async def _send_chat_request(self, prompt: str) -> str:
         """
         Отправляет запрос к GigaChat API и возвращает ответ
         """
-        max_attempts = 2  # Максимальное количество попыток с обновлением токена
-        attempt = 0
-        
-        while attempt < max_attempts:
-            attempt += 1
-            try:
-                # Получаем токен авторизации
-                auth_token = await token_manager.get_token()
-                logger.info(f"Отправка запроса к GigaChat API (попытка {attempt}/{max_attempts})")
-                
-                # Формируем запрос
-                request_data = {
-                    "model": gigachat_config.model,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ],
-                    "temperature": gigachat_config.temperature,
-                    "max_tokens": gigachat_config.max_tokens
-                }
-                
-                # Отправляем запрос к API
-                async with httpx.AsyncClient(verify=False, timeout=60.0) as client:
-                    response = await client.post(
-                        f"{gigachat_config.api_base_url}/chat/completions",
-                        headers={
-                            "Authorization": f"Bearer {auth_token}",
-                            "Content-Type": "application/json",
-                            "Accept": "application/json"
-                        },
-                        json=request_data
-                    )
-                    
-                    response.raise_for_status()
-                    response_data = response.json()
-                    
-                    # Извлекаем текст ответа
-                    if response_data.get("choices") and len(response_data["choices"]) > 0:
-                        message = response_data["choices"][0].get("message", {})
-                        return message.get("content", "").strip()
-                        
-                    return "Не удалось получить ответ от ассистента."
-                    
-            except httpx.HTTPStatusError as e:
-                if e.response.status_code == 401 and attempt < max_attempts:
-                    # Если токен истек, принудительно обновляем его и повторяем запрос
-                    logger.warning("Получена ошибка авторизации 401. Принудительное обновление токена...")
-                    await token_manager.refresh_token()
-                    continue
-                else:
-                    logger.error(f"HTTP ошибка при запросе к API: {e.response.status_code} {e.response.text}")
-                    raise Exception(f"Ошибка взаимодействия с GigaChat API: {str(e)}")
-            except Exception as e:
-                logger.error(f"Неожиданная ошибка при запросе к API: {str(e)}")
-                raise Exception(f"Ошибка взаимодействия с GigaChat API: {str(e)}")
-        
-        # Если мы дошли до этой точки, значит все попытки исчерпаны
-        raise Exception("Превышено максимальное количество попыток запроса к GigaChat API")
+        request_data = self._build_request_data(prompt)
+
+        try:
+            response_data = await gigachat_upstream.chat_completions(request_data)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error("Ошибка при запросе к API: %s", e)
+            raise Exception(f"Ошибка взаимодействия с GigaChat API: {str(e)}")
+
+        # Извлекаем текст ответа
+        content = gigachat_upstream.extract_content(response_data)
+        if content is None:
+            return EMPTY_RESPONSE_MESSAGE
+        return content
 
 # Глобальный экземпляр сервиса
 gigachat_service = GigaChatService() 
\ No newline at end of file
@@ -0,0 +1,451 @@
+import asyncio
+import ipaddress
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Any, Optional, List, Set
+from urllib.parse import urlsplit
+import logging
+
+import httpx
+
+from app.config import jobs_config, JobsConfig
+from app.services.gigachat import gigachat_service
+from app.utils.cache import CACHE_USE
+
+logger = logging.getLogger("jobs")
+
+# Статусы заданий
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# Колонки аренды, добавленные после первой версии схемы
+LEASE_COLUMNS = {"owner": "TEXT", "lease_until": "REAL"}
+
+class CallbackURLError(ValueError):
+    """Адрес уведомления не разрешен: неподходящая схема, хост не из списка или внутренний адрес"""
+
+def _is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%")[0])
+    return ip.is_global and not ip.is_multicast
+
+def validate_callback_url(url: str, allowed_hosts: List[str]) -> str:
+    """
+    Проверяет схему и хост адреса уведомления (без разрешения имени)
+
+    Если задан allowed_hosts, хост должен быть из списка. Иначе адрес
+    не должен быть IP-адресом внутренней сети, loopback и т.п.
+
+    Raises:
+        CallbackURLError: Если адрес не разрешен
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise CallbackURLError("Адрес уведомления должен начинаться с http:// или https:// и содержать хост")
+    host = parts.hostname.lower()
+    if allowed_hosts:
+        if host not in allowed_hosts:
+            raise CallbackURLError(f"Хост {host} не входит в JOBS_CALLBACK_HOSTS")
+        return url
+    if host == "localhost" or host.endswith(".localhost"):
+        raise CallbackURLError("Уведомления на внутренние адреса запрещены")
+    try:
+        public = _is_public_address(host)
+    except ValueError:
+        # Имя хоста: адреса проверяются при отправке
+        return url
+    if not public:
+        raise CallbackURLError("Уведомления на внутренние адреса запрещены")
+    return url
+
+async def resolve_callback_host(url: str, allowed_hosts: List[str]) -> None:
+    """
+    Проверяет адреса, в которые разрешается хост уведомления, перед отправкой
+
+    Raises:
+        CallbackURLError: Если хост разрешается во внутренний адрес
+    """
+    validate_callback_url(url, allowed_hosts)
+    if allowed_hosts:
+        return
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    infos = await asyncio.get_running_loop().getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)
+    if not infos or not all(_is_public_address(info[4][0]) for info in infos):
+        raise CallbackURLError(f"Хост {parts.hostname} разрешается во внутренний адрес")
+
+class JobStore:
+    """
+    Хранилище заданий в локальном файле SQLite
+
+    Задания сохраняются до начала обработки, поэтому незавершенные задания
+    ставятся в очередь повторно после перезапуска сервиса. Файл общий для
+    всех процессов сервиса (uvicorn --workers N): процесс захватывает задание
+    атомарным UPDATE и продлевает аренду (lease_until), пока обрабатывает его.
+    Повторно в очередь ставятся только задания с истекшей арендой.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT NOT NULL, "
+                "result TEXT, error TEXT, total INTEGER NOT NULL, completed INTEGER NOT NULL DEFAULT 0, "
+                "callback_url TEXT, callback_status TEXT, "
+                "created_at REAL NOT NULL, started_at REAL, finished_at REAL, "
+                "owner TEXT, lease_until REAL)"
+            )
+            # Файл, созданный до появления аренды, дополняется новыми колонками
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in LEASE_COLUMNS.items():
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._connection().execute(sql, params)
+
+    def create(self, job_id: str, payload: Dict[str, Any], total: int, callback_url: Optional[str]) -> None:
+        self._execute(
+            "INSERT INTO jobs (id, status, payload, total, callback_url, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, JOB_PENDING, json.dumps(payload, ensure_ascii=False), total, callback_url, time.time())
+        )
+
+    def get(self, job_id: str, with_payload: bool = False) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            cursor = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            columns = [column[0] for column in cursor.description]
+        if row is None:
+            return None
+        job = dict(zip(columns, row))
+        payload = job.pop("payload")
+        # Владелец и аренда - внутреннее состояние хранилища
+        job.pop("owner")
+        job.pop("lease_until")
+        if with_payload:
+            job["payload"] = json.loads(payload)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def claim(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        """Захватывает ожидающее задание; False, если его уже взял другой процесс"""
+        now = time.time()
+        cursor = self._execute(
+            "UPDATE jobs SET status = ?, owner = ?, lease_until = ?, started_at = ? WHERE id = ? AND status = ?",
+            (JOB_RUNNING, owner, now + lease_seconds, now, job_id, JOB_PENDING)
+        )
+        return cursor.rowcount == 1
+
+    def renew(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        """Продлевает аренду; False, если задание больше не принадлежит owner"""
+        cursor = self._execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = ? AND owner = ?",
+            (time.time() + lease_seconds, job_id, JOB_RUNNING, owner)
+        )
+        return cursor.rowcount == 1
+
+    def set_progress(self, job_id: str, owner: str, completed: int) -> None:
+        self._execute("UPDATE jobs SET completed = ? WHERE id = ? AND owner = ?", (completed, job_id, owner))
+
+    def finish(self,
+               job_id: str,
+               owner: str,
+               status: str,
+               result: Optional[List[Dict[str, Any]]],
+               error: Optional[str]) -> bool:
+        """Сохраняет итог задания; False, если аренду уже перехватил другой процесс"""
+        cursor = self._execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_until = NULL "
+            "WHERE id = ? AND status = ? AND owner = ?",
+            (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error, time.time(),
+             job_id, JOB_RUNNING, owner)
+        )
+        return cursor.rowcount == 1
+
+    def set_callback_status(self, job_id: str, callback_status: str) -> None:
+        self._execute("UPDATE jobs SET callback_status = ? WHERE id = ?", (callback_status, job_id))
+
+    def release(self, owner: str) -> int:
+        """Возвращает в ожидание задания owner, прерванные остановкой процесса"""
+        cursor = self._execute(
+            "UPDATE jobs SET status = ?, owner = NULL, lease_until = NULL, started_at = NULL "
+            "WHERE status = ? AND owner = ?",
+            (JOB_PENDING, JOB_RUNNING, owner)
+        )
+        return cursor.rowcount
+
+    def requeue_expired(self, created_before: float) -> List[str]:
+        """
+        Задания, которые нужно поставить в очередь
+
+        Задания с истекшей арендой (процесс, обрабатывавший их, завершился
+        аварийно) возвращаются в ожидание. Возвращаются ожидающие задания,
+        созданные раньше created_before: задания других процессов, которые
+        обрабатываются сейчас, не затрагиваются.
+        """
+        self._execute(
+            "UPDATE jobs SET status = ?, owner = NULL, lease_until = NULL, started_at = NULL "
+            "WHERE status = ? AND (lease_until IS NULL OR lease_until < ?)",
+            (JOB_PENDING, JOB_RUNNING, time.time())
+        )
+        rows = self._execute(
+            "SELECT id FROM jobs WHERE status = ? AND created_at < ? ORDER BY created_at", (JOB_PENDING, created_before)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def cleanup(self, older_than: float) -> int:
+        """Удаляет завершенные задания старше older_than (unix-время)"""
+        cursor = self._execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?", (JOB_DONE, JOB_FAILED, older_than)
+        )
+        return cursor.rowcount
+
+    def count_by_status(self) -> Dict[str, int]:
+        rows = self._execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+class JobService:
+    """
+    Фоновые задания на улучшение текстов
+
+    Задание сохраняется в JobStore и попадает в очередь asyncio, из которой его
+    забирают воркеры. Число одновременных запросов к GigaChat от всех заданий
+    ограничено max_in_flight. По завершении задание можно получить по
+    идентификатору или дождаться POST-запроса на callback_url.
+
+    Задание выполняет процесс, захвативший его в хранилище; аренда продлевается
+    каждые lease_seconds / 3 секунд. Задания процесса, завершившегося без
+    остановки, подбираются другими процессами после истечения аренды.
+    """
+
+    def __init__(self, config: JobsConfig = jobs_config):
+        self.config = config
+        self.store = JobStore(config.store_path)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued: Set[str] = set()
+        self._workers: List[asyncio.Task] = []
+        self._recovery: Optional[asyncio.Task] = None
+        # Общий клиент для уведомлений на callback_url
+        self._client: Optional[httpx.AsyncClient] = None
+        # Параллельность обработки элементов внутри одного задания
+        self.item_concurrency = max(1, config.max_in_flight // max(1, config.workers))
+        self.completed_total = 0
+        self.failed_total = 0
+        self.recovered_total = 0
+        self.lost_leases_total = 0
+
+    async def start(self) -> None:
+        """Запускает воркеры и ставит в очередь ожидающие задания и задания с истекшей арендой"""
+        self._queue = asyncio.Queue()
+        self._client = httpx.AsyncClient(timeout=self.config.callback_timeout)
+        removed = await asyncio.to_thread(self.store.cleanup, time.time() - self.config.retention)
+        unfinished = await self._requeue(time.time())
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self.config.workers)]
+        self._recovery = asyncio.ensure_future(self._recover())
+        logger.info(
+            "Запущено воркеров заданий: %s, восстановлено заданий: %s, удалено устаревших: %s",
+            self.config.workers, unfinished, removed
+        )
+
+    async def stop(self) -> None:
+        """Останавливает воркеры. Прерванные задания возвращаются в ожидание"""
+        tasks = self._workers + ([self._recovery] if self._recovery is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._recovery = None
+        self._queued.clear()
+        released = await asyncio.to_thread(self.store.release, self.owner)
+        if released:
+            logger.info("Прерванных заданий возвращено в ожидание: %s", released)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self.store.close()
+
+    async def submit(self,
+                     items: List[Dict[str, Any]],
+                     callback_url: Optional[str] = None,
+                     cache_mode: str = CACHE_USE) -> Dict[str, Any]:
+        """
+        Создает задание и ставит его в очередь
+
+        Args:
+            items: Элементы для улучшения (как в пакетном эндпоинте)
+            callback_url: Адрес для POST-уведомления о завершении
+            cache_mode: Режим кэша (use, bypass, refresh)
+
+        Returns:
+            Созданное задание
+
+        Raises:
+            CallbackURLError: Если адрес уведомления не разрешен
+        """
+        if self._queue is None:
+            raise RuntimeError("Обработчик заданий не запущен")
+        if callback_url:
+            validate_callback_url(callback_url, self.config.callback_host_list)
+        job_id = uuid.uuid4().hex
+        payload = {"items": items, "cache": cache_mode}
+        await asyncio.to_thread(self.store.create, job_id, payload, len(items), callback_url)
+        self._enqueue(job_id)
+        return await self.get(job_id)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Возвращает задание со статусом и результатом"""
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    def _enqueue(self, job_id: str) -> None:
+        self._queued.add(job_id)
+        self._queue.put_nowait(job_id)
+
+    async def _requeue(self, created_before: float) -> int:
+        """Ставит в очередь задания из хранилища, которых еще нет в очереди процесса"""
+        job_ids = await asyncio.to_thread(self.store.requeue_expired, created_before)
+        added = 0
+        for job_id in job_ids:
+            if job_id not in self._queued:
+                self._enqueue(job_id)
+                added += 1
+        return added
+
+    async def _recover(self) -> None:
+        """Подбирает задания процессов, завершившихся без остановки"""
+        while True:
+            await asyncio.sleep(self.config.lease_seconds)
+            try:
+                # Более новые ожидающие задания еще стоят в очереди процесса, который их принял
+                added = await self._requeue(time.time() - self.config.lease_seconds)
+            except Exception as e:
+                logger.error("Ошибка восстановления заданий: %s", e)
+                continue
+            if added:
+                self.recovered_total += added
+                logger.warning("Поставлено в очередь заданий других процессов: %s", added)
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            try:
+                await self._process(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Ошибка обработки задания %s: %s", job_id, e)
+
+    async def _process(self, job_id: str) -> None:
+        # Атомарный захват: задание, взятое другим процессом или завершенное, пропускается
+        if not await asyncio.to_thread(self.store.claim, job_id, self.owner, self.config.lease_seconds):
+            return
+        job = await asyncio.to_thread(self.store.get, job_id, True)
+
+        work = asyncio.ensure_future(self._enhance(job))
+        try:
+            while not work.done():
+                await asyncio.wait({work}, timeout=self.config.lease_seconds / 3)
+                if work.done():
+                    break
+                if not await asyncio.to_thread(self.store.renew, job_id, self.owner, self.config.lease_seconds):
+                    # Аренда истекла и задание взял другой процесс - результат этого процесса не нужен
+                    logger.warning("Аренда задания %s потеряна, обработка прервана", job_id)
+                    self.lost_leases_total += 1
+                    work.cancel()
+                    await asyncio.gather(work, return_exceptions=True)
+                    return
+        except asyncio.CancelledError:
+            # Сервис останавливается - задание будет возвращено в ожидание в stop()
+            work.cancel()
+            raise
+
+        try:
+            results = work.result()
+        except Exception as e:
+            finished = await asyncio.to_thread(self.store.finish, job_id, self.owner, JOB_FAILED, None, str(e))
+            self.failed_total += finished
+        else:
+            finished = await asyncio.to_thread(self.store.finish, job_id, self.owner, JOB_DONE, results, None)
+            self.completed_total += finished
+        if not finished:
+            logger.warning("Аренда задания %s потеряна, результат не сохранен", job_id)
+            self.lost_leases_total += 1
+            return
+
+        if job["callback_url"]:
+            await self._send_callback(job_id, job["callback_url"])
+
+    async def _enhance(self, job: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Улучшает элементы задания, сохраняя прогресс"""
+        results: List[Dict[str, Any]] = []
+        async for result in gigachat_service.enhance_batch(
+            job["payload"]["items"], self.item_concurrency, cache_mode=job["payload"].get("cache", CACHE_USE)
+        ):
+            results.append(result)
+            await asyncio.to_thread(self.store.set_progress, job["id"], self.owner, len(results))
+        results.sort(key=lambda result: result["index"])
+        return results
+
+    async def _send_callback(self, job_id: str, callback_url: str) -> None:
+        """Отправляет завершенное задание на callback_url с повторными попытками"""
+        job = await self.get(job_id)
+        status = "failed"
+        try:
+            # Имя хоста проверяется при каждой отправке: адрес мог смениться после создания задания
+            await resolve_callback_host(callback_url, self.config.callback_host_list)
+        except (CallbackURLError, OSError) as e:
+            logger.warning("Уведомление о задании %s не отправлено: %s", job_id, e)
+        else:
+            for attempt in range(1, self.config.callback_attempts + 1):
+                try:
+                    response = await self._client.post(callback_url, json=job)
+                    response.raise_for_status()
+                    status = "delivered"
+                    break
+                except Exception as e:
+                    logger.warning("Не удалось отправить уведомление о задании %s (попытка %s): %s", job_id, attempt, e)
+                    if attempt < self.config.callback_attempts:
+                        await asyncio.sleep(2 ** attempt)
+        await asyncio.to_thread(self.store.set_callback_status, job_id, status)
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика заданий для эндпоинта /health"""
+        return {
+            "workers": len(self._workers),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_in_flight": self.item_concurrency * self.config.workers,
+            "completed_total": self.completed_total,
+            "failed_total": self.failed_total,
+            "recovered_total": self.recovered_total,
+            "lost_leases_total": self.lost_leases_total
+        }
+
+# Глобальный экземпляр сервиса заданий
+job_service = JobService()
@@ -0,0 +1,346 @@
+import asyncio
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+import logging
+
+from app.config import assistant_config, AssistantConfig, embeddings_config, EmbeddingsConfig
+from app.services.embeddings import Embedder, create_embedder
+from app.utils.limiter import priority_lane, PRIORITY_BATCH
+from app.utils.text_search import BM25Index, tokenize
+from app.utils.vector_index import VectorIndex, np
+
+logger = logging.getLogger("knowledge")
+
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+
+# Разделы длиннее этого размера делятся по абзацам на несколько фрагментов
+SECTION_MAX_CHARS = 1500
+
+# Константа сглаживания при объединении рейтингов BM25 и семантического поиска (RRF)
+RRF_K = 60
+
+class Section:
+    """Раздел документации: заголовок с путем от корня и текст раздела"""
+
+    def __init__(self, title: str, path: List[str], text: str, source: str):
+        self.title = title
+        self.path = path
+        self.text = text
+        self.source = source
+
+    @property
+    def full_title(self) -> str:
+        return " > ".join(self.path)
+
+def split_sections(markdown: str, source: str) -> List[Section]:
+    """
+    Разбивает Markdown на разделы по заголовкам
+
+    Каждый раздел содержит свой заголовок и текст до следующего заголовка.
+    Заголовки внутри блоков кода не учитываются.
+    """
+    sections: List[Section] = []
+    stack: List[str] = []
+    title: Optional[str] = None
+    lines: List[str] = []
+    in_code = False
+
+    def flush() -> None:
+        # Заголовок без собственного текста (сразу за ним подраздел) не индексируется
+        content = lines[1:] if title is not None else lines
+        if "\n".join(content).strip():
+            path = list(stack) or [os.path.basename(source)]
+            for part in _split_long("\n".join(lines).strip(), lines[0] if title is not None else None):
+                sections.append(Section(path[-1], path, part, source))
+
+    for line in markdown.splitlines():
+        if line.lstrip().startswith("```"):
+            in_code = not in_code
+        match = None if in_code else _HEADING_RE.match(line)
+        if match:
+            flush()
+            level = len(match.group(1))
+            title = match.group(2).strip()
+            stack = stack[:level - 1] + [title]
+            lines = [line]
+        else:
+            lines.append(line)
+    flush()
+    return sections
+
+def _split_long(text: str, heading: Optional[str]) -> List[str]:
+    """Делит длинный раздел по абзацам; каждый следующий фрагмент начинается с заголовка раздела"""
+    if len(text) <= SECTION_MAX_CHARS:
+        return [text]
+    parts: List[str] = []
+    current = ""
+    for paragraph in text.split("\n\n"):
+        if current and len(current) + len(paragraph) + 2 > SECTION_MAX_CHARS:
+            parts.append(current)
+            current = f"{heading}\n\n{paragraph}" if heading else paragraph
+        else:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        parts.append(current)
+    return parts
+
+class KnowledgeBase:
+    """
+    База знаний ассистента: разделы документации платформы и индекс BM25 над ними
+
+    Индекс строится в памяти при запуске сервиса. Поиск используется
+    эндпоинтом /search и для выбора разделов, которые попадают в промпт.
+
+    Если включены эмбеддинги, разделы дополнительно векторизуются, и
+    результаты BM25 и семантического поиска объединяются (Reciprocal Rank
+    Fusion): перефразированный вопрос находит раздел даже без общих слов.
+    """
+
+    def __init__(self,
+                 config: AssistantConfig = assistant_config,
+                 embeddings: EmbeddingsConfig = embeddings_config,
+                 embedder: Optional[Embedder] = None):
+        self.config = config
+        self.embeddings = embeddings
+        self.embedder = embedder if embedder is not None else create_embedder(embeddings)
+        self.vectors = VectorIndex(embeddings.index_path)
+        # Версия документации, для которой векторы разделов актуальны
+        self.vectors_version = ""
+        self._query_vectors: "OrderedDict[str, Any]" = OrderedDict()
+        self._sync_lock = asyncio.Lock()
+        self.embedded_total = 0
+        self.reused_total = 0
+        self.sections: List[Section] = []
+        self.index = BM25Index()
+        # Хэш содержимого файлов - меняется при изменении документации
+        self.version = ""
+        self.loaded = False
+        self.build_time = 0.0
+        self.searches_total = 0
+
+    def load(self) -> None:
+        """Читает файлы базы знаний и строит индекс заново"""
+        self._apply(self._build())
+
+    async def reload(self) -> bool:
+        """
+        Перестраивает индекс в отдельном потоке и атомарно подменяет его
+
+        Returns:
+            True, если содержимое документации изменилось
+        """
+        previous = self.version
+        self._apply(await asyncio.to_thread(self._build))
+        return self.version != previous
+
+    def _build(self) -> Tuple[List[Section], BM25Index, str, float]:
+        started_at = time.monotonic()
+        sections: List[Section] = []
+        digest = hashlib.sha256()
+        for path in self.config.knowledge_paths:
+            if not os.path.exists(path):
+                logger.warning("Файл базы знаний не найден: %s", path)
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as file:
+                    content = file.read()
+            except Exception as e:
+                logger.error("Ошибка при чтении файла базы знаний %s: %s", path, e)
+                continue
+            digest.update(content.encode("utf-8"))
+            sections.extend(split_sections(content, path))
+
+        index = BM25Index()
+        for section in sections:
+            # Заголовки раздела учитываются с двойным весом
+            index.add(tokenize(" ".join(section.path)) * 2 + tokenize(section.text))
+        index.prepare()
+        return sections, index, digest.hexdigest()[:16], time.monotonic() - started_at
+
+    def _apply(self, built: Tuple[List[Section], BM25Index, str, float]) -> None:
+        # Присваивания выполняются в потоке event loop без await между ними,
+        # поэтому запросы видят либо старый, либо новый индекс целиком
+        self.sections, self.index, self.version, self.build_time = built
+        self.loaded = True
+        logger.info("Индекс базы знаний построен: разделов %s, терминов %s", len(self.sections), len(self.index.postings))
+
+    def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        """
+        Ищет разделы документации по ключевым словам (только BM25)
+
+        Returns:
+            Список разделов (title, source, score, text) по убыванию релевантности
+        """
+        if not self.loaded:
+            self.load()
+        self.searches_total += 1
+        sections = self.sections
+        return [self._match(sections[doc_id], score, bm25=score) for doc_id, score in self.index.search(tokenize(query), top_k)]
+
+    async def sync_embeddings(self) -> None:
+        """
+        Векторизует разделы документации, которых еще нет в векторном индексе
+
+        Векторы неизмененных разделов берутся из сохраненной матрицы по хэшу
+        текста, поэтому после правки документации через API проходят только
+        новые и измененные разделы.
+        """
+        if self.embedder is None:
+            return
+        async with self._sync_lock:
+            if not self.loaded:
+                self.load()
+            if self.vectors.matrix is None:
+                await asyncio.to_thread(self.vectors.open)
+            version = self.version
+            sections = self.sections
+            hashes = [
+                hashlib.sha256(f"{self.embedder.name}\n{section.text}".encode("utf-8")).hexdigest()
+                for section in sections
+            ]
+            if self.vectors.model == self.embedder.name and self.vectors.hashes == hashes:
+                self.vectors_version = version
+                return
+
+            existing = self.vectors.lookup(self.embedder.name)
+            missing = [index for index, text_hash in enumerate(hashes) if text_hash not in existing]
+            computed: Dict[int, List[float]] = {}
+            batch_size = max(1, self.embeddings.batch_size)
+            # Векторизация документации - фоновая работа, она уступает очередь запросам пользователей
+            with priority_lane(PRIORITY_BATCH):
+                for start in range(0, len(missing), batch_size):
+                    batch = missing[start:start + batch_size]
+                    vectors = await self.embedder.embed([sections[index].text for index in batch])
+                    computed.update(zip(batch, vectors))
+
+            rows = [
+                np.asarray(computed[index], dtype=np.float32) if index in computed
+                else self.vectors.row(existing[text_hash])
+                for index, text_hash in enumerate(hashes)
+            ]
+            dim = len(rows[0]) if rows else self.vectors.dim
+            matrix = np.vstack(rows) if rows else np.zeros((0, dim), dtype=np.float32)
+            # Пока матрица подменяется, семантический поиск не используется
+            self.vectors_version = ""
+            await asyncio.to_thread(self.vectors.replace, self.embedder.name, hashes, matrix)
+            self._query_vectors.clear()
+            self.vectors_version = version
+            self.embedded_total += len(missing)
+            self.reused_total += len(hashes) - len(missing)
+            logger.info(
+                "Векторный индекс обновлен: векторизовано разделов %s, взято из индекса %s",
+                len(missing), len(hashes) - len(missing)
+            )
+
+    @property
+    def semantic_ready(self) -> bool:
+        """Векторы соответствуют текущей версии документации"""
+        return self.embedder is not None and self.loaded and self.vectors_version == self.version
+
+    async def _query_vector(self, query: str) -> Any:
+        vector = self._query_vectors.get(query)
+        if vector is None:
+            # Короткий таймаут: медленный API эмбеддингов не задерживает поиск, используется BM25
+            vectors = await asyncio.wait_for(self.embedder.embed([query]), self.embeddings.query_timeout)
+            vector = np.asarray(vectors[0], dtype=np.float32)
+            self._query_vectors[query] = vector
+            if len(self._query_vectors) > self.embeddings.query_cache_size:
+                self._query_vectors.popitem(last=False)
+        else:
+            self._query_vectors.move_to_end(query)
+        return vector
+
+    async def retrieve(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        """
+        Гибридный поиск: BM25 и, если векторы готовы, косинусная близость эмбеддингов
+
+        Рейтинги объединяются по формуле RRF: score = сумма 1 / (RRF_K + место).
+        При ошибке векторизации запроса используется только BM25.
+
+        Returns:
+            Список разделов (title, source, score, bm25, similarity, text)
+        """
+        if not self.loaded:
+            self.load()
+        # Индекс может быть подменен перезагрузкой во время await - работаем с текущим снимком
+        sections, version = self.sections, self.version
+        candidates = max(top_k * 3, 10)
+        lexical = self.index.search(tokenize(query), candidates)
+        semantic: List = []
+        if self.semantic_ready:
+            try:
+                query_vector = await self._query_vector(query)
+                if self.vectors_version == version:
+                    semantic = self.vectors.search(query_vector, candidates)
+            except Exception as e:
+                logger.warning("Семантический поиск недоступен, используется BM25: %s", e or type(e).__name__)
+        self.searches_total += 1
+
+        if not semantic:
+            return [self._match(sections[doc_id], score, bm25=score) for doc_id, score in lexical[:top_k]]
+
+        fused: Dict[int, float] = {}
+        for ranking in (lexical, semantic):
+            for place, (doc_id, _) in enumerate(ranking):
+                fused[doc_id] = fused.get(doc_id, 0.0) + 1 / (RRF_K + place + 1)
+        bm25 = dict(lexical)
+        similarity = dict(semantic)
+        ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [
+            self._match(sections[doc_id], score, bm25=bm25.get(doc_id), similarity=similarity.get(doc_id))
+            for doc_id, score in ranked
+        ]
+
+    @staticmethod
+    def _match(section: Section,
+               score: float,
+               bm25: Optional[float] = None,
+               similarity: Optional[float] = None) -> Dict[str, Any]:
+        return {
+            "title": section.full_title,
+            "source": section.source,
+            "score": round(score, 4),
+            "bm25": round(bm25, 4) if bm25 is not None else None,
+            "similarity": round(similarity, 4) if similarity is not None else None,
+            "text": section.text
+        }
+
+    async def build_context(self, query: str, top_k: int, max_chars: int) -> str:
+        """Текст наиболее релевантных разделов для промпта, не длиннее max_chars"""
+        parts: List[str] = []
+        size = 0
+        for match in await self.retrieve(query, top_k):
+            text = match["text"]
+            if size + len(text) > max_chars:
+                text = text[:max(0, max_chars - size)]
+            if not text:
+                break
+            parts.append(text)
+            size += len(text) + 2
+        return "\n\n".join(parts)
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние индекса для эндпоинта /health"""
+        return {
+            "loaded": self.loaded,
+            "version": self.version,
+            "sections": len(self.sections),
+            "terms": len(self.index.postings),
+            "build_time": round(self.build_time, 4),
+            "searches_total": self.searches_total,
+            "embeddings": {
+                "model": self.embedder.name if self.embedder is not None else None,
+                "ready": self.semantic_ready,
+                "vectors": len(self.vectors),
+                "dim": self.vectors.dim,
+                "embedded_total": self.embedded_total,
+                "reused_total": self.reused_total
+            }
+        }
+
+# Глобальная база знаний ассистента
+knowledge_base = KnowledgeBase()
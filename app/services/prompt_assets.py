@@ -0,0 +1,187 @@
+import asyncio
+import hashlib
+import os
+import time
+from typing import Dict, Any, Optional, List, NamedTuple, Tuple
+import logging
+
+from app.config import assistant_config, AssistantConfig
+from app.services.knowledge import knowledge_base, KnowledgeBase
+
+logger = logging.getLogger("prompt_assets")
+
+class PromptTemplate(NamedTuple):
+    """
+    Неизменяемый шаблон системного промпта ассистента
+
+    Текст шаблона читается один раз при загрузке; на каждый запрос к нему
+    только дописываются разделы документации и текущая страница.
+    """
+
+    system_prompt: str
+    version: str
+    loaded_at: float
+
+    def render(self, platform_info: str = "", context: Optional[str] = None) -> str:
+        """Собирает системный промпт с разделами документации и текущей страницей"""
+        parts = [self.system_prompt]
+        if platform_info:
+            parts.append(f"\n\nДополнительная информация о веб-интерфейсе:\n{platform_info}")
+        if context:
+            parts.append(f"\nТекущая страница пользователя: {context}")
+        return "".join(parts)
+
+class PromptAssets:
+    """
+    Файлы, из которых собирается промпт ассистента: шаблон системного
+    промпта и база знаний
+
+    Файлы читаются один раз. Фоновая задача раз в assets_reload_interval
+    секунд сравнивает mtime и размер файлов и при изменении перечитывает их
+    и атомарно подменяет шаблон и индекс документации, поэтому правки
+    documentation.md, смонтированного в контейнер, подхватываются без перезапуска.
+    """
+
+    def __init__(self, config: AssistantConfig = assistant_config, knowledge: KnowledgeBase = knowledge_base):
+        self.config = config
+        self.knowledge = knowledge
+        self._template: Optional[PromptTemplate] = None
+        self._fingerprint: Tuple = ()
+        self._watch_task: Optional[asyncio.Task] = None
+        self._embeddings_task: Optional[asyncio.Task] = None
+        self._embeddings_pending = False
+        self.reloads_total = 0
+        self.reload_errors_total = 0
+        self.last_reload_at: Optional[float] = None
+
+    @property
+    def template(self) -> PromptTemplate:
+        """Текущий шаблон системного промпта (загружается при первом обращении)"""
+        if self._template is None:
+            self.load()
+        return self._template
+
+    @property
+    def version(self) -> str:
+        """Версия промпта: меняется при изменении шаблона или документации"""
+        return self.template.version
+
+    def _paths(self) -> List[str]:
+        return [self.config.system_prompt_path] + self.config.knowledge_paths
+
+    def _stat(self) -> Tuple:
+        """Отпечаток файлов: (путь, mtime, размер) - дешевая проверка без чтения содержимого"""
+        fingerprint = []
+        for path in self._paths():
+            try:
+                stat = os.stat(path)
+                fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                fingerprint.append((path, None, None))
+        return tuple(fingerprint)
+
+    def _read_template(self) -> str:
+        with open(self.config.system_prompt_path, "r", encoding="utf-8") as file:
+            return file.read()
+
+    def _make_template(self, system_prompt: str) -> PromptTemplate:
+        digest = hashlib.sha256(f"{system_prompt}\n{self.knowledge.version}".encode("utf-8"))
+        return PromptTemplate(system_prompt, digest.hexdigest()[:16], time.time())
+
+    def load(self) -> None:
+        """Синхронно загружает шаблон и базу знаний (при запуске сервиса)"""
+        fingerprint = self._stat()
+        system_prompt = self._read_template()
+        self.knowledge.load()
+        self._template = self._make_template(system_prompt)
+        self._fingerprint = fingerprint
+        logger.info("Промпт ассистента загружен, версия %s", self._template.version)
+
+    async def check(self) -> bool:
+        """
+        Перечитывает файлы, если они изменились с последней загрузки
+
+        Returns:
+            True, если шаблон или документация были перезагружены
+        """
+        fingerprint = await asyncio.to_thread(self._stat)
+        if fingerprint == self._fingerprint:
+            return False
+        try:
+            system_prompt = await asyncio.to_thread(self._read_template)
+            knowledge_changed = await self.knowledge.reload()
+        except Exception as e:
+            # Оставляем предыдущую версию: файл мог быть прочитан в момент записи
+            self.reload_errors_total += 1
+            logger.error("Ошибка перезагрузки промпта ассистента: %s", e)
+            return False
+        previous = self._template.version if self._template is not None else None
+        self._template = self._make_template(system_prompt)
+        self._fingerprint = fingerprint
+        self.reloads_total += 1
+        self.last_reload_at = time.time()
+        if self._template.version != previous:
+            logger.info("Промпт ассистента перезагружен, версия %s", self._template.version)
+        if knowledge_changed:
+            self._start_embeddings_sync()
+        return True
+
+    def _start_embeddings_sync(self) -> None:
+        """Векторизует измененные разделы в фоне"""
+        if self._embeddings_task is not None and not self._embeddings_task.done():
+            # Идущая векторизация повторится для новой версии после завершения
+            self._embeddings_pending = True
+            return
+        self._embeddings_task = asyncio.ensure_future(self._sync_embeddings())
+
+    async def _sync_embeddings(self) -> None:
+        while True:
+            self._embeddings_pending = False
+            try:
+                await self.knowledge.sync_embeddings()
+            except Exception as e:
+                logger.error("Ошибка векторизации документации, используется только BM25: %s", e)
+            if not self._embeddings_pending:
+                return
+
+    async def start(self) -> None:
+        """Загружает файлы, векторизует документацию и запускает наблюдение за изменениями"""
+        await asyncio.to_thread(self.load)
+        self._embeddings_task = asyncio.ensure_future(self._sync_embeddings())
+        if self.config.assets_reload_interval > 0:
+            self._watch_task = asyncio.ensure_future(self._watch())
+
+    async def stop(self) -> None:
+        for task in (self._watch_task, self._embeddings_task):
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(
+            *(task for task in (self._watch_task, self._embeddings_task) if task is not None),
+            return_exceptions=True
+        )
+        self._watch_task = None
+        self._embeddings_task = None
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.config.assets_reload_interval)
+            try:
+                await self.check()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Ошибка проверки файлов промпта: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние промпта для эндпоинта /health"""
+        return {
+            "version": self._template.version if self._template is not None else None,
+            "files": [path for path, mtime, _ in self._fingerprint if mtime is not None],
+            "reload_interval": self.config.assets_reload_interval,
+            "reloads_total": self.reloads_total,
+            "reload_errors_total": self.reload_errors_total,
+            "last_reload_at": self.last_reload_at
+        }
+
+# Глобальные ресурсы промпта ассистента
+prompt_assets = PromptAssets()
@@ -0,0 +1,102 @@
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, Optional, NamedTuple
+
+from app.config import assistant_config, AssistantConfig
+
+class _Session(NamedTuple):
+    session_id: str
+    version: str
+    last_used: float
+
+class UpstreamSessions:
+    """
+    Идентификаторы сессий GigaChat (заголовок X-Session-ID) для ассистента
+
+    GigaChat кэширует контекст запросов с одинаковым X-Session-ID, поэтому
+    общее начало промпта (системный промпт) и предыдущие реплики диалога не
+    обрабатываются заново при каждом вопросе. Сессия выдается на пару
+    (версия промпта, пользователь): при изменении шаблона или документации
+    сессия сменяется, так как закэшированный контекст больше не совпадает с
+    промптом. Запросы без user_id делят одну сессию на версию промпта - в
+    них нет истории, а системный промпт одинаков. Сессии хранятся в LRU с
+    ограничением по количеству и сменяются после session_ttl бездействия.
+
+    По блоку usage ответов подсчитывается, сколько токенов промпта API взял
+    из кэша (precached_prompt_tokens).
+    """
+
+    def __init__(self, config: AssistantConfig = assistant_config):
+        self.enabled = config.session_cache
+        self.ttl = config.session_ttl
+        self.max_entries = config.session_max_entries
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+
+        self.created_total = 0
+        self.rotations = 0
+        self.requests_total = 0
+        self.prompt_tokens = 0
+        self.precached_prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def session_id(self, user_id: Optional[str], version: str) -> Optional[str]:
+        """
+        Возвращает идентификатор сессии пользователя для текущей версии промпта
+
+        Args:
+            user_id: Идентификатор пользователя (None - общая сессия анонимных запросов)
+            version: Версия промпта ассистента
+
+        Returns:
+            Идентификатор сессии или None, если кэширование контекста отключено
+        """
+        if not self.enabled:
+            return None
+        key = user_id or ""
+        now = time.time()
+        session = self._sessions.get(key)
+        if session is not None and session.version == version and now - session.last_used < self.ttl:
+            self._sessions[key] = session._replace(last_used=now)
+            self._sessions.move_to_end(key)
+            return session.session_id
+
+        if session is not None and session.version != version:
+            self.rotations += 1
+        session = _Session(uuid.uuid4().hex, version, now)
+        self._sessions[key] = session
+        self._sessions.move_to_end(key)
+        self.created_total += 1
+        while len(self._sessions) > self.max_entries:
+            self._sessions.popitem(last=False)
+        return session.session_id
+
+    def forget(self, user_id: Optional[str]) -> None:
+        """Завершает сессию пользователя (например, при сбросе истории диалога)"""
+        self._sessions.pop(user_id or "", None)
+
+    def record_usage(self, usage: Optional[Dict[str, Any]]) -> None:
+        """Учитывает блок usage ответа API"""
+        if not usage:
+            return
+        self.requests_total += 1
+        self.prompt_tokens += usage.get("prompt_tokens") or 0
+        self.precached_prompt_tokens += usage.get("precached_prompt_tokens") or 0
+        self.completion_tokens += usage.get("completion_tokens") or 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика сессий для эндпоинта /health"""
+        return {
+            "enabled": self.enabled,
+            "sessions": len(self._sessions),
+            "created_total": self.created_total,
+            "rotations": self.rotations,
+            "requests_total": self.requests_total,
+            "prompt_tokens": self.prompt_tokens,
+            "precached_prompt_tokens": self.precached_prompt_tokens,
+            "precached_ratio": round(self.precached_prompt_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0,
+            "completion_tokens": self.completion_tokens
+        }
+
+# Глобальные сессии GigaChat ассистента
+upstream_sessions = UpstreamSessions()
@@ -0,0 +1,316 @@
+import asyncio
+import httpx
+import json
+from typing import Dict, Any, List, Optional, AsyncIterator, Set
+import logging
+
+from app.config import gigachat_config
+from app.utils.auth import token_manager
+from app.utils.http_client import http_client
+from app.utils.hedging import hedge_policy
+from app.utils.limiter import upstream_limiter, priority_lane, PRIORITY_BATCH
+from app.utils.metrics import UpstreamTimer, untimed, PHASE_TOKEN, PHASE_QUEUE
+from app.utils.resilience import CircuitBreaker, upstream_breaker, retry_policy, is_upstream_failure, parse_retry_after
+from app.utils.tokens import token_counter
+from app.utils.usage import token_usage, current_route
+
+logger = logging.getLogger("upstream")
+
+class GigaChatUpstream:
+    """Общая точка отправки запросов к GigaChat API (/chat/completions, /embeddings)"""
+
+    # Максимальное количество попыток с обновлением токена при 401
+    max_attempts = 2
+
+    # Заголовок сессии: запросы с одним идентификатором используют кэш контекста GigaChat
+    session_header = "X-Session-ID"
+
+    def __init__(self):
+        # Фоновые подсчеты токенов (ссылки нужны, чтобы задачи не были собраны сборщиком мусора)
+        self._calibration_tasks: Set[asyncio.Task] = set()
+
+    async def chat_completions(self,
+                               request_data: Dict[str, Any],
+                               session_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Отправляет запрос к /chat/completions через общий пул соединений
+
+        Args:
+            request_data: Тело запроса (модель, сообщения, параметры генерации)
+            session_id: Идентификатор сессии для кэширования контекста на стороне API
+
+        Returns:
+            Распарсенный JSON-ответ API
+        """
+        self._calibrate(request_data)
+        # Для эндпоинтов из HEDGE_ENDPOINTS медленный запрос дублируется, используется первый ответ
+        response_data = await hedge_policy.call(
+            current_route(),
+            lambda: self._post("/chat/completions", request_data, session_id)
+        )
+        token_usage.record(response_data.get("usage"))
+        return response_data
+
+    async def count_tokens(self, texts: List[str], model: str) -> List[int]:
+        """
+        Подсчитывает токены текстов через /tokens/count
+
+        Args:
+            texts: Тексты для подсчета
+            model: Модель, токенизатор которой используется
+
+        Returns:
+            Число токенов каждого текста в порядке исходных текстов
+        """
+        response_data = await self._post("/tokens/count", {"model": model, "input": texts})
+        if not isinstance(response_data, list) or len(response_data) != len(texts):
+            raise ValueError("API вернул подсчет токенов не для всех текстов")
+        return [int(item["tokens"]) for item in response_data]
+
+    def _calibrate(self, request_data: Dict[str, Any]) -> None:
+        """Отправляет тексты выборки промптов на точный подсчет токенов в фоне"""
+        if not token_counter.should_calibrate():
+            return
+        texts = [message["content"] for message in request_data.get("messages", []) if message.get("content")]
+        if texts:
+            task = asyncio.ensure_future(self._count_in_background(texts, request_data.get("model", "")))
+            self._calibration_tasks.add(task)
+            task.add_done_callback(self._calibration_tasks.discard)
+
+    async def _count_in_background(self, texts: List[str], model: str) -> None:
+        try:
+            # Подсчет не срочный, уступает место запросам пользователей и не входит в их Server-Timing
+            with priority_lane(PRIORITY_BATCH), untimed():
+                counts = await self.count_tokens(texts, model)
+        except Exception as e:
+            token_counter.calibration_errors += 1
+            logger.warning("Не удалось подсчитать токены через API: %s", e)
+            return
+        for text, tokens in zip(texts, counts):
+            token_counter.record_exact(text, tokens)
+
+    async def embeddings(self, texts: List[str], model: str) -> List[List[float]]:
+        """
+        Вычисляет векторные представления текстов через /embeddings
+
+        Args:
+            texts: Тексты для векторизации
+            model: Модель эмбеддингов (например, Embeddings)
+
+        Returns:
+            Векторы в порядке исходных текстов
+        """
+        # Сбои /embeddings не размыкают выключатель: при них поиск продолжает работать по BM25,
+        # а ответы модели не должны отключаться из-за недоступности эмбеддингов
+        response_data = await self._post("/embeddings", {"model": model, "input": texts}, breaker=None)
+        items = sorted(response_data.get("data", []), key=lambda item: item.get("index", 0))
+        if len(items) != len(texts):
+            raise ValueError(f"API вернул {len(items)} векторов для {len(texts)} текстов")
+        return [item["embedding"] for item in items]
+
+    def _headers(self, auth_token: str, accept: str, session_id: Optional[str] = None) -> Dict[str, str]:
+        headers = {
+            "Authorization": f"Bearer {auth_token}",
+            "Content-Type": "application/json",
+            "Accept": accept
+        }
+        if session_id:
+            headers[self.session_header] = session_id
+        return headers
+
+    async def _post(self,
+                    path: str,
+                    request_data: Dict[str, Any],
+                    session_id: Optional[str] = None,
+                    breaker: Optional[CircuitBreaker] = upstream_breaker) -> Any:
+        """
+        Отправляет POST-запрос к API
+
+        При 401 токен обновляется и запрос повторяется. При 429, 5xx и сетевых
+        ошибках запрос повторяется с задержкой в пределах бюджета повторов.
+        Пока выключатель разомкнут, запрос сразу завершается CircuitOpenError
+        (breaker=None - запрос не проверяет выключатель и не влияет на него).
+        Время фаз запроса записывается в метрики и заголовок Server-Timing.
+        """
+        timer = UpstreamTimer(path)
+        try:
+            return await self._post_attempts(path, request_data, session_id, timer, breaker)
+        finally:
+            timer.finish()
+
+    async def _post_attempts(self,
+                             path: str,
+                             request_data: Dict[str, Any],
+                             session_id: Optional[str],
+                             timer: UpstreamTimer,
+                             breaker: Optional[CircuitBreaker]) -> Any:
+        retry_policy.record_request()
+        attempt = 0
+        auth_attempts = 0
+        while True:
+            attempt += 1
+            if breaker is not None:
+                breaker.before_call()
+            with timer.measure(PHASE_TOKEN):
+                auth_token = await token_manager.get_token()
+            logger.debug("Отправка запроса к GigaChat API %s (попытка %s)", path, attempt)
+            try:
+                # Число одновременных запросов ограничено адаптивным лимитом
+                async with upstream_limiter.slot() as slot:
+                    timer.record(PHASE_QUEUE, slot.wait)
+                    response = await http_client.client.post(
+                        f"{gigachat_config.api_base_url}{path}",
+                        headers=self._headers(auth_token, "application/json", session_id),
+                        json=request_data,
+                        extensions=timer.extensions
+                    )
+                    slot.record(response.status_code)
+            except httpx.TransportError as e:
+                if breaker is not None:
+                    breaker.record_failure()
+                if await self._backoff(attempt, None, f"{type(e).__name__}: {e}"):
+                    continue
+                raise
+            if is_upstream_failure(response.status_code):
+                if breaker is not None:
+                    breaker.record_failure()
+                if await self._backoff(attempt, response, f"HTTP {response.status_code}"):
+                    continue
+            elif breaker is not None:
+                breaker.record_success()
+            try:
+                response.raise_for_status()
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code == 401 and auth_attempts < self.max_attempts - 1:
+                    # Если токен истек, принудительно обновляем его и повторяем запрос
+                    auth_attempts += 1
+                    logger.warning("Получена ошибка авторизации 401. Принудительное обновление токена...")
+                    await token_manager.refresh_token(stale_token=auth_token)
+                    continue
+                logger.error("HTTP ошибка при запросе к API: %s %s", e.response.status_code, e.response.text)
+                raise
+            return response.json()
+
+    async def _backoff(self, attempt: int, response: Optional[httpx.Response], reason: str) -> bool:
+        """Ждет перед повтором неудачной попытки; возвращает False, если повторять нельзя"""
+        retry_after = parse_retry_after(response.headers.get("Retry-After")) if response is not None else None
+        delay = retry_policy.delay(attempt, retry_after)
+        if delay is None:
+            return False
+        logger.warning("Ошибка GigaChat API (%s), повтор через %.2f с (попытка %s)", reason, delay, attempt + 1)
+        await asyncio.sleep(delay)
+        return True
+
+    async def stream_chat_completions(self,
+                                      request_data: Dict[str, Any],
+                                      priority: Optional[int] = None,
+                                      session_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Отправляет потоковый запрос к /chat/completions ("stream": true)
+
+        Запрос повторяется по тем же правилам, что и обычный, но только до
+        получения первого фрагмента ответа.
+
+        Args:
+            request_data: Тело запроса (модель, сообщения, параметры генерации)
+            priority: Полоса ограничителя запросов; по умолчанию из priority_lane
+            session_id: Идентификатор сессии для кэширования контекста на стороне API
+
+        Yields:
+            Распарсенные SSE-события API (фрагменты ответа с полем delta)
+        """
+        payload = dict(request_data, stream=True)
+        self._calibrate(request_data)
+        # Отдельная метка: время до заголовков потокового ответа - это время до первого токена, а не вся генерация
+        timer = UpstreamTimer("/chat/completions:stream")
+        attempts = self._stream_attempts(payload, priority, session_id, timer)
+        try:
+            async for chunk in attempts:
+                yield chunk
+        finally:
+            await attempts.aclose()
+            timer.finish()
+
+    async def _stream_attempts(self,
+                               payload: Dict[str, Any],
+                               priority: Optional[int],
+                               session_id: Optional[str],
+                               timer: UpstreamTimer) -> AsyncIterator[Dict[str, Any]]:
+        retry_policy.record_request()
+        attempt = 0
+        auth_attempts = 0
+        while True:
+            attempt += 1
+            upstream_breaker.before_call()
+            with timer.measure(PHASE_TOKEN):
+                auth_token = await token_manager.get_token()
+            streaming = False
+            failed: Optional[httpx.Response] = None
+            try:
+                async with upstream_limiter.slot(priority) as slot, http_client.client.stream(
+                    "POST",
+                    f"{gigachat_config.api_base_url}/chat/completions",
+                    headers=self._headers(auth_token, "text/event-stream", session_id),
+                    json=payload,
+                    extensions=timer.extensions
+                ) as response:
+                    timer.record(PHASE_QUEUE, slot.wait)
+                    # Задержка для лимита - время до заголовков, без генерации всего ответа
+                    slot.record(response.status_code)
+                    if response.status_code >= 400:
+                        # Ошибка разбирается после выхода из блока: место в ограничителе и
+                        # соединение не удерживаются во время паузы перед повтором и обновления токена
+                        await response.aread()
+                        failed = response
+                    else:
+                        upstream_breaker.record_success()
+                        streaming = True
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[len("data:"):].strip()
+                            if data == "[DONE]":
+                                return
+                            chunk = json.loads(data)
+                            # Блок usage приходит в последнем фрагменте
+                            token_usage.record(chunk.get("usage"))
+                            yield chunk
+                        return
+            except httpx.TransportError as e:
+                upstream_breaker.record_failure()
+                # После начала ответа повтор невозможен: часть фрагментов уже передана
+                if not streaming and await self._backoff(attempt, None, f"{type(e).__name__}: {e}"):
+                    continue
+                raise
+
+            if is_upstream_failure(failed.status_code):
+                upstream_breaker.record_failure()
+                if await self._backoff(attempt, failed, f"HTTP {failed.status_code}"):
+                    continue
+            else:
+                upstream_breaker.record_success()
+            if failed.status_code == 401 and auth_attempts < self.max_attempts - 1:
+                auth_attempts += 1
+                logger.warning("Получена ошибка авторизации 401. Принудительное обновление токена...")
+                await token_manager.refresh_token(stale_token=auth_token)
+                continue
+            logger.error("HTTP ошибка при потоковом запросе к API: %s %s", failed.status_code, failed.text)
+            failed.raise_for_status()
+
+    @staticmethod
+    def extract_delta(chunk: Dict[str, Any]) -> str:
+        """Извлекает текст фрагмента потокового ответа"""
+        if chunk.get("choices"):
+            return chunk["choices"][0].get("delta", {}).get("content") or ""
+        return ""
+
+    @staticmethod
+    def extract_content(response_data: Dict[str, Any]) -> Optional[str]:
+        """Извлекает текст первого варианта ответа или None, если его нет"""
+        if response_data.get("choices") and len(response_data["choices"]) > 0:
+            message = response_data["choices"][0].get("message", {})
+            return message.get("content", "").strip()
+        return None
+
+# Глобальный экземпляр клиента GigaChat API
+gigachat_upstream = GigaChatUpstream()
@@ -1,114 +1,299 @@
 import httpx
+import asyncio
 import base64
+import os
+import random
+import socket
+import sqlite3
 from typing import Optional, Dict, Any
 import time
 from app.config import gigachat_config
-import certifi
-import ssl
+from app.utils.http_client import http_client
+from app.utils.token_store import TokenStore, create_token_store
 import uuid
 import logging
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("auth")
 
+# Время жизни токена по умолчанию, если API не вернул срок действия (30 минут)
+DEFAULT_TOKEN_LIFETIME = 1800
+# Интервал проверки общего хранилища, пока токен обновляет другой воркер
+LEASE_POLL_INTERVAL = 0.5
+# Таймаут одного запроса к OAuth API
+OAUTH_TIMEOUT = 30.0
+
+class LeaseLostError(Exception):
+    """Аренда обновления токена истекла и перешла к другому воркеру"""
+
 class TokenManager:
-    """Класс для управления токенами аутентификации GigaChat API"""
-    
-    def __init__(self):
+    """
+    Класс для управления токенами аутентификации GigaChat API
+
+    Все одновременные обращения ожидают одно общее обновление токена,
+    а сам токен обновляется заранее - за token_refresh_margin секунд до истечения.
+    При общем хранилище (GIGACHAT_TOKEN_STORE=sqlite) токен запрашивает только
+    воркер, захвативший аренду, остальные берут готовый токен из хранилища.
+    """
+
+    def __init__(self, store: Optional[TokenStore] = None):
+        self.store = store or create_token_store()
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
         self.access_token: Optional[str] = None
         self.token_expires_at: Optional[float] = None
         self.config = gigachat_config
-        # Отключаем проверку SSL для тестовых сертификатов
-        self.verify_ssl = False
-        self.token_refresh_attempts = 0
-        self.max_refresh_attempts = 3
+        self.refresh_margin = self.config.token_refresh_margin
+        self.max_refresh_attempts = self.config.token_max_refresh_attempts
+        self._refresh_task: Optional[asyncio.Task] = None
+
+        # Счетчики для мониторинга
+        self.refresh_total = 0
+        self.refresh_failures_total = 0
+        self.shared_tokens_adopted_total = 0
+        self.refresh_attempts_total = 0
+        self.last_refresh_latency: Optional[float] = None
+        self.refresh_latency_sum = 0.0
+        self.last_refresh_at: Optional[float] = None
+        self.last_error: Optional[str] = None
         logger.info("Инициализация TokenManager")
-        
+
+    def is_valid(self) -> bool:
+        """Есть ли неистекший токен"""
+        return bool(self.access_token) and self.token_expires_at is not None and time.time() < self.token_expires_at
+
+    def needs_refresh(self) -> bool:
+        """Пора ли обновлять токен (истек или истекает в пределах запаса)"""
+        if not self.access_token or self.token_expires_at is None:
+            return True
+        return time.time() >= self.token_expires_at - self.refresh_margin
+
+    def expires_in(self) -> Optional[int]:
+        """Сколько секунд осталось до истечения токена"""
+        if self.token_expires_at is None:
+            return None
+        return int(self.token_expires_at - time.time())
+
     async def get_token(self) -> str:
         """Получение токена авторизации, с обновлением при необходимости"""
-        if not self.access_token or time.time() >= self.token_expires_at:
-            logger.info("Токен отсутствует или истек, получаем новый")
-            await self.refresh_token()
-        return self.access_token
-    
-    async def refresh_token(self) -> str:
-        """Обновление токена доступа через API GigaChat"""
-        self.token_refresh_attempts += 1
+        if not self.needs_refresh():
+            return self.access_token
+
+        if self.is_valid():
+            # Токен еще действует: обновляем его в фоне, не задерживая запрос
+            self._start_refresh(self.access_token)
+            return self.access_token
+
+        logger.info("Токен отсутствует или истек, получаем новый")
+        return await self.refresh_token()
+
+    async def refresh_token(self, stale_token: Optional[str] = None) -> str:
+        """
+        Обновление токена доступа через API GigaChat
+
+        Если обновление уже выполняется, вызывающий ожидает его результат
+        вместо повторного запроса к OAuth.
+
+        Args:
+            stale_token: Токен, отклоненный API (401). Если он уже заменен
+                действующим токеном, повторное обновление не выполняется.
+        """
+        if stale_token is not None and stale_token != self.access_token and self.is_valid():
+            return self.access_token
+        if stale_token is None:
+            stale_token = self.access_token
+        # shield: отмена одного из ожидающих запросов не прерывает общее обновление
+        return await asyncio.shield(self._start_refresh(stale_token))
+
+    def _start_refresh(self, stale_token: Optional[str]) -> asyncio.Task:
+        """Запускает обновление токена, если оно еще не выполняется"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._refresh(stale_token))
+            self._refresh_task.add_done_callback(self._consume_task_exception)
+        return self._refresh_task
+
+    @staticmethod
+    def _consume_task_exception(task: asyncio.Task) -> None:
+        # Фоновое обновление может завершиться ошибкой, которую никто не ожидает
+        if not task.cancelled():
+            task.exception()
+
+    def _backoff_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Экспоненциальная задержка со случайным разбросом (или Retry-After от сервера)"""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.config.token_backoff_max)
+            except ValueError:
+                pass
+        delay = min(self.config.token_backoff_max, self.config.token_backoff_base * (2 ** (attempt - 1)))
+        return random.uniform(delay / 2, delay)
+
+    async def _refresh(self, stale_token: Optional[str]) -> str:
+        """Обновляет токен, согласуя обновление с другими воркерами через хранилище"""
+        if not self.store.shared:
+            return await self._refresh_with_retries()
+
         try:
-            logger.info(f"Попытка обновления токена #{self.token_refresh_attempts} (планировщик или API запрос)")
-            headers = {
-                "Content-Type": "application/x-www-form-urlencoded",
-                "Accept": "application/json",
-                "RqUID": str(uuid.uuid4())
-            }
+            while True:
+                if await self._adopt_shared_token(stale_token):
+                    return self.access_token
+                if await self.store.acquire_lease(self.worker_id, self.config.token_lease_ttl):
+                    try:
+                        # Токен мог обновить предыдущий владелец аренды
+                        if await self._adopt_shared_token(stale_token):
+                            return self.access_token
+                        try:
+                            token = await self._refresh_with_retries(renew_lease=True)
+                        except LeaseLostError:
+                            # Обновление продолжает новый владелец аренды - ждем его токен
+                            logger.warning("Аренда обновления токена перешла к другому воркеру")
+                            await asyncio.sleep(LEASE_POLL_INTERVAL)
+                            continue
+                        try:
+                            await self.store.save(token, self.token_expires_at)
+                        except (sqlite3.Error, OSError) as e:
+                            logger.error("Не удалось сохранить токен в общее хранилище: %s", e)
+                        return token
+                    finally:
+                        await self.store.release_lease(self.worker_id)
+                # Токен обновляет другой воркер - ждем, пока он появится в хранилище
+                await asyncio.sleep(LEASE_POLL_INTERVAL)
+        except (sqlite3.Error, OSError) as e:
+            logger.error("Ошибка общего хранилища токена, запрашиваем токен напрямую: %s", e)
+            return await self._refresh_with_retries()
+
+    async def _adopt_shared_token(self, stale_token: Optional[str]) -> bool:
+        """Берет токен из общего хранилища, если он новее отклоненного и не истекает"""
+        shared = await self.store.load()
+        if shared is None or shared["access_token"] == stale_token:
+            return False
+        if shared["expires_at"] - self.refresh_margin <= time.time():
+            return False
+        self.access_token = shared["access_token"]
+        self.token_expires_at = shared["expires_at"]
+        self.shared_tokens_adopted_total += 1
+        logger.info("Получен токен из общего хранилища, истекает через %s секунд", self.expires_in())
+        return True
+
+    async def _refresh_with_retries(self, renew_lease: bool = False) -> str:
+        """
+        Получает токен, повторяя попытки при 429, 5xx и сетевых ошибках
 
-            if self.config.auth_key:
-                # Используем Authorization Key
-                auth_string = f"{self.config.client_id}:{self.config.client_secret}"
-                auth_bytes = auth_string.encode('ascii')
-                base64_auth = base64.b64encode(auth_bytes).decode('ascii')
-                headers["Authorization"] = f"Basic {base64_auth}"
-                data = {
-                    "scope": self.config.scope,
-                    "grant_type": "client_credentials"
-                }
+        Args:
+            renew_lease: Продлевать аренду в общем хранилище перед каждой попыткой,
+                чтобы она не истекла посреди обновления с повторами.
+        """
+        started_at = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            if renew_lease and not await self.store.acquire_lease(self.worker_id, self.config.token_lease_ttl):
+                raise LeaseLostError()
+            self.refresh_attempts_total += 1
+            try:
+                logger.info("Попытка обновления токена #%s", attempt)
+                token = await self._request_token()
+            except httpx.HTTPStatusError as e:
+                status = e.response.status_code
+                logger.error("HTTP ошибка при получении токена: %s %s", status, e.response.text)
+                retryable = status == 429 or status >= 500
+                if not retryable or attempt >= self.max_refresh_attempts:
+                    self._record_failure(e)
+                    raise
+                wait_time = self._backoff_delay(attempt, e.response.headers.get("Retry-After"))
+            except Exception as e:
+                logger.error("Неожиданная ошибка при получении токена: %s", e)
+                if attempt >= self.max_refresh_attempts:
+                    self._record_failure(e)
+                    raise
+                wait_time = self._backoff_delay(attempt)
             else:
-                # Используем Client ID и Client Secret
-                data = {
-                    "scope": self.config.scope,
-                    "grant_type": "client_credentials",
-                    "client_id": self.config.client_id,
-                    "client_secret": self.config.client_secret
-                }
-
-            # Создаем клиент с отключенной проверкой SSL
-            async with httpx.AsyncClient(verify=self.verify_ssl) as client:
-                logger.info(f"Отправка запроса на получение токена к {self.config.auth_url}")
-                response = await client.post(
-                    self.config.auth_url,
-                    headers=headers,
-                    data=data,
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                token_data = response.json()
-                
-                self.access_token = token_data["access_token"]
-                
-                # Проверяем наличие поля expires_in в ответе
-                if "expires_in" in token_data:
-                    self.token_expires_at = time.time() + token_data["expires_in"]
-                    expiry_seconds = token_data["expires_in"]
-                elif "expires_at" in token_data:
-                    # Если есть поле expires_at, используем его
-                    self.token_expires_at = token_data["expires_at"]
-                    expiry_seconds = self.token_expires_at - time.time()
-                else:
-                    # Если нет ни одного поля, устанавливаем время истечения по умолчанию (30 минут)
-                    self.token_expires_at = 1800
-                    expiry_seconds = 1800
-                
-                logger.info(f"Получен новый токен, истекает через {int(expiry_seconds)} секунд (осталось {int(expiry_seconds/60)} минут)")
-                self.token_refresh_attempts = 0  # Сбрасываем счетчик попыток после успеха
-                return self.access_token
-
-        except httpx.HTTPStatusError as e:
-            logger.error(f"HTTP ошибка при получении токена: {e.response.status_code} {e.response.text}")
-            if e.response.status_code == 429 and self.token_refresh_attempts < self.max_refresh_attempts:
-                wait_time = 5 * self.token_refresh_attempts
-                logger.warning(f"Слишком много запросов. Ожидание {wait_time} секунд перед следующей попыткой")
-                time.sleep(wait_time)
-                return await self.refresh_token()
-            raise
-        except Exception as e:
-            logger.error(f"Неожиданная ошибка при получении токена: {str(e)}")
-            if self.token_refresh_attempts < self.max_refresh_attempts:
-                wait_time = 5 * self.token_refresh_attempts
-                logger.warning(f"Ожидание {wait_time} секунд перед следующей попыткой")
-                time.sleep(wait_time)
-                return await self.refresh_token()
-            raise
+                latency = time.monotonic() - started_at
+                self.refresh_total += 1
+                self.last_refresh_latency = latency
+                self.refresh_latency_sum += latency
+                self.last_refresh_at = time.time()
+                self.last_error = None
+                return token
+
+            logger.warning("Ожидание %.1f секунд перед следующей попыткой", wait_time)
+            await asyncio.sleep(wait_time)
+
+    def _record_failure(self, error: Exception) -> None:
+        self.refresh_failures_total += 1
+        self.last_error = str(error)
+
+    async def _request_token(self) -> str:
+        """Один запрос к OAuth API GigaChat"""
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Accept": "application/json",
+            "RqUID": str(uuid.uuid4())
+        }
+
+        if self.config.auth_key:
+            # Используем Authorization Key
+            auth_string = f"{self.config.client_id}:{self.config.client_secret}"
+            auth_bytes = auth_string.encode('ascii')
+            base64_auth = base64.b64encode(auth_bytes).decode('ascii')
+            headers["Authorization"] = f"Basic {base64_auth}"
+            data = {
+                "scope": self.config.scope,
+                "grant_type": "client_credentials"
+            }
+        else:
+            # Используем Client ID и Client Secret
+            data = {
+                "scope": self.config.scope,
+                "grant_type": "client_credentials",
+                "client_id": self.config.client_id,
+                "client_secret": self.config.client_secret
+            }
+
+        # Используем общий пул соединений приложения
+        logger.debug("Отправка запроса на получение токена к %s", self.config.auth_url)
+        response = await http_client.client.post(
+            self.config.auth_url,
+            headers=headers,
+            data=data,
+            timeout=OAUTH_TIMEOUT
+        )
+        response.raise_for_status()
+        token_data = response.json()
+
+        self.token_expires_at = self._parse_expiry(token_data)
+        self.access_token = token_data["access_token"]
+
+        expiry_seconds = self.token_expires_at - time.time()
+        logger.info("Получен новый токен, истекает через %s секунд", int(expiry_seconds))
+        return self.access_token
+
+    @staticmethod
+    def _parse_expiry(token_data: Dict[str, Any]) -> float:
+        """Возвращает время истечения токена (unix-время в секундах)"""
+        if "expires_in" in token_data:
+            return time.time() + float(token_data["expires_in"])
+        if "expires_at" in token_data:
+            expires_at = float(token_data["expires_at"])
+            # GigaChat возвращает expires_at в миллисекундах
+            if expires_at > 1e12:
+                expires_at /= 1000
+            return expires_at
+        # Если нет ни одного поля, устанавливаем время истечения по умолчанию
+        return time.time() + DEFAULT_TOKEN_LIFETIME
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика обновлений токена для эндпоинта /health"""
+        return {
+            "refresh_in_progress": self._refresh_task is not None and not self._refresh_task.done(),
+            "refresh_total": self.refresh_total,
+            "refresh_attempts_total": self.refresh_attempts_total,
+            "refresh_failures_total": self.refresh_failures_total,
+            "shared_tokens_adopted_total": self.shared_tokens_adopted_total,
+            "store": self.store.describe(),
+            "last_refresh_latency": round(self.last_refresh_latency, 4) if self.last_refresh_latency is not None else None,
+            "avg_refresh_latency": round(self.refresh_latency_sum / self.refresh_total, 4) if self.refresh_total else None,
+            "last_refresh_at": self.last_refresh_at,
+            "last_error": self.last_error
+        }
 
 # Глобальный экземпляр менеджера токенов
-token_manager = TokenManager() 
\ No newline at end of file
+token_manager = TokenManager()
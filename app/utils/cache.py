@@ -0,0 +1,167 @@
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, NamedTuple
+
+from app.config import cache_config, CacheConfig
+from app.utils.disk_cache import DiskCache, create_disk_cache
+
+# Режимы работы кэша для отдельного запроса
+CACHE_USE = "use"          # вернуть ответ из кэша, если он есть
+CACHE_BYPASS = "bypass"    # не читать и не записывать кэш
+CACHE_REFRESH = "refresh"  # получить новый ответ и перезаписать запись в кэше
+CACHE_MODES = (CACHE_USE, CACHE_BYPASS, CACHE_REFRESH)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_prompt(prompt: str) -> str:
+    """Нормализует промпт для ключа кэша (схлопывает пробельные символы)"""
+    return _WHITESPACE_RE.sub(" ", prompt).strip()
+
+def make_cache_key(*parts: Any) -> str:
+    """Строит ключ кэша из частей запроса (промпт, модель, параметры генерации)"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class _CacheEntry(NamedTuple):
+    value: str
+    size: int
+    expires_at: float
+
+class ResponseCache:
+    """
+    LRU-кэш ответов GigaChat в памяти процесса с ограничением по TTL,
+    количеству записей и суммарному размеру значений
+    """
+
+    def __init__(self, config: CacheConfig = cache_config):
+        self.enabled = config.enabled
+        self.max_entries = config.max_entries
+        self.max_bytes = config.max_bytes
+        self.ttl = config.ttl
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[str]:
+        """Возвращает значение из кэша или None"""
+        if not self.enabled:
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= time.time():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        """
+        Сохраняет значение, вытесняя самые старые записи при превышении лимитов
+
+        Args:
+            ttl: Время жизни записи в секундах (по умолчанию RESPONSE_CACHE_TTL)
+        """
+        if not self.enabled:
+            return
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = _CacheEntry(value, size, time.time() + (ttl if ttl is not None else self.ttl))
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        if key in self._entries:
+            self._remove(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика кэша для эндпоинта /health"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+class TieredResponseCache:
+    """
+    Двухуровневый кэш ответов: быстрый LRU в памяти процесса и постоянный
+    дисковый уровень, общий для воркеров и переживающий перезапуск.
+
+    При промахе в памяти значение читается с диска и поднимается в память
+    не дольше, чем осталось жить дисковой записи; новые значения записываются в оба уровня.
+    """
+
+    def __init__(self, memory: ResponseCache, disk: Optional[DiskCache] = None):
+        self.memory = memory
+        self.disk = disk
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory.enabled
+
+    async def get(self, key: str) -> Optional[str]:
+        """Возвращает значение из памяти или с диска"""
+        if not self.enabled:
+            return None
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            entry = await self.disk.get_entry(key)
+            if entry is not None:
+                value, expires_at = entry
+                self.memory.set(key, value, ttl=min(self.memory.ttl, expires_at - time.time()))
+        return value
+
+    async def set(self, key: str, value: str) -> None:
+        """Записывает значение в память и на диск"""
+        if not self.enabled:
+            return
+        self.memory.set(key, value)
+        if self.disk is not None:
+            await self.disk.set(key, value)
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика обоих уровней кэша для эндпоинта /health"""
+        stats = self.memory.stats()
+        stats["disk"] = self.disk.stats() if self.disk is not None else None
+        return stats
+
+# Глобальный кэш ответов GigaChat (улучшение текста и ассистент)
+response_cache = TieredResponseCache(ResponseCache(), create_disk_cache())
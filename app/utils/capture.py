@@ -0,0 +1,268 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from typing import Dict, Any, List, Optional
+from urllib.parse import parse_qsl
+
+from app.config import capture_config, CaptureConfig
+from app.utils.log import current_request_id
+from app.utils.metrics import current_timings
+from app.utils.usage import current_usage
+
+logger = logging.getLogger("capture")
+
+# Поля параметров и тела запроса, содержащие промпт (текст для улучшения или вопрос)
+PROMPT_FIELDS = ("text", "query")
+
+def prompt_hash(text: str) -> str:
+    """Короткий хэш промпта: одинаковые вопросы можно найти в журнале без чтения текста"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+def _decode_body(body: bytes, content_type: str) -> Any:
+    if not body:
+        return None
+    text = body.decode("utf-8", errors="replace")
+    if content_type.startswith("application/json"):
+        try:
+            return json.loads(text)
+        except ValueError:
+            pass
+    return text
+
+def _find_prompt(params: Dict[str, str], body: Any) -> Optional[str]:
+    for source in (params, body):
+        if isinstance(source, dict):
+            for field in PROMPT_FIELDS:
+                if isinstance(source.get(field), str):
+                    return source[field]
+    if isinstance(body, str):
+        return body
+    if body is not None:
+        # Пакет текстов: хэшируется тело целиком
+        return json.dumps(body, ensure_ascii=False, sort_keys=True)
+    return None
+
+class CaptureLog:
+    """
+    Журнал запросов к эндпоинтам сервиса в формате JSONL
+
+    Обработчик запроса только кладет сырые данные в очередь. Фоновая задача
+    забирает записи пакетами, а разбор тела, хэширование и запись в файл
+    выполняет в пуле потоков, так что запрос не ждет файлового ввода-вывода.
+    При переполнении очереди записи отбрасываются. Файл переименовывается
+    (capture.jsonl.1, .2 и т.д.) при превышении max_bytes.
+    """
+
+    def __init__(self, config: CaptureConfig = capture_config):
+        self.enabled = config.enabled
+        self.sample_rate = config.sample_rate
+        self.endpoints = tuple(config.endpoint_prefixes)
+        self.path = config.path
+        self.max_bytes = config.max_bytes
+        self.backup_count = config.backup_count
+        self.payloads = config.payloads
+        self.max_body_bytes = config.max_body_bytes
+        self.batch_size = max(1, config.batch_size)
+        self.flush_interval = config.flush_interval
+        self.queue_size = config.queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.captured_total = 0
+        self.dropped_total = 0
+        self.written_total = 0
+        self.write_errors = 0
+        self.rotations = 0
+
+    def should_capture(self, scope: Dict[str, Any]) -> bool:
+        """Попадает ли запрос в журнал (эндпоинт из списка и запрос в выборке)"""
+        if self._queue is None or not scope.get("path", "").startswith(self.endpoints):
+            return False
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def submit(self, record: Dict[str, Any]) -> None:
+        """Ставит запись в очередь на запись (без ожидания)"""
+        if self._queue is None:
+            return
+        try:
+            self._queue.put_nowait(record)
+            self.captured_total += 1
+        except asyncio.QueueFull:
+            self.dropped_total += 1
+
+    async def start(self) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._task = asyncio.create_task(self._writer(self._queue))
+        logger.info("Запросы записываются в %s (доля %.2f)", self.path, self.sample_rate)
+
+    async def stop(self) -> None:
+        """Останавливает запись, дописав записи из очереди"""
+        if self._task is None:
+            return
+        queue, self._queue = self._queue, None
+        await queue.put(None)
+        await self._task
+        self._task = None
+
+    async def _writer(self, queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            batch = []
+            record = await queue.get()
+            deadline = loop.time() + self.flush_interval
+            while record is not None:
+                batch.append(record)
+                timeout = deadline - loop.time()
+                if len(batch) >= self.batch_size or timeout <= 0:
+                    break
+                try:
+                    record = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            # None в очереди - сигнал остановки
+            stopping = record is None
+            if batch:
+                await loop.run_in_executor(None, self._write, batch)
+
+    def _serialize(self, raw: Dict[str, Any]) -> str:
+        params = dict(parse_qsl(raw.pop("query_string").decode("latin-1"), keep_blank_values=True))
+        body = _decode_body(raw.pop("body") or b"", raw.get("content_type") or "")
+        prompt = _find_prompt(params, body)
+        record = dict(raw)
+        if prompt is not None:
+            record["prompt_hash"] = prompt_hash(prompt)
+            record["prompt_chars"] = len(prompt)
+        if self.payloads:
+            record["params"] = params
+            record["body"] = body
+        return json.dumps(record, ensure_ascii=False)
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        try:
+            data = "".join(self._serialize(raw) + "\n" for raw in batch).encode("utf-8")
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            try:
+                size = os.path.getsize(self.path)
+            except OSError:
+                size = 0
+            if size and size + len(data) > self.max_bytes:
+                self._rotate()
+            with open(self.path, "ab") as f:
+                f.write(data)
+            self.written_total += len(batch)
+        except Exception as e:
+            self.write_errors += 1
+            logger.error("Ошибка записи журнала запросов %s: %s", self.path, e)
+
+    def _rotate(self) -> None:
+        """Сдвигает файлы журнала: capture.jsonl -> .1 -> .2 ..., самый старый удаляется"""
+        if self.backup_count <= 0:
+            os.remove(self.path)
+            return
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        self.rotations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние журнала для эндпоинта /health"""
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "path": self.path,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "captured_total": self.captured_total,
+            "written_total": self.written_total,
+            "dropped_total": self.dropped_total,
+            "write_errors": self.write_errors,
+            "rotations": self.rotations
+        }
+
+# Глобальный журнал запросов
+capture_log = CaptureLog()
+
+class CaptureMiddleware:
+    """
+    ASGI middleware: записывает выбранные запросы в журнал
+
+    Подключается внутри UsageContextMiddleware, чтобы в запись попал расход
+    токенов запроса, и внутри MetricsMiddleware - для фаз запросов к API.
+    Для потоковых ответов время считается до последнего фрагмента.
+    """
+
+    def __init__(self, app, capture: CaptureLog = capture_log):
+        self.app = app
+        self.capture = capture
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.capture.should_capture(scope):
+            await self.app(scope, receive, send)
+            return
+        timestamp = time.time()
+        started_at = time.perf_counter()
+        max_body_bytes = self.capture.max_body_bytes
+        body = bytearray()
+        body_truncated = False
+        status = 500
+        ttfb = None
+        response_bytes = 0
+
+        async def receive_with_capture():
+            nonlocal body_truncated
+            message = await receive()
+            if message["type"] == "http.request" and not body_truncated:
+                chunk = message.get("body", b"")
+                if len(body) + len(chunk) > max_body_bytes:
+                    body_truncated = True
+                    body.clear()
+                else:
+                    body.extend(chunk)
+            return message
+
+        async def send_with_capture(message):
+            nonlocal status, ttfb, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                ttfb = time.perf_counter() - started_at
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_with_capture, send_with_capture)
+        finally:
+            route = scope.get("route")
+            headers = dict(scope.get("headers", []))
+            timings = current_timings()
+            record = {
+                "ts": round(timestamp, 3),
+                "request_id": current_request_id(),
+                "method": scope.get("method", ""),
+                "endpoint": getattr(route, "path", None) or scope.get("path", ""),
+                "path": scope.get("path", ""),
+                "status": status,
+                "duration_ms": round((time.perf_counter() - started_at) * 1000, 1),
+                "ttfb_ms": round(ttfb * 1000, 1) if ttfb is not None else None,
+                "response_bytes": response_bytes,
+                "upstream_ms": {
+                    phase: round(seconds * 1000, 1) for phase, seconds in timings.phases.items()
+                } if timings is not None else None,
+                "usage": current_usage(),
+                "content_type": headers.get(b"content-type", b"").decode("latin-1") or None,
+                "body_truncated": body_truncated,
+                # Разбор параметров и тела выполняется при записи, вне обработки запроса
+                "query_string": scope.get("query_string", b""),
+                "body": bytes(body) if not body_truncated else None
+            }
+            self.capture.submit(record)
@@ -0,0 +1,83 @@
+import codecs
+import re
+from typing import AsyncIterator, List
+
+# Конец предложения: знак препинания и следующий за ним пробел
+_SENTENCE_END = re.compile(r"[.!?…][»\")]*\s+")
+
+# Граница разреза ищется не раньше этой доли размера части, чтобы части не были слишком мелкими
+MIN_CUT_RATIO = 0.5
+
+class BodyTooLargeError(ValueError):
+    """Тело запроса превышает допустимый размер"""
+
+class TextChunker:
+    """
+    Разбиение текста на части не длиннее chunk_chars символов
+
+    Текст подается фрагментами по мере поступления (feed), готовые части
+    возвращаются сразу, как только набирается достаточно текста, поэтому
+    весь текст в памяти не накапливается. Разрез делается по последней
+    границе абзаца в пределах части, иначе по концу предложения, иначе
+    по пробелу и только в крайнем случае посреди слова.
+    """
+
+    def __init__(self, chunk_chars: int):
+        self.chunk_chars = max(1, chunk_chars)
+        self._buffer = ""
+
+    def _cut(self, window: str) -> int:
+        minimum = int(self.chunk_chars * MIN_CUT_RATIO)
+        paragraph = window.rfind("\n\n")
+        if paragraph >= minimum:
+            return paragraph + 2
+        sentence_ends = [match.end() for match in _SENTENCE_END.finditer(window, minimum)]
+        if sentence_ends:
+            return sentence_ends[-1]
+        space = max(window.rfind(" "), window.rfind("\n"))
+        if space >= minimum:
+            return space + 1
+        return len(window)
+
+    def feed(self, text: str) -> List[str]:
+        """Добавляет фрагмент текста и возвращает готовые части"""
+        self._buffer += text
+        chunks = []
+        # Часть готова, только когда после нее уже есть текст: иначе граница еще неизвестна
+        while len(self._buffer) > self.chunk_chars:
+            cut = self._cut(self._buffer[:self.chunk_chars])
+            chunk = self._buffer[:cut].strip()
+            self._buffer = self._buffer[cut:]
+            if chunk:
+                chunks.append(chunk)
+        return chunks
+
+    def flush(self) -> List[str]:
+        """Возвращает оставшийся текст последней частью"""
+        chunk = self._buffer.strip()
+        self._buffer = ""
+        return [chunk] if chunk else []
+
+async def iter_text_chunks(body: AsyncIterator[bytes], chunk_chars: int, max_bytes: int) -> AsyncIterator[str]:
+    """
+    Разбивает поступающее тело запроса (UTF-8) на части текста
+
+    Args:
+        body: Фрагменты тела запроса по мере получения
+        chunk_chars: Максимальный размер части в символах
+        max_bytes: Максимальный размер тела
+
+    Raises:
+        BodyTooLargeError: Если тело больше max_bytes
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    chunker = TextChunker(chunk_chars)
+    received = 0
+    async for data in body:
+        received += len(data)
+        if received > max_bytes:
+            raise BodyTooLargeError(f"Текст слишком большой: больше {max_bytes} байт")
+        for chunk in chunker.feed(decoder.decode(data)):
+            yield chunk
+    for chunk in chunker.feed(decoder.decode(b"", final=True)) + chunker.flush():
+        yield chunk
@@ -0,0 +1,53 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+class RequestCoalescer:
+    """
+    Объединение одинаковых одновременных запросов к GigaChat API
+
+    Если запрос с тем же отпечатком уже выполняется, новый вызывающий ожидает
+    его результат вместо повторного обращения к API. Общий запрос выполняется
+    в отдельной задаче: отключение одного из клиентов не отменяет его для остальных.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполняет factory() или присоединяется к уже выполняющемуся вызову с тем же ключом
+
+        Args:
+            key: Отпечаток запроса
+            factory: Функция, создающая корутину запроса к API
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        # shield: отмена ожидающего не отменяет общий запрос
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Результат мог остаться невостребованным, если все ожидающие отменены
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика объединения запросов для эндпоинта /health"""
+        return {
+            "in_flight": len(self._in_flight),
+            "upstream_calls": self.leaders,
+            "coalesced": self.coalesced
+        }
+
+# Глобальный объединитель запросов (общий для сервисов улучшения текста и ассистента)
+request_coalescer = RequestCoalescer()
@@ -0,0 +1,190 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Optional, Dict, Any, List, Tuple
+import logging
+
+from app.config import disk_cache_config, DiskCacheConfig
+
+logger = logging.getLogger("disk_cache")
+
+# Как часто (в количестве записей) пересчитывать суммарный размер для вытеснения
+EVICTION_CHECK_INTERVAL = 32
+# До какой доли от max_bytes сокращать кэш при вытеснении
+EVICTION_TARGET_RATIO = 0.9
+
+class DiskCache:
+    """
+    Постоянный кэш ответов в локальном файле SQLite
+
+    Значения хранятся сжатыми zlib, поиск выполняется по первичному ключу.
+    Файл общий для всех воркеров на хосте и переживает перезапуск сервиса.
+    При превышении max_bytes вытесняются записи, к которым дольше всего не обращались.
+    """
+
+    def __init__(self, config: DiskCacheConfig = disk_cache_config):
+        self.path = config.path
+        self.max_bytes = config.max_bytes
+        self.ttl = config.ttl
+        self.compression_level = config.compression_level
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._writes_since_check = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+            self._conn = conn
+        return self._conn
+
+    # Синхронные операции (выполняются в пуле потоков)
+
+    def get_sync(self, key: str) -> Optional[str]:
+        entry = self.get_entry_sync(key)
+        return entry[0] if entry is not None else None
+
+    def get_entry_sync(self, key: str) -> Optional[Tuple[str, float]]:
+        """Возвращает значение и время его истечения (unix-время) или None"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT value, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if row[1] <= now:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return zlib.decompress(row[0]).decode("utf-8"), row[1]
+
+    def set_sync(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        blob = zlib.compress(value.encode("utf-8"), self.compression_level)
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created_at, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now + (ttl if ttl is not None else self.ttl), now)
+            )
+            self.writes += 1
+            self._writes_since_check += 1
+            if self._writes_since_check >= EVICTION_CHECK_INTERVAL:
+                self._writes_since_check = 0
+                self._evict_locked(conn)
+
+    def _evict_locked(self, conn: sqlite3.Connection) -> None:
+        """Удаляет истекшие записи и самые давние по обращению, пока размер превышает лимит"""
+        conn.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * EVICTION_TARGET_RATIO
+        rows = conn.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall()
+        to_delete = []
+        for key, size in rows:
+            if total <= target:
+                break
+            to_delete.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM entries WHERE key = ?", to_delete)
+        self.evictions += len(to_delete)
+
+    def purge_sync(self, expired_only: bool = False) -> int:
+        """Удаляет все (или только истекшие) записи, возвращает их количество"""
+        with self._lock:
+            conn = self._connection()
+            if expired_only:
+                cursor = conn.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+            else:
+                cursor = conn.execute("DELETE FROM entries")
+            conn.execute("VACUUM")
+            return cursor.rowcount
+
+    def inspect_sync(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Последние использованные записи (без значений) для просмотра содержимого"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT key, size, created_at, expires_at, accessed_at FROM entries "
+                "ORDER BY accessed_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [
+            {"key": row[0], "size": row[1], "created_at": row[2], "expires_at": row[3], "accessed_at": row[4]}
+            for row in rows
+        ]
+
+    def summary_sync(self) -> Dict[str, Any]:
+        """Количество записей и суммарный размер сжатых значений в файле"""
+        with self._lock:
+            count, total = self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        return {"path": self.path, "entries": count, "bytes": total, "max_bytes": self.max_bytes}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # Асинхронные обертки, не блокирующие event loop
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = await self.get_entry(key)
+        return entry[0] if entry is not None else None
+
+    async def get_entry(self, key: str) -> Optional[Tuple[str, float]]:
+        try:
+            return await asyncio.to_thread(self.get_entry_sync, key)
+        except (sqlite3.Error, OSError, zlib.error) as e:
+            self.errors += 1
+            logger.error("Ошибка чтения дискового кэша: %s", e)
+            return None
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        try:
+            await asyncio.to_thread(self.set_sync, key, value, ttl)
+        except (sqlite3.Error, OSError) as e:
+            self.errors += 1
+            logger.error("Ошибка записи в дисковый кэш: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики дискового кэша (без обращения к файлу)"""
+        return {
+            "path": self.path,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "errors": self.errors
+        }
+
+def create_disk_cache(config: DiskCacheConfig = disk_cache_config) -> Optional[DiskCache]:
+    """Создает дисковый кэш, если он включен в настройках"""
+    if not config.enabled:
+        return None
+    return DiskCache(config)
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Dict, Any, Optional, Deque, Callable, Awaitable, TypeVar
+
+from app.config import hedging_config, HedgingConfig
+
+logger = logging.getLogger("hedging")
+
+T = TypeVar("T")
+
+class HedgePolicy:
+    """
+    Дублирование (hedging) медленных запросов к GigaChat API
+
+    Для эндпоинтов из списка хранятся задержки последних ответов. Если
+    ответа нет дольше заданного перцентиля этих задержек, отправляется
+    такой же запрос повторно; используется ответ, пришедший первым, а
+    второй запрос отменяется. Бюджет ограничивает число дублей долей от
+    числа запросов за последние budget_window секунд, поэтому дублирование
+    лишь немного увеличивает нагрузку на API и не усиливает ее при сбое.
+    """
+
+    def __init__(self, config: HedgingConfig = hedging_config):
+        self.config = config
+        self.enabled = config.enabled
+        self.endpoints = set(config.endpoint_paths)
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._requests: Deque[float] = deque()
+        self._hedges: Deque[float] = deque()
+
+        self.hedged_total = 0
+        self.hedge_wins = 0
+        self.budget_exhausted_total = 0
+
+    def enabled_for(self, endpoint: Optional[str]) -> bool:
+        """Включено ли дублирование для эндпоинта (шаблона пути)"""
+        return self.enabled and endpoint in self.endpoints
+
+    def hedge_delay(self, endpoint: str) -> Optional[float]:
+        """Через сколько секунд без ответа отправлять дубль или None, если задержек пока мало"""
+        latencies = self._latencies.get(endpoint)
+        if not latencies or len(latencies) < self.config.min_samples:
+            return None
+        ordered = sorted(latencies)
+        index = min(len(ordered) - 1, math.ceil(len(ordered) * self.config.percentile / 100) - 1)
+        return max(self.config.min_delay, ordered[max(0, index)])
+
+    def _record_latency(self, endpoint: str, latency: float) -> None:
+        latencies = self._latencies.get(endpoint)
+        if latencies is None:
+            latencies = self._latencies[endpoint] = deque(maxlen=max(1, self.config.latency_window))
+        latencies.append(latency)
+
+    def _trim(self, now: float) -> None:
+        deadline = now - self.config.budget_window
+        for events in (self._requests, self._hedges):
+            while events and events[0] < deadline:
+                events.popleft()
+
+    def _take_budget(self) -> bool:
+        """Расходует бюджет на один дубль; False, если бюджет исчерпан"""
+        now = time.monotonic()
+        self._trim(now)
+        if len(self._hedges) + 1 > self.config.budget_ratio * len(self._requests):
+            self.budget_exhausted_total += 1
+            return False
+        self._hedges.append(now)
+        return True
+
+    async def call(self, endpoint: Optional[str], request: Callable[[], Awaitable[T]]) -> T:
+        """
+        Выполняет запрос, при необходимости отправляя дубль
+
+        Args:
+            endpoint: Шаблон пути эндпоинта сервиса, из которого выполняется запрос
+            request: Функция, отправляющая запрос; вызывается второй раз для дубля
+
+        Returns:
+            Результат запроса, завершившегося успешно первым
+        """
+        if not self.enabled_for(endpoint):
+            return await request()
+        started_at = time.monotonic()
+        self._trim(started_at)
+        self._requests.append(started_at)
+
+        delay = self.hedge_delay(endpoint)
+        if delay is None:
+            result = await request()
+            self._record_latency(endpoint, time.monotonic() - started_at)
+            return result
+
+        primary = asyncio.ensure_future(request())
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self._take_budget():
+                logger.info("Нет ответа GigaChat API за %.2f с (%s), отправлен дубль запроса", delay, endpoint)
+                self.hedged_total += 1
+                tasks.append(asyncio.ensure_future(request()))
+
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        self._record_latency(endpoint, time.monotonic() - started_at)
+                        return task.result()
+                    # Если не удались оба запроса, возвращается ошибка основного
+                    if task is primary or error is None:
+                        error = task.exception()
+            raise error
+        finally:
+            # Проигравший запрос отменяется: его место в ограничителе и соединение освобождаются
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние дублирования для эндпоинта /health"""
+        self._trim(time.monotonic())
+        return {
+            "enabled": self.enabled,
+            "endpoints": {
+                endpoint: {
+                    "samples": len(self._latencies.get(endpoint, ())),
+                    "hedge_delay": self.hedge_delay(endpoint)
+                }
+                for endpoint in sorted(self.endpoints)
+            },
+            "window_requests": len(self._requests),
+            "window_hedges": len(self._hedges),
+            "hedged_total": self.hedged_total,
+            "hedge_wins": self.hedge_wins,
+            "budget_exhausted_total": self.budget_exhausted_total
+        }
+
+# Общая политика дублирования запросов к GigaChat API
+hedge_policy = HedgePolicy()
@@ -0,0 +1,123 @@
+import httpx
+from typing import Optional, Dict, Any
+import logging
+
+from app.config import http_client_config, HTTPClientConfig
+
+logger = logging.getLogger("http_client")
+
+class UpstreamHTTPClient:
+    """
+    Общий пул соединений для всех запросов к GigaChat API.
+
+    Один экземпляр httpx.AsyncClient создается при запуске приложения и
+    переиспользуется сервисами и менеджером токенов, поэтому TCP+TLS
+    соединения с API не устанавливаются заново на каждый запрос.
+    """
+
+    def __init__(self, config: HTTPClientConfig = http_client_config):
+        self.config = config
+        self._client: Optional[httpx.AsyncClient] = None
+        self._transport: Optional[httpx.AsyncHTTPTransport] = None
+        self.http2_enabled = False
+        self.requests_total = 0
+        self.responses_by_status: Dict[int, int] = {}
+
+    def _http2_available(self) -> bool:
+        """Проверяет, установлена ли библиотека h2 для поддержки HTTP/2"""
+        try:
+            import h2  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def _create_client(self) -> httpx.AsyncClient:
+        """Создает клиент с настройками пула и таймаутов из конфигурации"""
+        self.http2_enabled = self.config.http2
+        if self.http2_enabled and not self._http2_available():
+            logger.warning("HTTP/2 включен в настройках, но пакет h2 не установлен. Используется HTTP/1.1")
+            self.http2_enabled = False
+
+        limits = httpx.Limits(
+            max_connections=self.config.max_connections,
+            max_keepalive_connections=self.config.max_keepalive_connections,
+            keepalive_expiry=self.config.keepalive_expiry
+        )
+        timeout = httpx.Timeout(
+            connect=self.config.connect_timeout,
+            read=self.config.read_timeout,
+            write=self.config.write_timeout,
+            pool=self.config.pool_timeout
+        )
+        self._transport = httpx.AsyncHTTPTransport(
+            verify=self.config.verify_ssl,
+            http2=self.http2_enabled,
+            limits=limits
+        )
+        return httpx.AsyncClient(
+            transport=self._transport,
+            timeout=timeout,
+            event_hooks={
+                "request": [self._on_request],
+                "response": [self._on_response]
+            }
+        )
+
+    async def _on_request(self, request: httpx.Request) -> None:
+        self.requests_total += 1
+
+    async def _on_response(self, response: httpx.Response) -> None:
+        status = response.status_code
+        self.responses_by_status[status] = self.responses_by_status.get(status, 0) + 1
+
+    async def start(self) -> httpx.AsyncClient:
+        """Создает пул соединений (вызывается при запуске приложения)"""
+        if self._client is None or self._client.is_closed:
+            self._client = self._create_client()
+            logger.info(
+                "Создан общий HTTP-клиент: max_connections=%s, keepalive=%s, http2=%s",
+                self.config.max_connections,
+                self.config.max_keepalive_connections,
+                self.http2_enabled
+            )
+        return self._client
+
+    async def close(self) -> None:
+        """Закрывает все соединения пула (вызывается при остановке приложения)"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info("Общий HTTP-клиент закрыт")
+        self._client = None
+        self._transport = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        Возвращает общий клиент. Если приложение запущено вне lifespan
+        (скрипты, консольные утилиты), клиент создается при первом обращении.
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = self._create_client()
+        return self._client
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика пула соединений для эндпоинта /health"""
+        connections = []
+        pool = getattr(self._transport, "_pool", None) if self._transport else None
+        if pool is not None:
+            connections = list(pool.connections)
+
+        return {
+            "open": self._client is not None and not self._client.is_closed,
+            "http2": self.http2_enabled,
+            "max_connections": self.config.max_connections,
+            "max_keepalive_connections": self.config.max_keepalive_connections,
+            "connections": len(connections),
+            "idle_connections": sum(1 for conn in connections if conn.is_idle()),
+            "active_connections": sum(1 for conn in connections if not conn.is_idle() and not conn.is_closed()),
+            "requests_total": self.requests_total,
+            "responses_by_status": dict(self.responses_by_status)
+        }
+
+# Глобальный экземпляр общего HTTP-клиента
+http_client = UpstreamHTTPClient()
@@ -0,0 +1,201 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import contextmanager, asynccontextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional, Tuple, AsyncIterator, Iterator
+
+from app.config import limiter_config, LimiterConfig
+
+# Приоритеты (полосы) запросов к GigaChat API: меньшее значение обслуживается раньше
+PRIORITY_INTERACTIVE = 0  # вопросы к ассистенту
+PRIORITY_DEFAULT = 1      # интерактивное улучшение текста
+PRIORITY_BATCH = 2        # пакеты и фоновые задания
+LANE_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_DEFAULT: "default",
+    PRIORITY_BATCH: "batch"
+}
+
+# Исходы запроса для корректировки лимита
+OUTCOME_SUCCESS = "success"
+OUTCOME_OVERLOAD = "overload"  # 429 от API
+OUTCOME_ERROR = "error"        # прочие ошибки, на лимит не влияют
+
+_current_priority: ContextVar[int] = ContextVar("upstream_priority", default=PRIORITY_DEFAULT)
+
+@contextmanager
+def priority_lane(priority: int) -> Iterator[None]:
+    """Задает приоритет запросов к API для текущей задачи и созданных в ней задач"""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+def current_priority() -> int:
+    return _current_priority.get()
+
+class UpstreamSlot:
+    """Разрешение на один запрос к API; исход записывается вызывающим"""
+
+    def __init__(self):
+        self.outcome = OUTCOME_ERROR
+        self.started_at = time.monotonic()
+        # Время ожидания места в очереди ограничителя
+        self.wait = 0.0
+        # Задержка ответа; если не задана, считается до освобождения места
+        self.latency = None
+
+    def record(self, status_code: int) -> None:
+        """Записывает исход по HTTP-статусу ответа API"""
+        self.latency = time.monotonic() - self.started_at
+        if status_code == 429:
+            self.outcome = OUTCOME_OVERLOAD
+        elif status_code < 400:
+            self.outcome = OUTCOME_SUCCESS
+        else:
+            self.outcome = OUTCOME_ERROR
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Адаптивное ограничение числа одновременных запросов к GigaChat API (AIMD)
+
+    Лимит растет на 1/limit после каждого успешного ответа (аддитивно, примерно
+    на единицу за «окно» запросов) и уменьшается в backoff_ratio раз при ответе
+    429 или в latency_backoff_ratio раз при всплеске задержки. Запросы сверх
+    лимита ждут в очереди с приоритетами: вопросы к ассистенту обгоняют пакетную обработку.
+    """
+
+    def __init__(self, config: LimiterConfig = limiter_config):
+        self.config = config
+        self.enabled = config.enabled
+        self.limit = config.initial_limit
+        self.in_flight = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._latency_avg = None
+
+        self.increases = 0
+        self.decreases = 0
+        self.overloads = 0
+        self._wait_stats: Dict[int, Dict[str, float]] = {
+            priority: {"count": 0, "total": 0.0, "max": 0.0} for priority in LANE_NAMES
+        }
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[int] = None) -> AsyncIterator[UpstreamSlot]:
+        """
+        Занимает место для одного запроса к API на время блока
+
+        Приоритет берется из priority_lane текущей задачи, если не задан явно.
+
+        Пример:
+            async with upstream_limiter.slot() as slot:
+                response = await client.post(...)
+                slot.record(response.status_code)
+        """
+        if not self.enabled:
+            yield UpstreamSlot()
+            return
+        wait = await self._acquire(current_priority() if priority is None else priority)
+        slot = UpstreamSlot()
+        slot.wait = wait
+        try:
+            yield slot
+        finally:
+            latency = slot.latency if slot.latency is not None else time.monotonic() - slot.started_at
+            self._release(slot.outcome, latency)
+
+    async def _acquire(self, priority: int) -> float:
+        """Занимает место и возвращает время ожидания в очереди"""
+        started_at = time.monotonic()
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            entry = (priority, next(self._sequence), future)
+            heapq.heappush(self._waiters, entry)
+            try:
+                # Место (in_flight) резервируется при пробуждении в _wake_waiters
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Место уже выделено, но ожидающий отменен - возвращаем его
+                    self.in_flight -= 1
+                    self._wake_waiters()
+                else:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                raise
+        wait_time = time.monotonic() - started_at
+        self._record_wait(priority, wait_time)
+        return wait_time
+
+    def _release(self, outcome: str, latency: float) -> None:
+        self.in_flight -= 1
+        self._adjust(outcome, latency)
+        self._wake_waiters()
+
+    def _adjust(self, outcome: str, latency: float) -> None:
+        """Корректирует лимит по исходу запроса (AIMD)"""
+        if outcome == OUTCOME_OVERLOAD:
+            self.overloads += 1
+            self._decrease(self.config.backoff_ratio)
+        elif outcome == OUTCOME_SUCCESS:
+            if self._latency_avg is not None and latency > self._latency_avg * self.config.latency_tolerance:
+                self._decrease(self.config.latency_backoff_ratio)
+            else:
+                self.limit = min(self.config.max_limit, self.limit + 1 / self.limit)
+                self.increases += 1
+            # Скользящее среднее задержки успешных запросов
+            if self._latency_avg is None:
+                self._latency_avg = latency
+            else:
+                self._latency_avg = 0.9 * self._latency_avg + 0.1 * latency
+
+    def _decrease(self, ratio: float) -> None:
+        self.limit = max(self.config.min_limit, self.limit * ratio)
+        self.decreases += 1
+
+    def _wake_waiters(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _record_wait(self, priority: int, wait_time: float) -> None:
+        stats = self._wait_stats.setdefault(priority, {"count": 0, "total": 0.0, "max": 0.0})
+        stats["count"] += 1
+        stats["total"] += wait_time
+        stats["max"] = max(stats["max"], wait_time)
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние ограничителя и время ожидания по полосам для эндпоинта /health"""
+        queued: Dict[str, int] = {name: 0 for name in LANE_NAMES.values()}
+        for priority, _, _ in self._waiters:
+            queued[LANE_NAMES.get(priority, str(priority))] += 1
+        return {
+            "enabled": self.enabled,
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": queued,
+            "latency_avg": round(self._latency_avg, 4) if self._latency_avg is not None else None,
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "overloads": self.overloads,
+            "queue_wait": {
+                LANE_NAMES.get(priority, str(priority)): {
+                    "count": int(stats["count"]),
+                    "avg": round(stats["total"] / stats["count"], 4) if stats["count"] else None,
+                    "max": round(stats["max"], 4)
+                }
+                for priority, stats in self._wait_stats.items()
+            }
+        }
+
+# Глобальный ограничитель запросов к GigaChat API (общий для всех сервисов)
+upstream_limiter = AdaptiveConcurrencyLimiter()
@@ -0,0 +1,217 @@
+import atexit
+import json
+import logging
+import queue
+import re
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Any, Optional, Tuple
+
+from app.config import logging_config, LoggingConfig
+
+# Заголовок с идентификатором запроса: принимается от клиента (или прокси) и возвращается в ответе
+REQUEST_ID_HEADER = "X-Request-ID"
+
+_REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+
+# Логгеры uvicorn, записи которых также идут через очередь
+UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s"
+
+# Стандартные атрибуты LogRecord; остальные (переданные через extra) попадают в JSON как поля
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message", "asctime", "request_id",
+    "color_message"  # копия сообщения uvicorn с цветовыми кодами терминала
+}
+
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+def current_request_id() -> Optional[str]:
+    """Идентификатор текущего HTTP-запроса или None вне HTTP-запроса"""
+    return _request_id.get()
+
+class RequestIdMiddleware:
+    """ASGI middleware: идентификатор запроса для записей лога и заголовок X-Request-ID в ответе"""
+
+    def __init__(self, app):
+        self.app = app
+        self.header = REQUEST_ID_HEADER.lower().encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        incoming = dict(scope.get("headers", [])).get(self.header, b"").decode("latin-1")
+        request_id = incoming if _REQUEST_ID_PATTERN.match(incoming) else uuid.uuid4().hex
+        token = _request_id.set(request_id)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((self.header, request_id.encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            _request_id.reset(token)
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога в виде одной строки JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        if getattr(record, "request_id", "-") != "-":
+            data["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exc"] = record.exc_text
+        if record.stack_info:
+            data["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class TracebackLimiter:
+    """
+    Ограничение числа стеков одной ошибки
+
+    Ошибка определяется логгером, местом записи и типом исключения. Сверх
+    limit стеков за window секунд запись попадает в лог без стека, с
+    типом и текстом исключения, - при массовых сбоях API лог не забивается
+    одинаковыми стеками, а их форматирование не нагружает цикл событий.
+    """
+
+    def __init__(self, limit: int, window: float, max_keys: int = 1000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._windows: Dict[Tuple[str, str, int, str], Tuple[float, int]] = {}
+        self.suppressed_total = 0
+
+    def allow(self, record: logging.LogRecord) -> bool:
+        key = (record.name, record.pathname, record.lineno, record.exc_info[0].__name__)
+        now = time.monotonic()
+        started_at, count = self._windows.get(key, (now, 0))
+        if now - started_at >= self.window:
+            started_at, count = now, 0
+        if len(self._windows) >= self.max_keys and key not in self._windows:
+            self._windows.clear()
+        self._windows[key] = (started_at, count + 1)
+        if count < self.limit:
+            return True
+        self.suppressed_total += 1
+        return False
+
+class AsyncQueueHandler(QueueHandler):
+    """
+    Обработчик, передающий записи фоновому потоку через очередь
+
+    В потоке, который пишет в лог (обычно цикл событий), выполняется только
+    подстановка аргументов сообщения; стек ошибки, JSON и вывод формируются
+    в потоке писателя, поэтому медленный приемник логов не блокирует цикл
+    событий. При переполнении очереди записи отбрасываются.
+    """
+
+    def __init__(self, log_queue: queue.Queue, limiter: TracebackLimiter):
+        super().__init__(log_queue)
+        self.limiter = limiter
+        self.dropped_total = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Копия записи: аргументы подставляются сейчас, пока объекты не изменились
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        record.request_id = _request_id.get() or "-"
+        if record.exc_info and not self.limiter.allow(record):
+            exc_type, exc_value = record.exc_info[:2]
+            record.msg = f"{record.msg} ({exc_type.__name__}: {exc_value}; стек не записан: частая ошибка)"
+            record.exc_info = None
+            record.exc_text = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_total += 1
+
+class LoggingManager:
+    """Настройка логирования: очередь, фоновый писатель и уровень во время работы"""
+
+    def __init__(self, config: LoggingConfig = logging_config):
+        self.config = config
+        self.handler: Optional[AsyncQueueHandler] = None
+        self.listener: Optional[QueueListener] = None
+        self.limiter = TracebackLimiter(config.traceback_limit, config.traceback_window)
+
+    def setup(self) -> None:
+        """Направляет записи корневого логгера и логгеров uvicorn в очередь с фоновым писателем"""
+        if self.handler is not None:
+            return
+        output = logging.StreamHandler(sys.stderr)
+        output.setFormatter(JsonFormatter() if self.config.format == "json" else logging.Formatter(TEXT_FORMAT))
+        self.handler = AsyncQueueHandler(queue.Queue(self.config.queue_size), self.limiter)
+        self.listener = QueueListener(self.handler.queue, output, respect_handler_level=False)
+        self.listener.start()
+        atexit.register(self.shutdown)
+
+        root = logging.getLogger()
+        root.handlers = [self.handler]
+        self.set_level(self.config.level)
+        for name in UVICORN_LOGGERS:
+            uvicorn_logger = logging.getLogger(name)
+            uvicorn_logger.handlers = [self.handler] if name != "uvicorn.error" else []
+            uvicorn_logger.propagate = name == "uvicorn.error"
+
+    def shutdown(self) -> None:
+        """Дописывает записи из очереди и останавливает писатель"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    @staticmethod
+    def validate_level(level: str) -> str:
+        """Название уровня в верхнем регистре; ValueError для неизвестного уровня"""
+        level = level.upper()
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"Неизвестный уровень логирования: {level}")
+        return level
+
+    def set_level(self, level: str, name: Optional[str] = None) -> None:
+        """Меняет уровень корневого логгера (или логгера name) без перезапуска"""
+        logging.getLogger(name).setLevel(self.validate_level(level))
+
+    def levels(self) -> Dict[str, str]:
+        """Уровни корневого логгера и логгеров, для которых уровень задан явно"""
+        levels = {"root": logging.getLevelName(logging.getLogger().level)}
+        for name, logger in sorted(logging.Logger.manager.loggerDict.items()):
+            if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET:
+                levels[name] = logging.getLevelName(logger.level)
+        return levels
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние логирования для эндпоинта /health"""
+        return {
+            "level": logging.getLevelName(logging.getLogger().level),
+            "format": self.config.format,
+            "queued": self.handler.queue.qsize() if self.handler is not None else 0,
+            "dropped_total": self.handler.dropped_total if self.handler is not None else 0,
+            "tracebacks_suppressed": self.limiter.suppressed_total
+        }
+
+# Глобальная настройка логирования
+logging_manager = LoggingManager()
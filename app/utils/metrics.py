@@ -0,0 +1,242 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Optional, Iterator
+
+from prometheus_client import Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from app.config import metrics_config, MetricsConfig
+from app.utils.auth import token_manager
+from app.utils.cache import response_cache
+from app.utils.hedging import hedge_policy
+from app.utils.http_client import http_client
+from app.utils.limiter import upstream_limiter
+from app.utils.resilience import upstream_breaker, retry_policy, STATE_OPEN
+from app.utils.semantic_cache import semantic_cache
+from app.utils.usage import token_usage, USAGE_FIELDS
+
+# Фазы запроса к GigaChat API
+PHASE_TOKEN = "token"      # получение токена доступа
+PHASE_QUEUE = "queue"      # ожидание места в ограничителе запросов
+PHASE_CONNECT = "connect"  # установка TCP и TLS соединения (только для нового соединения)
+PHASE_TTFB = "ttfb"        # от отправки запроса до заголовков ответа (для обычных запросов - вся генерация)
+PHASE_TOTAL = "total"      # весь вызов, включая повторы
+
+# Метка запросов, не сопоставленных ни с одним эндпоинтом (чтобы произвольные пути не плодили ряды)
+UNMATCHED_ENDPOINT = "unmatched"
+
+# Тип содержимого ответа /metrics
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Границы гистограмм в секундах: ответы GigaChat занимают от долей секунды до десятков секунд
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки HTTP-запроса к сервису",
+    ["method", "endpoint", "status"],
+    buckets=LATENCY_BUCKETS
+)
+
+UPSTREAM_PHASE_SECONDS = Histogram(
+    "gigachat_request_phase_seconds",
+    "Время фаз запроса к GigaChat API",
+    ["path", "phase"],
+    buckets=LATENCY_BUCKETS
+)
+
+class RequestTimings:
+    """Суммарное время фаз запросов к API в рамках одного HTTP-запроса (для Server-Timing)"""
+
+    __slots__ = ("started_at", "phases")
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def header(self) -> str:
+        """Значение заголовка Server-Timing: фазы GigaChat API и общее время в миллисекундах"""
+        parts = [f"gigachat-{phase};dur={seconds * 1000:.1f}" for phase, seconds in self.phases.items()]
+        parts.append(f"app;dur={(time.perf_counter() - self.started_at) * 1000:.1f}")
+        return ", ".join(parts)
+
+_current_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+def current_timings() -> Optional[RequestTimings]:
+    """Фазы запросов к API текущего HTTP-запроса или None вне HTTP-запроса (и при выключенных метриках)"""
+    return _current_timings.get()
+
+@contextmanager
+def untimed() -> Iterator[None]:
+    """Не относить запросы к API в блоке к текущему HTTP-запросу (для фоновых задач)"""
+    token = _current_timings.set(None)
+    try:
+        yield
+    finally:
+        _current_timings.reset(token)
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: время обработки запросов по эндпоинтам и заголовок Server-Timing
+
+    Фазы запросов к API, выполненных во время обработки (в том числе в
+    созданных ею задачах), суммируются и попадают в заголовок ответа.
+    Для потоковых ответов заголовок отправляется до запроса к API и
+    содержит только время до начала ответа.
+    """
+
+    def __init__(self, app, config: MetricsConfig = metrics_config):
+        self.app = app
+        self.server_timing = config.server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", timings.header().encode("latin-1")))
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_timings.reset(token)
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                method=scope.get("method", ""),
+                endpoint=getattr(route, "path", None) or UNMATCHED_ENDPOINT,
+                status=str(status)
+            ).observe(time.perf_counter() - timings.started_at)
+
+class UpstreamTimer:
+    """
+    Замер фаз одного вызова GigaChat API (всех его попыток)
+
+    Время соединения и до заголовков ответа берется из событий httpcore:
+    обработчик trace передается в extensions запроса httpx.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.started_at = time.perf_counter()
+        self._connect_started: Optional[float] = None
+        self._request_started: Optional[float] = None
+
+    def record(self, phase: str, seconds: float) -> None:
+        UPSTREAM_PHASE_SECONDS.labels(path=self.path, phase=phase).observe(seconds)
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.add(phase, seconds)
+
+    @contextmanager
+    def measure(self, phase: str) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - started_at)
+
+    @property
+    def extensions(self) -> Dict[str, Any]:
+        """Расширения запроса httpx для замера соединения и ожидания ответа"""
+        return {"trace": self._trace}
+
+    async def _trace(self, event: str, info: Dict[str, Any]) -> None:
+        now = time.perf_counter()
+        if event == "connection.connect_tcp.started":
+            self._connect_started = now
+        elif event.endswith(".send_request_headers.started"):
+            # Соединение (TCP и TLS) готово к моменту отправки заголовков запроса
+            if self._connect_started is not None:
+                self.record(PHASE_CONNECT, now - self._connect_started)
+                self._connect_started = None
+            self._request_started = now
+        elif event.endswith(".receive_response_headers.complete") and self._request_started is not None:
+            self.record(PHASE_TTFB, now - self._request_started)
+            self._request_started = None
+
+    def finish(self) -> None:
+        """Записывает общее время вызова"""
+        self.record(PHASE_TOTAL, time.perf_counter() - self.started_at)
+
+class ServiceStatsCollector:
+    """Счетчики кэшей, повторов, ответов 429, обновлений и расхода токенов из статистики сервисов"""
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        cache_lookups = CounterMetricFamily(
+            "cache_lookups", "Обращения к кэшам ответов", labels=["cache", "result"]
+        )
+        caches = [("response", response_cache.memory), ("disk", response_cache.disk), ("semantic", semantic_cache)]
+        for name, cache in caches:
+            if cache is not None:
+                cache_lookups.add_metric([name, "hit"], cache.hits)
+                cache_lookups.add_metric([name, "miss"], cache.misses)
+        yield cache_lookups
+
+        responses = CounterMetricFamily(
+            "gigachat_http_responses", "Ответы GigaChat API по HTTP-статусу", labels=["status"]
+        )
+        for status, count in sorted(http_client.responses_by_status.items()):
+            responses.add_metric([str(status)], count)
+        yield responses
+
+        yield CounterMetricFamily(
+            "gigachat_rate_limited", "Ответы 429 от GigaChat API", value=upstream_limiter.overloads
+        )
+        yield CounterMetricFamily(
+            "gigachat_retries", "Повторы запросов к GigaChat API", value=retry_policy.retries_total
+        )
+        yield CounterMetricFamily(
+            "gigachat_retry_budget_exhausted", "Повторы, отклоненные бюджетом", value=retry_policy.budget_exhausted_total
+        )
+        yield CounterMetricFamily(
+            "gigachat_hedged_requests", "Дубли медленных запросов к GigaChat API", value=hedge_policy.hedged_total
+        )
+        yield CounterMetricFamily(
+            "gigachat_breaker_rejected", "Запросы, отклоненные разомкнутым выключателем", value=upstream_breaker.rejected_total
+        )
+        yield GaugeMetricFamily(
+            "gigachat_breaker_open", "Выключатель разомкнут (1) или нет (0)", value=int(upstream_breaker.state == STATE_OPEN)
+        )
+
+        refreshes = CounterMetricFamily(
+            "gigachat_token_refreshes", "Обновления токена доступа", labels=["result"]
+        )
+        refreshes.add_metric(["success"], token_manager.refresh_total)
+        refreshes.add_metric(["failure"], token_manager.refresh_failures_total)
+        yield refreshes
+
+        # Только по эндпоинтам: расход пользователей доступен в /api/admin/usage
+        tokens = CounterMetricFamily(
+            "gigachat_tokens", "Токены GigaChat API по эндпоинтам сервиса (по блоку usage)", labels=["endpoint", "kind"]
+        )
+        for endpoint, counters in sorted(token_usage.endpoints.items()):
+            for field in USAGE_FIELDS[1:]:
+                tokens.add_metric([endpoint, field[:-len("_tokens")]], counters[field])
+        yield tokens
+
+        yield GaugeMetricFamily("gigachat_limiter_limit", "Текущий лимит одновременных запросов", value=upstream_limiter.limit)
+        yield GaugeMetricFamily("gigachat_in_flight", "Запросы к GigaChat API в обработке", value=upstream_limiter.in_flight)
+
+REGISTRY.register(ServiceStatsCollector())
+
+def render_metrics() -> bytes:
+    """Метрики в текстовом формате Prometheus"""
+    return generate_latest(REGISTRY)
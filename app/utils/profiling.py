@@ -0,0 +1,290 @@
+import asyncio
+import logging
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter
+from typing import Dict, Any, List, Optional, Set, AsyncIterator
+
+from fastapi import Request
+
+from app.config import profiling_config, ProfilingConfig
+
+logger = logging.getLogger("profiling")
+
+# Заголовок, которым отдельный запрос можно профилировать принудительно (значение - PROFILING_SECRET)
+PROFILE_HEADER = "X-Profile"
+
+PROFILE_SUFFIX = ".folded"
+
+_CWD = os.getcwd()
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(_CWD):
+        filename = os.path.relpath(filename, _CWD)
+    else:
+        # Для библиотек достаточно пакета и имени файла
+        filename = "/".join(filename.split(os.sep)[-2:])
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+def fold_stack(frame) -> str:
+    """Стек в свернутом формате flamegraph: функции от корня через «;»"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+def secret_matches(value: Optional[str], secret: str) -> bool:
+    """Сравнивает переданный секрет с настроенным (пустой секрет не совпадает ни с чем)"""
+    return bool(secret) and bool(value) and secrets.compare_digest(value, secret)
+
+class ProfileSession:
+    """Снимки стека, сделанные во время одного профилируемого запроса"""
+
+    __slots__ = ("name", "samples")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.samples: Counter = Counter()
+
+class SamplingProfiler:
+    """
+    Выборочный профилировщик запросов
+
+    Пока выполняется хотя бы один профилируемый запрос, отдельный поток
+    каждые interval_ms снимает стек потока цикла событий и добавляет его
+    ко всем активным сеансам. Профиль сохраняется в output_dir в формате
+    свернутых стеков (flamegraph.pl, speedscope, inferno). Цикл событий
+    один на все запросы, поэтому при одновременных запросах в профиль
+    попадает и работа других запросов - это цена низких накладных расходов.
+    """
+
+    def __init__(self, config: ProfilingConfig = profiling_config):
+        self.config = config
+        self.enabled = config.enabled
+        self.sample_rate = config.sample_rate
+        self.interval = max(0.001, config.interval_ms / 1000)
+        self.output_dir = config.output_dir
+        self.max_files = config.max_files
+        self._sessions: Set[ProfileSession] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._target_thread: Optional[int] = None
+
+        self.profiled_total = 0
+        self.samples_total = 0
+        self.write_errors = 0
+        self.last_profile: Optional[str] = None
+
+    def should_profile(self, request: Request) -> bool:
+        """Попадает ли запрос в выборку (или профилирование запрошено заголовком X-Profile)"""
+        if secret_matches(request.headers.get(PROFILE_HEADER), self.config.secret):
+            return True
+        return self.enabled and random.random() < self.sample_rate
+
+    def start(self, name: str) -> ProfileSession:
+        """Начинает сеанс профилирования в потоке цикла событий"""
+        session = ProfileSession(name)
+        with self._lock:
+            self._sessions.add(session)
+            self._target_thread = threading.get_ident()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample_loop, name="sampling-profiler", daemon=True)
+                self._thread.start()
+        return session
+
+    async def stop(self, session: ProfileSession) -> Optional[str]:
+        """Завершает сеанс и сохраняет профиль; возвращает путь к файлу или None, если файл не записан"""
+        with self._lock:
+            self._sessions.discard(session)
+        if not session.samples:
+            return None
+        # Запись файла выполняется в пуле потоков, чтобы не блокировать цикл событий
+        try:
+            path = await asyncio.get_running_loop().run_in_executor(None, self._dump, session)
+        except OSError as e:
+            # Ошибка записи профиля не должна влиять на ответ профилируемого запроса
+            self.write_errors += 1
+            logger.error("Не удалось сохранить профиль в %s: %s", self.output_dir, e)
+            return None
+        self.profiled_total += 1
+        self.last_profile = path
+        return path
+
+    def _sample_loop(self) -> None:
+        while True:
+            with self._lock:
+                if not self._sessions:
+                    self._thread = None
+                    return
+                frame = sys._current_frames().get(self._target_thread)
+                if frame is not None:
+                    stack = fold_stack(frame)
+                    for session in self._sessions:
+                        session.samples[stack] += 1
+                    self.samples_total += 1
+                del frame
+            time.sleep(self.interval)
+
+    def _dump(self, session: ProfileSession) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", session.name).strip("_")
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{slug}-{uuid.uuid4().hex[:8]}{PROFILE_SUFFIX}"
+        path = os.path.join(self.output_dir, filename)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in session.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        self._rotate()
+        return path
+
+    def _rotate(self) -> None:
+        """Удаляет самые старые профили сверх max_files"""
+        for filename in self.recent(limit=None)[self.max_files:]:
+            try:
+                os.remove(os.path.join(self.output_dir, filename))
+            except OSError:
+                pass
+
+    def recent(self, limit: Optional[int] = 10) -> List[str]:
+        """Имена последних сохраненных профилей (новые первыми)"""
+        try:
+            names = [name for name in os.listdir(self.output_dir) if name.endswith(PROFILE_SUFFIX)]
+        except OSError:
+            return []
+        names.sort(reverse=True)
+        return names if limit is None else names[:limit]
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние профилировщика для эндпоинта /health"""
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "active_sessions": len(self._sessions),
+            "profiled_total": self.profiled_total,
+            "samples_total": self.samples_total,
+            "write_errors": self.write_errors,
+            "last_profile": self.last_profile
+        }
+
+class LoopLagMonitor:
+    """
+    Контроль блокировок цикла событий
+
+    Корутина отмечает «пульс» каждые threshold/2 секунд. Отдельный поток
+    проверяет пульс и, если тот опаздывает дольше threshold, снимает стек
+    потока цикла событий, пока блокировка еще длится, - в лог попадает
+    код, который ее вызвал (синхронный sleep, чтение файла, тяжелые
+    вычисления). После окончания блокировки в лог пишется ее длительность.
+    """
+
+    def __init__(self, config: ProfilingConfig = profiling_config):
+        self.enabled = config.loop_monitor
+        self.threshold = config.loop_lag_threshold_ms / 1000
+        self._beat = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._loop_thread: Optional[int] = None
+
+        self.blocked_total = 0
+        self.max_lag = 0.0
+        self.last_blocked_at: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self) -> None:
+        """Запускает контроль (вызывается при запуске приложения или из /api/admin/profiling)"""
+        if not self.enabled or self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped = threading.Event()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, args=(self._stopped,), name="loop-lag-monitor", daemon=True)
+        self._thread.start()
+        logger.info("Запущен контроль блокировок цикла событий (порог %.0f мс)", self.threshold * 1000)
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stopped.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._thread = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            interval = self.threshold / 2
+            self._beat = time.monotonic()
+            await asyncio.sleep(interval)
+            lag = time.monotonic() - self._beat - interval
+            self.max_lag = max(self.max_lag, lag)
+            if lag > self.threshold:
+                logger.warning("Цикл событий был заблокирован %.0f мс", lag * 1000)
+
+    def _watch(self, stopped: threading.Event) -> None:
+        reported = False
+        while not stopped.wait(self.threshold / 4):
+            lag = time.monotonic() - self._beat - self.threshold / 2
+            if lag <= self.threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            # Блокировка еще длится: стек показывает код, который ее вызвал
+            reported = True
+            self.blocked_total += 1
+            self.last_blocked_at = time.time()
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+            del frame
+            logger.warning(
+                "Цикл событий заблокирован дольше %.0f мс. Стек:\n%s",
+                self.threshold * 1000,
+                stack
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние контроля для эндпоинта /health"""
+        return {
+            "enabled": self.enabled,
+            "running": self.running,
+            "threshold_ms": round(self.threshold * 1000, 1),
+            "blocked_total": self.blocked_total,
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "last_blocked_at": self.last_blocked_at
+        }
+
+# Глобальные профилировщик и контроль цикла событий
+sampling_profiler = SamplingProfiler()
+loop_monitor = LoopLagMonitor()
+
+async def profile_request(request: Request) -> AsyncIterator[None]:
+    """Зависимость роутеров: профилирует запрос, если он попал в выборку"""
+    if not sampling_profiler.should_profile(request):
+        yield
+        return
+    route = request.scope.get("route")
+    name = f"{request.method} {getattr(route, 'path', request.url.path)}"
+    session = sampling_profiler.start(name)
+    try:
+        yield
+    finally:
+        path = await sampling_profiler.stop(session)
+        if path:
+            logger.info("Профиль запроса %s сохранен в %s", name, path)
@@ -0,0 +1,222 @@
+import math
+import random
+import time
+from collections import deque
+from typing import Dict, Any, Optional, Deque
+
+from app.config import resilience_config, ResilienceConfig
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """GigaChat API недоступен: выключатель разомкнут, запрос не отправлялся"""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"GigaChat API временно недоступен, повторите через {math.ceil(retry_after)} с")
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        """Заголовки ответа 503 для клиента"""
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+def is_upstream_failure(status_code: int) -> bool:
+    """Ответ говорит о перегрузке или сбое API (а не об ошибке в запросе)"""
+    return status_code == 429 or status_code >= 500
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель запросов к GigaChat API
+
+    В замкнутом состоянии запросы проходят, а их исходы записываются в
+    скользящее окно. Когда доля сбоев в окне достигает failure_ratio,
+    выключатель размыкается: запросы сразу завершаются CircuitOpenError,
+    не дожидаясь таймаутов. Через open_seconds выключатель переходит в
+    полуоткрытое состояние и пропускает один пробный запрос: успех
+    замыкает выключатель, сбой снова размыкает его.
+    """
+
+    def __init__(self, config: ResilienceConfig = resilience_config):
+        self.enabled = config.breaker_enabled
+        self.min_calls = config.breaker_min_calls
+        self.failure_ratio = config.breaker_failure_ratio
+        self.open_seconds = config.breaker_open_seconds
+        self._window: Deque[bool] = deque(maxlen=max(1, config.breaker_window))
+        self.state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._probe_started_at: Optional[float] = None
+
+        self.opened_total = 0
+        self.rejected_total = 0
+
+    def before_call(self) -> None:
+        """
+        Проверяет, можно ли отправить запрос
+
+        Raises:
+            CircuitOpenError: Если выключатель разомкнут или пробный запрос уже отправлен
+        """
+        if not self.enabled or self.state == STATE_CLOSED:
+            return
+        now = time.monotonic()
+        if self.state == STATE_OPEN:
+            remaining = self._opened_at + self.open_seconds - now
+            if remaining > 0:
+                self.rejected_total += 1
+                raise CircuitOpenError(remaining)
+            self.state = STATE_HALF_OPEN
+            self._probe_started_at = None
+        # Полуоткрытое состояние: одновременно выполняется только один пробный запрос.
+        # Пробный запрос, исход которого не записан (например, отменен), не блокирует дольше open_seconds
+        if self._probe_started_at is not None and now - self._probe_started_at < self.open_seconds:
+            self.rejected_total += 1
+            raise CircuitOpenError(self._probe_started_at + self.open_seconds - now)
+        self._probe_started_at = now
+
+    def check(self) -> None:
+        """
+        Проверяет, пропустит ли выключатель запрос, не занимая место пробного запроса
+
+        Потоковые эндпоинты вызывают проверку до отправки заголовков ответа,
+        чтобы клиент и прокси получили 503, а не событие error в потоке.
+
+        Raises:
+            CircuitOpenError: Если выключатель разомкнут или пробный запрос уже отправлен
+        """
+        if not self.enabled or self.state == STATE_CLOSED:
+            return
+        now = time.monotonic()
+        if self.state == STATE_OPEN:
+            remaining = self._opened_at + self.open_seconds - now
+        elif self._probe_started_at is not None:
+            remaining = self._probe_started_at + self.open_seconds - now
+        else:
+            return
+        if remaining > 0:
+            self.rejected_total += 1
+            raise CircuitOpenError(remaining)
+
+    def record_success(self) -> None:
+        if self.state == STATE_HALF_OPEN:
+            self.state = STATE_CLOSED
+            self._window.clear()
+            self._probe_started_at = None
+        self._window.append(True)
+
+    def record_failure(self) -> None:
+        if self.state == STATE_HALF_OPEN:
+            self._open()
+            return
+        self._window.append(False)
+        if self.state == STATE_CLOSED and len(self._window) >= self.min_calls:
+            failures = self._window.count(False)
+            if failures / len(self._window) >= self.failure_ratio:
+                self._open()
+
+    def _open(self) -> None:
+        self.state = STATE_OPEN
+        self._opened_at = time.monotonic()
+        self._probe_started_at = None
+        self._window.clear()
+        self.opened_total += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние выключателя для эндпоинта /health"""
+        retry_after = None
+        if self.state == STATE_OPEN:
+            retry_after = round(max(0.0, self._opened_at + self.open_seconds - time.monotonic()), 2)
+        return {
+            "enabled": self.enabled,
+            "state": self.state,
+            "retry_after": retry_after,
+            "window_calls": len(self._window),
+            "window_failures": self._window.count(False),
+            "opened_total": self.opened_total,
+            "rejected_total": self.rejected_total
+        }
+
+class RetryPolicy:
+    """
+    Повторы запросов при 429, 5xx и сетевых ошибках
+
+    Задержка растет экспоненциально до backoff_max и выбирается случайно
+    в этих пределах (full jitter), чтобы повторы разных клиентов не
+    совпадали по времени. Бюджет ограничивает число повторов долей от
+    числа запросов за последние window секунд, поэтому во время сбоя
+    повторы не умножают нагрузку на API.
+    """
+
+    def __init__(self, config: ResilienceConfig = resilience_config):
+        self.max_attempts = max(1, config.retry_max_attempts)
+        self.backoff_base = config.retry_backoff_base
+        self.backoff_max = config.retry_backoff_max
+        self.budget_ratio = config.retry_budget_ratio
+        self.budget_min_per_second = config.retry_budget_min_per_second
+        self.window = config.retry_budget_window
+        self._requests: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+
+        self.retries_total = 0
+        self.budget_exhausted_total = 0
+
+    def _trim(self, now: float) -> None:
+        deadline = now - self.window
+        for events in (self._requests, self._retries):
+            while events and events[0] < deadline:
+                events.popleft()
+
+    def record_request(self) -> None:
+        """Учитывает новый (не повторный) запрос"""
+        now = time.monotonic()
+        self._trim(now)
+        self._requests.append(now)
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> Optional[float]:
+        """
+        Задержка перед повтором после неудачной попытки attempt или None, если повторять нельзя
+
+        Args:
+            attempt: Номер неудачной попытки (с 1)
+            retry_after: Значение заголовка Retry-After ответа, если он есть
+        """
+        if attempt >= self.max_attempts:
+            return None
+        now = time.monotonic()
+        self._trim(now)
+        allowed = max(self.budget_ratio * len(self._requests), self.budget_min_per_second * self.window)
+        if len(self._retries) >= allowed:
+            self.budget_exhausted_total += 1
+            return None
+        if retry_after is not None and retry_after > self.backoff_max:
+            # API просит подождать дольше, чем имеет смысл держать запрос клиента
+            return None
+        self._retries.append(now)
+        self.retries_total += 1
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+        return max(delay, retry_after or 0.0)
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика повторов для эндпоинта /health"""
+        self._trim(time.monotonic())
+        return {
+            "max_attempts": self.max_attempts,
+            "window_requests": len(self._requests),
+            "window_retries": len(self._retries),
+            "retries_total": self.retries_total,
+            "budget_exhausted_total": self.budget_exhausted_total
+        }
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Значение заголовка Retry-After в секундах (формат даты не поддерживается)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+# Общие для всех запросов к GigaChat API выключатель и политика повторов
+upstream_breaker = CircuitBreaker()
+retry_policy = RetryPolicy()
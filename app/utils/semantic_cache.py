@@ -0,0 +1,211 @@
+import hashlib
+import itertools
+import random
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, NamedTuple, Set, Tuple
+
+from app.config import semantic_cache_config, SemanticCacheConfig
+from app.utils.cache import normalize_prompt
+from app.utils.text_search import tokenize, NEGATION_WORDS
+
+# Простое число Мерсенна 2^61 - 1 для универсального хэширования MinHash
+_MERSENNE_PRIME = (1 << 61) - 1
+
+class SemanticHit(NamedTuple):
+    """Найденный в кэше ответ на похожий вопрос"""
+    answer: str
+    similarity: float
+    question: str
+
+class _SemanticEntry(NamedTuple):
+    namespace: str
+    question: str
+    signature: Tuple[int, ...]
+    answer: str
+    expires_at: float
+
+def shingles(question: str) -> Set[str]:
+    """
+    Признаки вопроса для MinHash: основы слов и их символьные триграммы
+
+    Основы слов делают сравнение устойчивым к падежам и формам глаголов,
+    триграммы - к однокоренным словам и опечаткам. Порядок слов не учитывается.
+    Отрицание («не», «нет», «без» и т.д.) остается признаком, а признаки
+    следующего за ним слова помечаются «!», чтобы вопрос и его отрицание
+    («Почему платеж не прошел?» и «Почему платеж прошел?») не считались похожими.
+    """
+    features: Set[str] = set()
+    negated = False
+    for token in tokenize(question, keep=NEGATION_WORDS):
+        if token in NEGATION_WORDS:
+            features.add(token)
+            negated = True
+            continue
+        mark = "!" if negated else ""
+        negated = False
+        features.add(mark + token)
+        padded = f"#{token}#"
+        features.update(mark + padded[i:i + 3] for i in range(len(padded) - 2))
+    return features
+
+class SemanticCache:
+    """
+    Кэш ответов ассистента по похожести вопросов
+
+    Для каждого вопроса вычисляется MinHash-сигнатура; доля совпадающих
+    координат двух сигнатур оценивает коэффициент Жаккара их признаков.
+    Кандидаты ищутся через LSH (сигнатура делится на полосы, вопросы
+    с совпадающей полосой попадают в одну корзину), поэтому поиск не
+    перебирает весь кэш. Записи разделены по пространствам имен (страница
+    пользователя), ограничены по количеству (LRU) и времени жизни и
+    сбрасываются целиком при смене версии промпта или документации.
+    """
+
+    def __init__(self, config: SemanticCacheConfig = semantic_cache_config):
+        self.enabled = config.enabled
+        self.threshold = config.threshold
+        self.max_entries = config.max_entries
+        self.ttl = config.ttl
+        self.bands = max(1, config.bands)
+        self.rows = max(1, config.num_perm // self.bands)
+        num_perm = self.bands * self.rows
+        generator = random.Random(1)
+        self._perms = [
+            (generator.randrange(1, _MERSENNE_PRIME), generator.randrange(0, _MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+        self.version: Optional[str] = None
+        self._entries: "OrderedDict[int, _SemanticEntry]" = OrderedDict()
+        self._buckets: Dict[Tuple, Set[int]] = {}
+        self._ids = itertools.count()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def signature(self, features: Set[str]) -> Tuple[int, ...]:
+        """MinHash-сигнатура набора признаков"""
+        hashes = [
+            int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            for feature in features
+        ]
+        return tuple(
+            min((a * value + b) % _MERSENNE_PRIME for value in hashes)
+            for a, b in self._perms
+        )
+
+    def _band_keys(self, namespace: str, signature: Tuple[int, ...]) -> List[Tuple]:
+        return [
+            (namespace, band, signature[band * self.rows:(band + 1) * self.rows])
+            for band in range(self.bands)
+        ]
+
+    def _check_version(self, version: str) -> None:
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self.clear()
+            self.version = version
+
+    def lookup(self, question: str, namespace: str, version: str) -> Optional[SemanticHit]:
+        """
+        Ищет ответ на самый похожий вопрос в том же пространстве имен
+
+        Args:
+            question: Вопрос пользователя
+            namespace: Пространство имен (например, текущая страница пользователя)
+            version: Версия промпта; при ее смене кэш очищается
+
+        Returns:
+            Ответ с оценкой похожести или None, если похожих вопросов нет
+        """
+        if not self.enabled:
+            return None
+        self._check_version(version)
+        features = shingles(question)
+        if not features:
+            self.misses += 1
+            return None
+        signature = self.signature(features)
+        candidates: Set[int] = set()
+        for key in self._band_keys(namespace, signature):
+            candidates.update(self._buckets.get(key, ()))
+
+        now = time.time()
+        best: Optional[Tuple[float, int]] = None
+        for entry_id in candidates:
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                continue
+            if entry.expires_at <= now:
+                self._remove(entry_id)
+                continue
+            similarity = sum(a == b for a, b in zip(signature, entry.signature)) / len(signature)
+            if similarity >= self.threshold and (best is None or similarity > best[0]):
+                best = (similarity, entry_id)
+
+        if best is None:
+            self.misses += 1
+            return None
+        similarity, entry_id = best
+        self._entries.move_to_end(entry_id)
+        self.hits += 1
+        entry = self._entries[entry_id]
+        return SemanticHit(entry.answer, round(similarity, 4), entry.question)
+
+    def store(self, question: str, namespace: str, version: str, answer: str) -> None:
+        """Сохраняет ответ на вопрос, вытесняя самые давние записи при превышении лимита"""
+        if not self.enabled:
+            return
+        self._check_version(version)
+        features = shingles(question)
+        if not features:
+            return
+        signature = self.signature(features)
+        entry_id = next(self._ids)
+        self._entries[entry_id] = _SemanticEntry(
+            namespace, normalize_prompt(question), signature, answer, time.time() + self.ttl
+        )
+        for key in self._band_keys(namespace, signature):
+            self._buckets.setdefault(key, set()).add(entry_id)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        for key in self._band_keys(entry.namespace, entry.signature):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def clear(self) -> None:
+        """Удаляет все записи"""
+        self._entries.clear()
+        self._buckets.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика кэша для эндпоинта /health"""
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+# Глобальный семантический кэш ответов ассистента
+semantic_cache = SemanticCache()
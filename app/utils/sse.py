@@ -0,0 +1,40 @@
+import json
+from typing import Any, AsyncIterator, Dict
+import logging
+
+from fastapi.responses import StreamingResponse
+
+from app.utils.resilience import CircuitOpenError
+
+logger = logging.getLogger("sse")
+
+def format_sse(event: str, data: Any) -> str:
+    """Форматирует одно событие Server-Sent Events"""
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+async def _encode_events(events: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    try:
+        async for item in events:
+            yield format_sse(item["event"], item["data"])
+    except Exception as e:
+        # Заголовки уже отправлены, поэтому ошибка передается отдельным событием
+        logger.error("Ошибка во время потоковой передачи: %s", e)
+        data = {"detail": str(e)}
+        if isinstance(e, CircuitOpenError):
+            data["retry_after"] = e.headers["Retry-After"]
+        yield format_sse("error", data)
+
+def sse_response(events: AsyncIterator[Dict[str, Any]]) -> StreamingResponse:
+    """
+    Оборачивает поток событий {"event": ..., "data": ...} в ответ text/event-stream
+    """
+    return StreamingResponse(
+        _encode_events(events),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Отключаем буферизацию ответа в nginx
+            "X-Accel-Buffering": "no"
+        }
+    )
@@ -0,0 +1,204 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Tuple, Iterable, FrozenSet
+
+# Служебные слова, которые не несут смысла для поиска
+STOP_WORDS = frozenset("""
+а без более бы был была были было быть в вам вас весь во вот все всего всех вы где да даже для до его ее
+если есть еще же за здесь и из или им их к как ко когда который кто ли либо мне может мы на над надо не
+него нее нет ни них но ну о об однако он она они оно от очень по под при с со так также такой там те тем
+то того тоже той только том ты у уже хотя чего чей чем что чтобы чье чья эта эти это я мой моя
+нужно можно хочу сделать
+""".split())
+
+# Отрицания меняют смысл вопроса на противоположный; для поиска они служебные,
+# но в признаках семантического кэша сохраняются (см. tokenize(keep=...))
+NEGATION_WORDS = frozenset("не нет ни нельзя без".split())
+
+_TOKEN_RE = re.compile(r"[0-9a-zа-яё]+", re.IGNORECASE)
+
+_VOWELS = "аеиоуыэюя"
+
+# Окончания для стеммера Портера (Snowball) для русского языка
+_PERFECTIVE_GERUND_1 = ("вшись", "вши", "в")
+_PERFECTIVE_GERUND_2 = ("ившись", "ывшись", "ивши", "ывши", "ив", "ыв")
+_ADJECTIVE = (
+    "ими", "ыми", "его", "ого", "ему", "ому", "ее", "ие", "ые", "ое", "ей", "ий", "ый", "ой",
+    "ем", "им", "ым", "ом", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею"
+)
+_PARTICIPLE_1 = ("ем", "нн", "вш", "ющ", "щ")
+_PARTICIPLE_2 = ("ивш", "ывш", "ующ")
+_REFLEXIVE = ("ся", "сь")
+_VERB_1 = ("ете", "йте", "ешь", "нно", "ла", "на", "ли", "ем", "ло", "но", "ет", "ют", "ны", "ть", "й", "л", "н")
+_VERB_2 = (
+    "ейте", "уйте", "ила", "ыла", "ена", "ите", "или", "ыли", "ило", "ыло", "ено", "ует", "уют", "ены",
+    "ить", "ыть", "ишь", "ей", "уй", "ил", "ыл", "им", "ым", "ен", "ят", "ит", "ыт", "ую", "ю"
+)
+_NOUN = (
+    "иями", "ями", "ами", "ией", "иям", "ием", "иях", "ев", "ов", "ие", "ье", "еи", "ии", "ей", "ой",
+    "ий", "ям", "ем", "ам", "ом", "ах", "ях", "ию", "ью", "ия", "ья", "а", "е", "и", "й", "о", "у",
+    "ы", "ь", "ю", "я"
+)
+_SUPERLATIVE = ("ейше", "ейш")
+_DERIVATIONAL = ("ость", "ост")
+
+def _longest(endings: Iterable[str]) -> Tuple[str, ...]:
+    """Упорядочивает окончания от длинных к коротким"""
+    return tuple(sorted(endings, key=len, reverse=True))
+
+_ADJECTIVE = _longest(_ADJECTIVE)
+_PARTICIPLE_2 = _longest(_PARTICIPLE_2)
+_PARTICIPLE_1 = _longest(_PARTICIPLE_1)
+_VERB_1 = _longest(_VERB_1)
+_VERB_2 = _longest(_VERB_2)
+_NOUN = _longest(_NOUN)
+
+def _remove_ending(word: str, start: int, endings: Tuple[str, ...], preceded: bool = False) -> Tuple[str, bool]:
+    """
+    Удаляет самое длинное окончание из endings, лежащее в области word[start:]
+
+    preceded - окончание группы 1, которому должна предшествовать буква «а» или «я»
+    """
+    region = word[start:]
+    for ending in endings:
+        if region.endswith(ending):
+            stem = word[:-len(ending)]
+            if preceded and not (len(stem) > start and stem[-1] in "ая"):
+                continue
+            return stem, True
+    return word, False
+
+def _regions(word: str) -> Tuple[int, int]:
+    """Начало областей RV и R2 слова"""
+    rv = len(word)
+    for i, char in enumerate(word):
+        if char in _VOWELS:
+            rv = i + 1
+            break
+    r1 = len(word)
+    for i in range(1, len(word)):
+        if word[i - 1] in _VOWELS and word[i] not in _VOWELS:
+            r1 = i + 1
+            break
+    r2 = len(word)
+    for i in range(r1 + 1, len(word)):
+        if word[i - 1] in _VOWELS and word[i] not in _VOWELS:
+            r2 = i + 1
+            break
+    return rv, r2
+
+def stem(word: str) -> str:
+    """
+    Возвращает основу русского слова (стеммер Портера, алгоритм Snowball)
+
+    Слова на латинице и числа возвращаются без изменений.
+    """
+    word = word.lower().replace("ё", "е")
+    if not re.fullmatch("[а-я]+", word):
+        return word
+    rv, r2 = _regions(word)
+
+    # Шаг 1: деепричастие, иначе возвратная частица и прилагательное/глагол/существительное
+    word, found = _remove_ending(word, rv, _PERFECTIVE_GERUND_2)
+    if not found:
+        word, found = _remove_ending(word, rv, _PERFECTIVE_GERUND_1, preceded=True)
+    if not found:
+        word, _ = _remove_ending(word, rv, _REFLEXIVE)
+        # Прилагательное, возможно с предшествующим суффиксом причастия
+        word, found = _remove_ending(word, rv, _ADJECTIVE)
+        if found:
+            word, participle = _remove_ending(word, rv, _PARTICIPLE_2)
+            if not participle:
+                word, _ = _remove_ending(word, rv, _PARTICIPLE_1, preceded=True)
+        else:
+            word, found = _remove_ending(word, rv, _VERB_2)
+            if not found:
+                word, found = _remove_ending(word, rv, _VERB_1, preceded=True)
+            if not found:
+                word, _ = _remove_ending(word, rv, _NOUN)
+
+    # Шаг 2: конечная «и»
+    word, _ = _remove_ending(word, rv, ("и",))
+
+    # Шаг 3: словообразовательный суффикс в области R2
+    word, _ = _remove_ending(word, r2, _DERIVATIONAL)
+
+    # Шаг 4: «нн», превосходная степень, мягкий знак
+    if word[rv:].endswith("нн"):
+        word = word[:-1]
+    else:
+        word, found = _remove_ending(word, rv, _SUPERLATIVE)
+        if found and word[rv:].endswith("нн"):
+            word = word[:-1]
+        elif not found:
+            word, _ = _remove_ending(word, rv, ("ь",))
+    return word
+
+def tokenize(text: str, keep: FrozenSet[str] = frozenset()) -> List[str]:
+    """Разбивает текст на основы слов без служебных слов (слова из keep остаются как есть)"""
+    tokens = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        token = match.group(0)
+        if token in keep:
+            tokens.append(token)
+            continue
+        if token in STOP_WORDS or len(token) < 2 and not token.isdigit():
+            continue
+        tokens.append(stem(token))
+    return tokens
+
+class BM25Index:
+    """
+    Инвертированный индекс с ранжированием Okapi BM25
+
+    Документы добавляются списками токенов; поиск суммирует вклад каждого
+    термина запроса только по документам из его списка вхождений.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.doc_lengths: List[int] = []
+        self.avg_length = 0.0
+        self._idf: Dict[str, float] = {}
+
+    def add(self, tokens: List[str]) -> int:
+        """Добавляет документ и возвращает его номер"""
+        doc_id = len(self.doc_lengths)
+        for term, count in Counter(tokens).items():
+            self.postings.setdefault(term, []).append((doc_id, count))
+        self.doc_lengths.append(len(tokens))
+        self._idf = {}
+        return doc_id
+
+    def prepare(self) -> None:
+        """Вычисляет IDF терминов; вызывается один раз после добавления документов"""
+        total = len(self.doc_lengths)
+        self.avg_length = sum(self.doc_lengths) / total if total else 0.0
+        self._idf = {
+            term: math.log(1 + (total - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def search(self, tokens: List[str], top_k: int = 5) -> List[Tuple[int, float]]:
+        """
+        Возвращает до top_k пар (номер документа, оценка) по убыванию оценки
+
+        Документы без общих с запросом терминов в результат не попадают.
+        """
+        if not self._idf and self.postings:
+            self.prepare()
+        scores: Dict[int, float] = {}
+        for term in set(tokens):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, count in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / (self.avg_length or 1))
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * count * (self.k1 + 1) / (count + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
@@ -0,0 +1,138 @@
+import asyncio
+import os
+from contextlib import closing
+import sqlite3
+import time
+from typing import Optional, Dict, Any
+import logging
+
+from app.config import gigachat_config, GigaChatConfig
+
+logger = logging.getLogger("token_store")
+
+class TokenStore:
+    """
+    Базовое хранилище токена доступа
+
+    Хранилище позволяет нескольким процессам (воркерам uvicorn) использовать
+    один токен: право на обновление получает воркер, захвативший аренду (lease),
+    остальные читают токен из хранилища.
+    """
+
+    # Разделяется ли хранилище между процессами
+    shared = False
+
+    async def load(self) -> Optional[Dict[str, Any]]:
+        """Возвращает сохраненный токен ({"access_token", "expires_at"}) или None"""
+        return None
+
+    async def save(self, access_token: str, expires_at: float) -> None:
+        """Сохраняет токен"""
+
+    async def acquire_lease(self, owner: str, ttl: float) -> bool:
+        """Пытается захватить право на обновление токена на ttl секунд"""
+        return True
+
+    async def release_lease(self, owner: str) -> None:
+        """Освобождает право на обновление токена"""
+
+    def describe(self) -> Dict[str, Any]:
+        """Описание хранилища для эндпоинта /health"""
+        return {"backend": "memory"}
+
+class MemoryTokenStore(TokenStore):
+    """Токен хранится только в памяти процесса (поведение по умолчанию)"""
+
+class SQLiteTokenStore(TokenStore):
+    """
+    Токен и аренда хранятся в файле SQLite, общем для всех воркеров на хосте
+
+    Операции с файлом выполняются в пуле потоков, чтобы не блокировать event loop.
+    """
+
+    shared = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS token ("
+                "id INTEGER PRIMARY KEY CHECK (id = 1), "
+                "access_token TEXT NOT NULL, expires_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS lease ("
+                "id INTEGER PRIMARY KEY CHECK (id = 1), "
+                "owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            # Файл содержит секрет - доступ только владельцу
+            try:
+                os.chmod(self.path, 0o600)
+            except OSError:
+                pass
+            self._initialized = True
+        return conn
+
+    def _load_sync(self) -> Optional[Dict[str, Any]]:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT access_token, expires_at FROM token WHERE id = 1").fetchone()
+        if row is None:
+            return None
+        return {"access_token": row[0], "expires_at": row[1]}
+
+    def _save_sync(self, access_token: str, expires_at: float) -> None:
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO token (id, access_token, expires_at, updated_at) VALUES (1, ?, ?, ?)",
+                (access_token, expires_at, time.time())
+            )
+
+    def _acquire_lease_sync(self, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT owner, expires_at FROM lease WHERE id = 1").fetchone()
+                if row is not None and row[0] != owner and row[1] > now:
+                    return False
+                conn.execute(
+                    "INSERT OR REPLACE INTO lease (id, owner, expires_at) VALUES (1, ?, ?)",
+                    (owner, now + ttl)
+                )
+                return True
+            finally:
+                conn.execute("COMMIT")
+
+    def _release_lease_sync(self, owner: str) -> None:
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM lease WHERE id = 1 AND owner = ?", (owner,))
+
+    async def load(self) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._load_sync)
+
+    async def save(self, access_token: str, expires_at: float) -> None:
+        await asyncio.to_thread(self._save_sync, access_token, expires_at)
+
+    async def acquire_lease(self, owner: str, ttl: float) -> bool:
+        return await asyncio.to_thread(self._acquire_lease_sync, owner, ttl)
+
+    async def release_lease(self, owner: str) -> None:
+        await asyncio.to_thread(self._release_lease_sync, owner)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"backend": "sqlite", "path": self.path}
+
+def create_token_store(config: GigaChatConfig = gigachat_config) -> TokenStore:
+    """Создает хранилище токена по настройке GIGACHAT_TOKEN_STORE"""
+    backend = config.token_store.lower()
+    if backend == "sqlite":
+        logger.info("Используется общее хранилище токена SQLite: %s", config.token_store_path)
+        return SQLiteTokenStore(config.token_store_path)
+    if backend != "memory":
+        logger.warning("Неизвестное хранилище токена '%s', используется memory", config.token_store)
+    return MemoryTokenStore()
@@ -0,0 +1,180 @@
+import hashlib
+import math
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+from app.config import tokens_config, TokensConfig
+
+# Среднее число символов на токен GigaChat для русского текста (начальная оценка до калибровки)
+CHARS_PER_TOKEN = 3.0
+
+# Служебные токены на каждое сообщение запроса (роль и разделители)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Вес нового замера при калибровке (экспоненциальное сглаживание)
+CALIBRATION_ALPHA = 0.3
+
+# Текст короче этого размера не используется для калибровки: в нем велика доля служебных токенов
+CALIBRATION_MIN_CHARS = 200
+
+OVERFLOW_TRIM = "trim"
+OVERFLOW_REJECT = "reject"
+
+class PromptTooLargeError(ValueError):
+    """Промпт превышает бюджет токенов и не может быть отправлен"""
+
+    def __init__(self, tokens: int, budget: int):
+        self.tokens = tokens
+        self.budget = budget
+        super().__init__(f"Промпт слишком большой: около {tokens} токенов при лимите {budget}")
+
+def _text_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+class TokenCounter:
+    """
+    Оценка числа токенов без обращения к API и контроль бюджета промпта
+
+    Оценка - длина текста, деленная на среднее число символов на токен.
+    Коэффициент уточняется по точным подсчетам эндпоинта /tokens/count
+    для выборки отправляемых промптов; точные подсчеты кэшируются по хэшу
+    текста и используются вместо оценки для повторяющихся текстов.
+    """
+
+    def __init__(self, config: TokensConfig = tokens_config):
+        self.config = config
+        self.chars_per_token = CHARS_PER_TOKEN
+        self._exact: "OrderedDict[bytes, int]" = OrderedDict()
+        self._prompts = 0
+
+        self.calibrations = 0
+        self.calibration_errors = 0
+        self.trimmed = 0
+        self.rejected = 0
+
+    def estimate(self, text: str) -> int:
+        """Число токенов в тексте: точное, если текст уже подсчитан API, иначе оценка"""
+        if not text:
+            return 0
+        if self._exact:
+            exact = self._exact.get(_text_key(text))
+            if exact is not None:
+                return exact
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def estimate_messages(self, messages: List[Dict[str, str]]) -> int:
+        """Оценка размера промпта из нескольких сообщений"""
+        return sum(self.estimate(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+    def should_calibrate(self) -> bool:
+        """Отмечает отправку промпта и сообщает, нужно ли подсчитать его токены точно"""
+        if not self.config.calibrate or self.config.calibration_every <= 0:
+            return False
+        self._prompts += 1
+        # Первый промпт и далее каждый calibration_every-й
+        return (self._prompts - 1) % self.config.calibration_every == 0
+
+    def record_exact(self, text: str, tokens: int) -> None:
+        """Сохраняет точный подсчет API и уточняет коэффициент оценки"""
+        if not text or tokens <= 0:
+            return
+        self._exact[_text_key(text)] = tokens
+        while len(self._exact) > self.config.count_cache_size:
+            self._exact.popitem(last=False)
+        if len(text) >= CALIBRATION_MIN_CHARS:
+            ratio = len(text) / tokens
+            self.chars_per_token = CALIBRATION_ALPHA * ratio + (1 - CALIBRATION_ALPHA) * self.chars_per_token
+            self.calibrations += 1
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Обрезает текст до оценки max_tokens токенов, по возможности по границе слова"""
+        if max_tokens <= 0:
+            return ""
+        if self.estimate(text) <= max_tokens:
+            return text
+        limit = int(max_tokens * self.chars_per_token)
+        cut = text[:limit]
+        boundary = cut.rfind(" ")
+        if boundary > limit * 0.8:
+            cut = cut[:boundary]
+        return cut.rstrip()
+
+    def fit_text(self, text: str, template: str) -> str:
+        """
+        Ограничивает исходный текст так, чтобы промпт уложился в бюджет
+
+        Args:
+            text: Текст пользователя, который подставляется в шаблон
+            template: Промпт без текста пользователя (его размер вычитается из бюджета)
+
+        Returns:
+            Исходный или сокращенный текст
+
+        Raises:
+            PromptTooLargeError: Если бюджет превышен, а TOKENS_OVERFLOW=reject
+        """
+        budget = self.config.max_prompt_tokens
+        available = budget - self.estimate(template) - MESSAGE_OVERHEAD_TOKENS
+        tokens = self.estimate(text)
+        if tokens <= available:
+            return text
+        if self.config.overflow == OVERFLOW_REJECT or available <= 0:
+            self.rejected += 1
+            raise PromptTooLargeError(tokens + budget - available, budget)
+        self.trimmed += 1
+        return self.truncate(text, available)
+
+    def fit_messages(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        Ограничивает сообщения запроса бюджетом токенов
+
+        Сначала отбрасываются самые старые сообщения между системным промптом
+        и последним сообщением (история диалога), затем сокращается последнее
+        сообщение.
+
+        Raises:
+            PromptTooLargeError: Если бюджет превышен, а TOKENS_OVERFLOW=reject,
+                или если в бюджет не помещается даже системный промпт
+        """
+        budget = self.config.max_prompt_tokens
+        total = self.estimate_messages(messages)
+        if total <= budget:
+            return messages
+        if self.config.overflow == OVERFLOW_REJECT:
+            self.rejected += 1
+            raise PromptTooLargeError(total, budget)
+
+        messages = list(messages)
+        first = 1 if messages and messages[0]["role"] == "system" else 0
+        while total > budget and len(messages) - first > 1:
+            dropped = messages.pop(first)
+            total -= self.estimate(dropped["content"]) + MESSAGE_OVERHEAD_TOKENS
+        if total > budget:
+            last = messages[-1]
+            available = budget - (total - self.estimate(last["content"]))
+            if available <= 0:
+                self.rejected += 1
+                raise PromptTooLargeError(total, budget)
+            messages[-1] = dict(last, content=self.truncate(last["content"], available))
+        self.trimmed += 1
+        return messages
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние оценки токенов для эндпоинта /health"""
+        return {
+            "max_prompt_tokens": self.config.max_prompt_tokens,
+            "overflow": self.config.overflow,
+            "chars_per_token": round(self.chars_per_token, 4),
+            "exact_counts": len(self._exact),
+            "calibrations": self.calibrations,
+            "calibration_errors": self.calibration_errors,
+            "trimmed": self.trimmed,
+            "rejected": self.rejected
+        }
+
+# Глобальный счетчик токенов
+token_counter = TokenCounter()
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Оценивает число токенов в тексте без обращения к API"""
+    return token_counter.estimate(text or "")
@@ -0,0 +1,120 @@
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional
+
+from app.config import tokens_config, TokensConfig
+
+# Метка запросов к API, сделанных вне HTTP-запроса (фоновые задания, векторизация)
+BACKGROUND_ENDPOINT = "background"
+
+USAGE_FIELDS = ("requests", "prompt_tokens", "completion_tokens", "precached_prompt_tokens", "total_tokens")
+
+def _empty() -> Dict[str, int]:
+    return dict.fromkeys(USAGE_FIELDS, 0)
+
+class RequestUsage:
+    """Сведения о текущем HTTP-запросе для учета токенов"""
+
+    __slots__ = ("scope", "user_id", "usage")
+
+    def __init__(self, scope: Dict[str, Any]):
+        self.scope = scope
+        self.user_id: Optional[str] = None
+        # Токены, израсходованные при обработке этого запроса
+        self.usage = _empty()
+
+    @property
+    def path(self) -> str:
+        """Шаблон пути эндпоинта (без значений параметров), например /api/jobs/{job_id}"""
+        route = self.scope.get("route")
+        return getattr(route, "path", None) or self.scope.get("path", "")
+
+    @property
+    def endpoint(self) -> str:
+        """Метод и шаблон пути эндпоинта, например GET /api/jobs/{job_id}"""
+        return f"{self.scope.get('method', '')} {self.path}".strip()
+
+_current_request: ContextVar[Optional[RequestUsage]] = ContextVar("usage_request", default=None)
+
+class UsageContextMiddleware:
+    """ASGI middleware: связывает запросы к API с эндпоинтом, который их вызвал"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _current_request.set(RequestUsage(scope))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_request.reset(token)
+
+def set_usage_user(user_id: Optional[str]) -> None:
+    """Относит токены текущего HTTP-запроса к пользователю"""
+    request = _current_request.get()
+    if request is not None and user_id:
+        request.user_id = user_id
+
+def current_route() -> Optional[str]:
+    """Шаблон пути эндпоинта текущего HTTP-запроса или None вне HTTP-запроса"""
+    request = _current_request.get()
+    return request.path if request is not None else None
+
+def current_usage() -> Optional[Dict[str, int]]:
+    """Токены, израсходованные текущим HTTP-запросом, или None вне HTTP-запроса"""
+    request = _current_request.get()
+    return dict(request.usage) if request is not None else None
+
+class TokenUsage:
+    """
+    Счетчики фактически израсходованных токенов по блоку usage ответов API
+
+    Токены учитываются в целом, по эндпоинтам сервиса и по user_id.
+    Счетчики пользователей хранятся в LRU и ограничены usage_max_users:
+    давно неактивные пользователи вытесняются.
+    """
+
+    def __init__(self, config: TokensConfig = tokens_config):
+        self.max_users = config.usage_max_users
+        self.totals = _empty()
+        self.endpoints: Dict[str, Dict[str, int]] = {}
+        self.users: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+        self.users_evicted = 0
+
+    def record(self, usage: Optional[Dict[str, Any]]) -> None:
+        """Учитывает блок usage ответа API в счетчиках текущего запроса"""
+        if not usage:
+            return
+        request = _current_request.get()
+        endpoint = request.endpoint if request is not None else BACKGROUND_ENDPOINT
+        counters = [self.totals, self.endpoints.setdefault(endpoint, _empty())]
+        if request is not None:
+            counters.append(request.usage)
+            if request.user_id:
+                user = self.users.get(request.user_id)
+                if user is None:
+                    user = self.users[request.user_id] = _empty()
+                    while len(self.users) > self.max_users:
+                        self.users.popitem(last=False)
+                        self.users_evicted += 1
+                self.users.move_to_end(request.user_id)
+                counters.append(user)
+        for counter in counters:
+            counter["requests"] += 1
+            for field in USAGE_FIELDS[1:]:
+                counter[field] += usage.get(field) or 0
+
+    def top_users(self, limit: int) -> List[Dict[str, Any]]:
+        """Пользователи с наибольшим расходом токенов"""
+        ranked = sorted(self.users.items(), key=lambda item: item[1]["total_tokens"], reverse=True)
+        return [dict(counters, user_id=user_id) for user_id, counters in ranked[:limit]]
+
+    def stats(self) -> Dict[str, Any]:
+        """Итоговые счетчики для эндпоинта /health"""
+        return dict(self.totals, users=len(self.users), users_evicted=self.users_evicted)
+
+# Глобальные счетчики расхода токенов
+token_usage = TokenUsage()
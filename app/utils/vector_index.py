@@ -0,0 +1,123 @@
+import json
+import os
+import uuid
+from typing import Dict, List, Optional, Tuple
+import logging
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - семантический поиск отключается
+    np = None
+
+logger = logging.getLogger("vector_index")
+
+META_FILE = "meta.json"
+
+def numpy_available() -> bool:
+    """Проверяет, установлена ли библиотека NumPy"""
+    return np is not None
+
+class VectorIndex:
+    """
+    Векторы разделов документации в одной непрерывной матрице float32
+
+    Матрица хранится в файле и открывается через memory-mapping, поэтому
+    после перезапуска векторы не пересчитываются, а несколько воркеров
+    делят одни и те же страницы памяти. Строка i соответствует i-му разделу;
+    для каждой строки хранится хэш текста, по которому при изменении
+    документации определяется, какие разделы нужно векторизовать заново.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.model = ""
+        self.hashes: List[str] = []
+        self.matrix: Optional["np.ndarray"] = None
+        self.vectors_file: Optional[str] = None
+
+    @property
+    def dim(self) -> int:
+        return int(self.matrix.shape[1]) if self.matrix is not None and self.matrix.size else 0
+
+    def open(self) -> bool:
+        """Открывает сохраненные векторы. Возвращает False, если их нет или файл поврежден"""
+        meta_path = os.path.join(self.path, META_FILE)
+        if not os.path.exists(meta_path):
+            return False
+        try:
+            with open(meta_path, "r", encoding="utf-8") as file:
+                meta = json.load(file)
+            vectors_path = os.path.join(self.path, meta["vectors_file"])
+            rows, dim = len(meta["hashes"]), int(meta["dim"])
+            if rows and dim:
+                matrix = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(rows, dim))
+            else:
+                matrix = np.zeros((0, dim), dtype=np.float32)
+        except Exception as e:
+            logger.warning("Не удалось открыть векторный индекс %s: %s", self.path, e)
+            return False
+        self.model = meta["model"]
+        self.hashes = meta["hashes"]
+        self.matrix = matrix
+        self.vectors_file = meta["vectors_file"]
+        return True
+
+    def lookup(self, model: str) -> Dict[str, int]:
+        """Номера строк сохраненных векторов по хэшу текста (только для той же модели)"""
+        if self.matrix is None or self.model != model:
+            return {}
+        return {text_hash: row for row, text_hash in enumerate(self.hashes)}
+
+    def row(self, index: int) -> "np.ndarray":
+        return np.asarray(self.matrix[index])
+
+    def replace(self, model: str, hashes: List[str], matrix: "np.ndarray") -> None:
+        """
+        Сохраняет новую матрицу векторов и переоткрывает ее
+
+        Векторы нормализуются, чтобы косинусная близость сводилась к
+        скалярному произведению. Файл векторов пишется под новым именем,
+        а meta.json заменяется атомарно, поэтому читатели никогда не видят
+        наполовину записанный индекс.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if matrix.size:
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix = matrix / np.where(norms == 0, 1, norms)
+
+        vectors_file = f"vectors-{uuid.uuid4().hex[:12]}.f32"
+        matrix.tofile(os.path.join(self.path, vectors_file))
+        meta = {"model": model, "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+                "hashes": hashes, "vectors_file": vectors_file}
+        meta_tmp = os.path.join(self.path, f"{META_FILE}.{uuid.uuid4().hex[:8]}.tmp")
+        with open(meta_tmp, "w", encoding="utf-8") as file:
+            json.dump(meta, file)
+        os.replace(meta_tmp, os.path.join(self.path, META_FILE))
+
+        previous = self.vectors_file
+        self.open()
+        if previous and previous != vectors_file:
+            # Старый файл остается доступен уже открытым memmap до их закрытия
+            try:
+                os.remove(os.path.join(self.path, previous))
+            except OSError:
+                pass
+
+    def search(self, query: "np.ndarray", top_k: int) -> List[Tuple[int, float]]:
+        """Возвращает до top_k пар (номер строки, косинусная близость) по убыванию близости"""
+        if self.matrix is None or not len(self.hashes):
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        scores = self.matrix @ (query / norm)
+        top_k = min(top_k, len(scores))
+        # argpartition выбирает top_k за линейное время, сортируются только они
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        ordered = candidates[np.argsort(-scores[candidates])]
+        return [(int(row), float(scores[row])) for row in ordered]
+
+    def __len__(self) -> int:
+        return len(self.hashes)
@@ -0,0 +1,124 @@
+"""
+Общие фикстуры: сервис, работающий с локальной заменой GigaChat API
+
+Замена (tools/mock_gigachat.py) запускается в отдельном потоке на свободном
+порту, а сервис - через TestClient с обработкой запуска и остановки. Данные
+сервиса (кэш, задания, индекс, токен) хранятся во временном каталоге.
+Переменные окружения задаются до импорта модулей app, так как настройки
+читаются при импорте.
+"""
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, Any
+
+import httpx
+import pytest
+import uvicorn
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+DATA_DIR = tempfile.mkdtemp(prefix="gigachat-tests-")
+MOCK_PORT = _free_port()
+MOCK_URL = f"http://127.0.0.1:{MOCK_PORT}"
+
+os.environ.update({
+    "GIGACHAT_AUTH_KEY": "test",
+    "GIGACHAT_AUTH_URL": f"{MOCK_URL}/api/v2/oauth",
+    "GIGACHAT_API_BASE_URL": f"{MOCK_URL}/api/v1",
+    "GIGACHAT_TOKEN_STORE_PATH": os.path.join(DATA_DIR, "token.sqlite3"),
+    "PLATFORM_INFO_PATH": os.path.join(ROOT, "documentation.md"),
+    "ASSISTANT_SYSTEM_PROMPT_PATH": os.path.join(ROOT, "prompts", "assistant_system.md"),
+    "EMBEDDINGS_INDEX_PATH": os.path.join(DATA_DIR, "embeddings"),
+    "CONVERSATION_STORE_PATH": os.path.join(DATA_DIR, "conversations.sqlite3"),
+    "DISK_CACHE_PATH": os.path.join(DATA_DIR, "response_cache.sqlite3"),
+    "JOBS_STORE_PATH": os.path.join(DATA_DIR, "jobs.sqlite3"),
+    "JOBS_WORKERS": "1",
+    "PROFILING_DIR": os.path.join(DATA_DIR, "profiles"),
+    "CAPTURE_ENABLED": "False",
+    "CAPTURE_PATH": os.path.join(DATA_DIR, "capture.jsonl"),
+    "LOOP_LAG_MONITOR": "False",
+    "LOG_FORMAT": "text",
+    "LOG_LEVEL": "WARNING"
+})
+
+# Быстрые ответы замены: тесты меняют поведение через mock_config и возвращают его после себя
+MOCK_DEFAULTS: Dict[str, Any] = {
+    "latency": "const:0.02",
+    "tail_ratio": 0.0,
+    "stream_interval": 0.0,
+    "completion_words": 20,
+    "oauth_latency": "const:0.05",
+    "token_ttl": 1800.0,
+    "errors": {},
+    "retry_after": None
+}
+
+class MockServer:
+    """Замена GigaChat API в фоновом потоке с доступом к настройкам и счетчикам"""
+
+    def __init__(self):
+        from tools.mock_gigachat import create_app, MockSettings
+        app = create_app(MockSettings(**MOCK_DEFAULTS), seed=1)
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=MOCK_PORT, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.client = httpx.Client(base_url=MOCK_URL, timeout=10.0)
+
+    def start(self) -> None:
+        self.thread.start()
+        deadline = time.monotonic() + 10
+        while not self.server.started:
+            if time.monotonic() > deadline or not self.thread.is_alive():
+                raise RuntimeError("Замена GigaChat API не запустилась")
+            time.sleep(0.02)
+
+    def stop(self) -> None:
+        self.client.close()
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+    def config(self, **changes) -> Dict[str, Any]:
+        response = self.client.post("/mock/config", json=changes)
+        response.raise_for_status()
+        return response.json()
+
+    def stats(self) -> Dict[str, Any]:
+        return self.client.get("/mock/stats").json()
+
+    def requests(self, endpoint: str) -> int:
+        return self.stats()["requests"].get(endpoint, 0)
+
+    def revoke_tokens(self) -> None:
+        self.client.post("/mock/tokens/revoke").raise_for_status()
+
+@pytest.fixture(scope="session")
+def mock():
+    server = MockServer()
+    server.start()
+    yield server
+    server.stop()
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
+
+@pytest.fixture(scope="session")
+def client(mock):
+    from fastapi.testclient import TestClient
+    from app.main import app
+    with TestClient(app) as test_client:
+        yield test_client
+
+@pytest.fixture(autouse=True)
+def reset_mock(request):
+    """Возвращает настройки замены к быстрым ответам без ошибок после каждого теста с ней"""
+    yield
+    if "mock" in request.fixturenames:
+        request.getfixturevalue("mock").config(**MOCK_DEFAULTS)
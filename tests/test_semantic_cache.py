@@ -0,0 +1,31 @@
+from app.config import SemanticCacheConfig
+from app.utils.semantic_cache import SemanticCache
+
+NAMESPACE = "global"
+VERSION = "v1"
+
+def make_cache() -> SemanticCache:
+    cache = SemanticCache(SemanticCacheConfig())
+    cache.enabled = True
+    return cache
+
+def test_similar_question_hits():
+    cache = make_cache()
+    cache.store("Почему не приходят уведомления?", NAMESPACE, VERSION, "ответ")
+    hit = cache.lookup("почему не приходят уведомления", NAMESPACE, VERSION)
+    assert hit is not None and hit.answer == "ответ"
+
+def test_negated_question_does_not_hit():
+    pairs = [
+        ("Почему не приходят уведомления?", "Почему приходят уведомления?"),
+        ("Почему платеж не прошел?", "Почему платеж прошел?"),
+        ("Что делать если заказ не пришел?", "Что делать если заказ пришел?"),
+        ("Можно ли оплатить без комиссии?", "Можно ли оплатить комиссию?")
+    ]
+    for negated, plain in pairs:
+        cache = make_cache()
+        cache.store(negated, NAMESPACE, VERSION, "ответ на отрицание")
+        assert cache.lookup(plain, NAMESPACE, VERSION) is None, (negated, plain)
+        cache = make_cache()
+        cache.store(plain, NAMESPACE, VERSION, "ответ")
+        assert cache.lookup(negated, NAMESPACE, VERSION) is None, (plain, negated)
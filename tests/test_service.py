@@ -0,0 +1,281 @@
+"""
+Проверки сервиса против локальной замены GigaChat API (tools/mock_gigachat.py)
+
+Тесты меняют поведение замены (задержки, ошибки, отзыв токенов) и настройки
+общих объектов сервиса на время теста, поэтому выполняются последовательно.
+"""
+import asyncio
+import os
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import app.services.upstream as upstream
+from app.config import CacheConfig, DiskCacheConfig, HedgingConfig, gigachat_config
+from app.services.embeddings import GigaChatEmbedder
+from app.services.jobs import job_service
+from app.services.knowledge import knowledge_base
+from app.utils.auth import TokenManager
+from app.utils.cache import ResponseCache, TieredResponseCache
+from app.utils.disk_cache import DiskCache
+from app.utils.hedging import HedgePolicy
+from app.utils.limiter import upstream_limiter
+from app.utils.resilience import upstream_breaker, retry_policy, STATE_OPEN, STATE_CLOSED
+from app.utils.token_store import SQLiteTokenStore
+from app.utils.tokens import token_counter
+
+def enhance(client, text: str = ""):
+    """Запрос к /api/enhance с уникальным текстом в обход кэша"""
+    return client.get("/api/enhance", params={"text": f"{text} {uuid.uuid4().hex}", "cache": "bypass"})
+
+def wait_for(check, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        result = check()
+        if result:
+            return result
+        assert time.monotonic() < deadline, "Условие не выполнено за отведенное время"
+        time.sleep(0.05)
+
+def test_token_refresh_single_flight(client, mock):
+    """Одновременные ответы 401 приводят к одному запросу нового токена"""
+    # Токен выдается медленно, чтобы все запросы получили 401 до окончания обновления
+    mock.config(oauth_latency="const:0.3")
+    oauth_before = mock.requests("oauth")
+    rejected_before = mock.stats()["expired_rejected"]
+    mock.revoke_tokens()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        responses = list(pool.map(lambda _: enhance(client, "Токен"), range(8)))
+
+    assert [response.status_code for response in responses] == [200] * 8
+    assert mock.stats()["expired_rejected"] - rejected_before > 1
+    assert mock.requests("oauth") - oauth_before == 1
+
+def test_stream_releases_limiter_slot_during_token_refresh(client, mock):
+    """Потоковый запрос не держит место в ограничителе, пока обновляется токен после 401"""
+    mock.config(oauth_latency="const:0.5")
+    oauth_before = mock.requests("oauth")
+    mock.revoke_tokens()
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        future = pool.submit(client.get, "/api/enhance/stream", params={"text": f"Поток {uuid.uuid4().hex}"})
+        wait_for(lambda: mock.requests("oauth") > oauth_before)
+        assert upstream_limiter.in_flight == 0
+        response = future.result()
+
+    assert response.status_code == 200
+    assert "event: done" in response.text
+
+def test_token_lease_renewed_between_refresh_attempts(monkeypatch, tmp_path):
+    """Аренда не истекает посреди обновления с повторами, и второй воркер не обращается к OAuth"""
+    monkeypatch.setattr(gigachat_config, "token_lease_ttl", 0.5)
+    monkeypatch.setattr(gigachat_config, "token_backoff_base", 0.1)
+    monkeypatch.setattr(gigachat_config, "token_backoff_max", 0.1)
+    path = os.path.join(tmp_path, "token.sqlite3")
+    first, second = TokenManager(SQLiteTokenStore(path)), TokenManager(SQLiteTokenStore(path))
+    calls = []
+
+    async def slow_failing_request(manager: TokenManager):
+        calls.append(manager.worker_id)
+        await asyncio.sleep(0.3)
+        if len(calls) < first.max_refresh_attempts:
+            raise RuntimeError("OAuth недоступен")
+        manager.access_token, manager.token_expires_at = "token", time.time() + 1800
+        return manager.access_token
+
+    for manager in (first, second):
+        monkeypatch.setattr(manager, "_request_token", lambda manager=manager: slow_failing_request(manager))
+
+    async def refresh_both():
+        first_task = asyncio.ensure_future(first.refresh_token())
+        await asyncio.sleep(0.1)
+        return await asyncio.gather(first_task, second.refresh_token())
+
+    # Обновление длится дольше аренды: без продления второй воркер тоже запросил бы токен
+    assert asyncio.run(refresh_both()) == ["token", "token"]
+    assert calls == [first.worker_id] * first.max_refresh_attempts
+
+def test_breaker_opens_and_half_opens(client, mock, monkeypatch):
+    """Выключатель размыкается при сбоях API и замыкается после успешного пробного запроса"""
+    monkeypatch.setattr(upstream_breaker, "min_calls", 3)
+    monkeypatch.setattr(upstream_breaker, "open_seconds", 0.5)
+    monkeypatch.setattr(upstream_breaker, "_window", deque(maxlen=3))
+    monkeypatch.setattr(retry_policy, "max_attempts", 1)
+    mock.config(errors={500: 1.0})
+
+    for _ in range(3):
+        assert enhance(client).status_code == 500
+    assert upstream_breaker.state == STATE_OPEN
+
+    # Разомкнутый выключатель отвечает 503 без запроса к API
+    calls_before = mock.requests("chat_completions")
+    response = enhance(client)
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+    assert mock.requests("chat_completions") == calls_before
+    # Потоковые эндпоинты тоже отвечают 503 до начала потока
+    for path, params in (("/api/enhance/stream", {"text": "Поток"}), ("/api/assistant/ask/stream", {"query": "Поток"})):
+        response = client.get(path, params=dict(params, cache="bypass"))
+        assert response.status_code == 503, path
+        assert "Retry-After" in response.headers
+    assert mock.requests("chat_completions") == calls_before
+
+    # Неудачный пробный запрос снова размыкает выключатель
+    time.sleep(0.6)
+    assert enhance(client).status_code == 500
+    assert upstream_breaker.state == STATE_OPEN
+    assert enhance(client).status_code == 503
+
+    # Успешный пробный запрос замыкает выключатель
+    mock.config(errors={})
+    time.sleep(0.6)
+    assert enhance(client).status_code == 200
+    assert upstream_breaker.state == STATE_CLOSED
+    assert enhance(client).status_code == 200
+
+def test_hedge_budget_cap(client, mock, monkeypatch):
+    """Дубли медленных запросов отправляются не чаще, чем позволяет бюджет"""
+    policy = HedgePolicy(HedgingConfig(
+        enabled=True, endpoints="/api/enhance", percentile=50, min_delay=0.05,
+        min_samples=5, budget_ratio=0.2, budget_window=60
+    ))
+    monkeypatch.setattr(upstream, "hedge_policy", policy)
+
+    for _ in range(5):
+        assert enhance(client, "Быстрый").status_code == 200
+    assert policy.hedge_delay("/api/enhance") is not None
+
+    # Все ответы медленнее порога: без бюджета дублировался бы каждый запрос
+    mock.config(latency="const:0.4")
+    calls_before = mock.requests("chat_completions")
+    for _ in range(10):
+        assert enhance(client, "Медленный").status_code == 200
+
+    assert policy.hedged_total >= 1
+    assert policy.hedged_total <= policy.config.budget_ratio * 15
+    assert policy.budget_exhausted_total > 0
+    assert mock.requests("chat_completions") - calls_before <= 10 + policy.hedged_total
+
+def test_job_requeued_after_restart(client, mock):
+    """Задание, прерванное остановкой обработчика, выполняется после запуска"""
+    mock.config(latency="const:2")
+    response = client.post("/api/jobs", json={
+        "items": [{"id": str(index), "text": f"Текст задания {index} {uuid.uuid4().hex}"} for index in range(3)],
+        "cache": "bypass"
+    })
+    assert response.status_code == 202
+    job_id = response.json()["id"]
+    wait_for(lambda: client.get(f"/api/jobs/{job_id}").json()["status"] == "running")
+
+    # Остановка сервиса посреди обработки: задание возвращается в ожидание
+    client.portal.call(job_service.stop)
+    assert client.get(f"/api/jobs/{job_id}").json()["status"] == "pending"
+
+    mock.config(latency="const:0.02")
+    client.portal.call(job_service.start)
+    job = wait_for(lambda: (lambda job: job if job["status"] == "done" else None)(
+        client.get(f"/api/jobs/{job_id}").json()
+    ))
+    assert job["completed"] == 3
+    assert [result["id"] for result in job["result"]] == ["0", "1", "2"]
+
+def test_semantic_cache_keeps_negation(client, mock):
+    """Вопрос без отрицания не получает ответ на вопрос с отрицанием"""
+    context = f"Оплата {uuid.uuid4().hex}"
+
+    def ask(query: str):
+        response = client.post("/api/assistant/ask", json={"query": query, "context": context})
+        assert response.status_code == 200
+        return response.json()
+
+    assert ask("Почему платеж не прошел?")["cached"] is False
+    assert ask("Почему платеж прошел?")["cached"] is False
+
+    answer = ask("почему платеж не прошел")
+    assert answer["cached"] is True
+    assert answer["matched_query"] == "Почему платеж не прошел?"
+
+def test_job_leased_by_other_process_is_not_requeued(client, mock):
+    """При перезапуске не выполняются задания, аренда которых у другого процесса не истекла"""
+    job_id = uuid.uuid4().hex
+    items = [{"id": "0", "text": f"Текст другого процесса {uuid.uuid4().hex}"}]
+    job_service.store.create(job_id, {"items": items, "cache": "bypass"}, len(items), None)
+    assert job_service.store.claim(job_id, "other-process", lease_seconds=60)
+
+    client.portal.call(job_service.stop)
+    client.portal.call(job_service.start)
+    time.sleep(0.3)
+    assert client.get(f"/api/jobs/{job_id}").json()["status"] == "running"
+    # Второй захват того же задания не удается
+    assert not job_service.store.claim(job_id, job_service.owner, lease_seconds=60)
+
+    # Процесс завершился аварийно: после истечения аренды задание выполняется заново
+    assert job_service.store.renew(job_id, "other-process", lease_seconds=-1)
+    client.portal.call(job_service.stop)
+    client.portal.call(job_service.start)
+    job = wait_for(lambda: (lambda job: job if job["status"] == "done" else None)(
+        client.get(f"/api/jobs/{job_id}").json()
+    ))
+    assert job["completed"] == 1
+
+def test_job_callback_to_internal_address_rejected(client):
+    """Уведомления на внутренние адреса не принимаются"""
+    for url in ("http://127.0.0.1:8000/hook", "http://169.254.169.254/latest", "ftp://example.com/hook",
+                "http://localhost/hook", "http://[::1]/hook", "http://10.0.0.5/hook"):
+        response = client.post("/api/jobs", json={"items": [{"text": "Текст"}], "callback_url": url})
+        assert response.status_code == 400, url
+
+def test_stream_routes_reject_oversized_prompt(client, mock, monkeypatch):
+    """Потоковые эндпоинты отвечают 413 до начала потока, как и обычные"""
+    monkeypatch.setattr(token_counter.config, "overflow", "reject")
+    monkeypatch.setattr(token_counter.config, "max_prompt_tokens", 300)
+    text = "слово " * 500
+    requests = [
+        ("GET", "/api/enhance/stream", {"params": {"text": text}}),
+        ("GET", "/api/enhance/company/stream", {"params": {"text": text}}),
+        ("POST", "/api/assistant/ask/stream", {"json": {"query": text}}),
+        ("GET", "/api/assistant/ask/stream", {"params": {"query": text}})
+    ]
+    for method, path, kwargs in requests:
+        response = client.request(method, path, **kwargs)
+        assert response.status_code == 413, path
+
+def test_embeddings_outage_falls_back_to_bm25(client, mock, monkeypatch):
+    """Сбой /embeddings не ломает поиск и не размыкает выключатель"""
+    monkeypatch.setattr(knowledge_base, "embedder", GigaChatEmbedder("Embeddings"))
+    client.portal.call(knowledge_base.sync_embeddings)
+    assert knowledge_base.semantic_ready
+
+    monkeypatch.setattr(upstream_breaker, "min_calls", 3)
+    monkeypatch.setattr(upstream_breaker, "_window", deque(maxlen=3))
+    monkeypatch.setattr(retry_policy, "max_attempts", 1)
+    mock.config(errors={500: 1.0})
+    calls_before = mock.requests("embeddings")
+    for index in range(5):
+        response = client.post("/api/assistant/search", json={"query": f"Как оплатить заказ {index} {uuid.uuid4().hex}"})
+        assert response.status_code == 200
+        assert all(match.get("similarity") is None for match in response.json()["matches"])
+    assert mock.requests("embeddings") - calls_before == 5
+    assert upstream_breaker.state == STATE_CLOSED
+
+def test_metrics_export_token_counters(client, mock):
+    """Расход токенов по эндпоинтам доступен в /metrics, по пользователям - нет"""
+    assert client.post("/api/assistant/ask", json={"query": f"Вопрос {uuid.uuid4().hex}", "user_id": "metrics-user"}).status_code == 200
+    metrics = client.get("/metrics").text
+    assert 'gigachat_tokens_total{endpoint="POST /api/assistant/ask",kind="prompt"}' in metrics
+    assert 'gigachat_tokens_total{endpoint="POST /api/assistant/ask",kind="completion"}' in metrics
+    assert "metrics-user" not in metrics
+
+def test_disk_hit_keeps_remaining_ttl_in_memory(tmp_path):
+    """Запись, поднятая с диска в память, истекает вместе с дисковой"""
+    disk = DiskCache(DiskCacheConfig(path=os.path.join(tmp_path, "cache.sqlite3")))
+    cache = TieredResponseCache(ResponseCache(CacheConfig(ttl=3600)), disk)
+    disk.set_sync("key", "value", ttl=0.3)
+
+    assert asyncio.run(cache.get("key")) == "value"
+    assert cache.memory.get("key") == "value"
+    time.sleep(0.4)
+    assert asyncio.run(cache.get("key")) is None
+    disk.close()
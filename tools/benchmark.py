@@ -0,0 +1,395 @@
+"""
+Нагрузочный тест сервиса на локальной замене GigaChat API
+
+По умолчанию запускает замену API (tools.mock_gigachat) и сервис (uvicorn
+app.main:app) на свободных портах, прогоняет сценарии с заданной
+параллельностью и выводит пропускную способность и перцентили задержки по
+эндпоинтам. Результаты сохраняются в JSON (--output) вместе с хэшем коммита
+и сравниваются с предыдущим запуском (--compare).
+
+Примеры:
+    python -m tools.benchmark --concurrency 32 --requests 1000
+    python -m tools.benchmark --scenarios enhance=3,ask=1,ask_stream=1 --output bench.json
+    python -m tools.benchmark --latency lognormal:1.5,0.6 --tail 0.01:30 --errors 429=0.02
+    python -m tools.benchmark --env HEDGE_ENABLED=True --env HEDGE_ENDPOINTS=/api/enhance --compare bench.json
+    python -m tools.benchmark --app-url http://localhost:8000 --requests 200
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Any, List, Optional, Tuple, NamedTuple
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PERCENTILES = (50, 95, 99)
+
+# Слова для генерации уникальных текстов запросов (уникальность исключает попадания в кэш)
+WORDS = (
+    "продаю велосипед горный новый почти недорого срочно торг уместен доставка город "
+    "квартира светлая уютная ремонт рядом метро парк школа магазин кафе компания "
+    "услуги качественно быстро гарантия опыт команда клиенты отзывы скидка подарок"
+).split()
+
+QUESTIONS = (
+    "Как разместить объявление?",
+    "Как изменить пароль?",
+    "Сколько стоит продвижение объявления?",
+    "Как связаться с поддержкой?",
+    "Почему объявление отклонено модерацией?"
+)
+
+class Scenario(NamedTuple):
+    """Эндпоинт сценария: метод, путь и признак потокового ответа"""
+    method: str
+    path: str
+    stream: bool
+
+SCENARIOS = {
+    "enhance": Scenario("GET", "/api/enhance", False),
+    "advanced": Scenario("GET", "/api/enhance/advanced", False),
+    "enhance_stream": Scenario("GET", "/api/enhance/stream", True),
+    "ask": Scenario("POST", "/api/assistant/ask", False),
+    "ask_stream": Scenario("GET", "/api/assistant/ask/stream", True),
+    "search": Scenario("GET", "/api/assistant/search", False)
+}
+
+def random_text(rng: random.Random, words: int = 12) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+def build_request(name: str, index: int, rng: random.Random, repeat_pool: List[str], repeat_ratio: float) -> Dict[str, Any]:
+    """Аргументы httpx-запроса для сценария"""
+    if repeat_pool and rng.random() < repeat_ratio:
+        text = rng.choice(repeat_pool)
+    else:
+        text = f"{random_text(rng)} {index}"
+        repeat_pool.append(text)
+    if name in ("enhance", "enhance_stream"):
+        return {"params": {"text": text}}
+    if name == "advanced":
+        return {"params": {"text": text, "style": "продающий", "length": "средний"}}
+    question = f"{rng.choice(QUESTIONS)} {text}"
+    if name == "ask":
+        return {"json": {"query": question, "user_id": f"bench-{index % 100}"}}
+    return {"params": {"query": question}}
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """Разбирает веса сценариев вида «enhance=3,ask=1»"""
+    weights = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"Неизвестный сценарий {name!r}, доступны: {', '.join(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Перцентиль по методу ближайшего ранга"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(len(ordered) * p / 100) - 1)]
+
+class ScenarioStats:
+    """Задержки и ошибки одного сценария"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.ttfb: List[float] = []
+        self.errors: Dict[str, int] = {}
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        ok = len(self.latencies)
+        result = {
+            "requests": ok + sum(self.errors.values()),
+            "ok": ok,
+            "errors": dict(self.errors),
+            "throughput": round(ok / elapsed, 2) if elapsed else 0.0
+        }
+        for p in PERCENTILES:
+            value = percentile(self.latencies, p)
+            result[f"p{p}_ms"] = round(value * 1000, 1) if value is not None else None
+        result["max_ms"] = round(max(self.latencies) * 1000, 1) if self.latencies else None
+        if self.ttfb:
+            for p in (50, 95):
+                result[f"ttfb_p{p}_ms"] = round(percentile(self.ttfb, p) * 1000, 1)
+        return result
+
+async def run_request(client: httpx.AsyncClient, scenario: Scenario, kwargs: Dict[str, Any], stats: ScenarioStats) -> None:
+    started_at = time.perf_counter()
+    try:
+        if scenario.stream:
+            async with client.stream(scenario.method, scenario.path, **kwargs) as response:
+                ttfb = None
+                failed = response.status_code >= 400
+                async for line in response.aiter_lines():
+                    if ttfb is None and line == "event: chunk":
+                        ttfb = time.perf_counter() - started_at
+                    if line.startswith("event: error"):
+                        failed = True
+            if failed:
+                key = str(response.status_code) if response.status_code >= 400 else "stream_error"
+                stats.errors[key] = stats.errors.get(key, 0) + 1
+                return
+            if ttfb is not None:
+                stats.ttfb.append(ttfb)
+        else:
+            response = await client.request(scenario.method, scenario.path, **kwargs)
+            if response.status_code >= 400:
+                stats.errors[str(response.status_code)] = stats.errors.get(str(response.status_code), 0) + 1
+                return
+    except httpx.HTTPError as e:
+        stats.errors[type(e).__name__] = stats.errors.get(type(e).__name__, 0) + 1
+        return
+    stats.latencies.append(time.perf_counter() - started_at)
+
+async def run_load(app_url: str,
+                   weights: Dict[str, float],
+                   concurrency: int,
+                   total: int,
+                   duration: Optional[float],
+                   warmup: int,
+                   repeat_ratio: float,
+                   timeout: float,
+                   seed: int) -> Tuple[Dict[str, ScenarioStats], float]:
+    """Прогоняет сценарии; возвращает статистику по сценариям и время измерения"""
+    rng = random.Random(seed)
+    names = list(weights)
+    repeat_pool: List[str] = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=app_url, timeout=timeout, limits=limits) as client:
+        if warmup:
+            warmup_stats = {name: ScenarioStats() for name in names}
+            await asyncio.gather(*(
+                run_request(client, SCENARIOS[name], build_request(name, -i - 1, rng, [], 0.0), warmup_stats[name])
+                for i, name in enumerate(rng.choices(names, [weights[n] for n in names], k=warmup))
+            ))
+
+        stats = {name: ScenarioStats() for name in names}
+        counter = iter(range(total)) if duration is None else iter(range(sys.maxsize))
+        started_at = time.perf_counter()
+        deadline = started_at + duration if duration is not None else None
+
+        async def worker() -> None:
+            for index in counter:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return
+                name = rng.choices(names, [weights[n] for n in names])[0]
+                await run_request(client, SCENARIOS[name], build_request(name, index, rng, repeat_pool, repeat_ratio), stats[name])
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return stats, time.perf_counter() - started_at
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Процесс завершился при запуске (код {process.returncode}), см. журнал")
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"{url} не ответил за {timeout:.0f} с")
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class Stand:
+    """Замена GigaChat API и сервис, запущенные в отдельных процессах"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.workdir = tempfile.mkdtemp(prefix="benchmark-")
+        self.processes: List[subprocess.Popen] = []
+        self.app_url = ""
+        self.mock_url = ""
+
+    def _spawn(self, command: List[str], env: Dict[str, str], log_name: str) -> subprocess.Popen:
+        log = open(os.path.join(self.workdir, log_name), "w", encoding="utf-8")
+        process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+        self.processes.append(process)
+        return process
+
+    def start(self) -> None:
+        args = self.args
+        mock_port, app_port = free_port(), free_port()
+        self.mock_url = f"http://127.0.0.1:{mock_port}"
+        mock = self._spawn([
+            sys.executable, "-m", "tools.mock_gigachat",
+            "--port", str(mock_port),
+            "--latency", args.latency,
+            "--tail", args.tail,
+            "--errors", args.errors,
+            "--token-ttl", str(args.token_ttl),
+            "--stream-interval", str(args.stream_interval),
+            "--seed", str(args.seed)
+        ], dict(os.environ), "mock.log")
+        wait_ready(f"{self.mock_url}/mock/stats", mock)
+
+        env = dict(os.environ)
+        env.update({
+            "GIGACHAT_API_BASE_URL": f"{self.mock_url}/api/v1",
+            "GIGACHAT_AUTH_URL": f"{self.mock_url}/api/v2/oauth",
+            "GIGACHAT_AUTH_KEY": "benchmark",
+            "GIGACHAT_CLIENT_ID": "benchmark",
+            "GIGACHAT_CLIENT_SECRET": "benchmark",
+            # Данные сервиса (кэши, задания, индексы) - во временном каталоге, чтобы запуски не влияли друг на друга
+            "DISK_CACHE_PATH": os.path.join(self.workdir, "response_cache.sqlite3"),
+            "JOBS_STORE_PATH": os.path.join(self.workdir, "jobs.sqlite3"),
+            "EMBEDDINGS_INDEX_PATH": os.path.join(self.workdir, "embeddings"),
+            "CONVERSATION_STORE_PATH": os.path.join(self.workdir, "conversations.sqlite3"),
+            "GIGACHAT_TOKEN_STORE_PATH": os.path.join(self.workdir, "token.sqlite3"),
+            "PROFILING_DIR": os.path.join(self.workdir, "profiles")
+        })
+        for item in args.env:
+            key, _, value = item.partition("=")
+            env[key] = value
+        app = self._spawn([
+            sys.executable, "-m", "uvicorn", "app.main:app",
+            "--host", "127.0.0.1", "--port", str(app_port),
+            "--workers", str(args.workers), "--log-level", "warning"
+        ], env, "app.log")
+        self.app_url = f"http://127.0.0.1:{app_port}"
+        wait_ready(f"{self.app_url}/", app)
+
+    def mock_stats(self) -> Optional[Dict[str, Any]]:
+        try:
+            return httpx.get(f"{self.mock_url}/mock/stats", timeout=5.0).json()
+        except httpx.HTTPError:
+            return None
+
+    def stop(self) -> None:
+        for process in reversed(self.processes):
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+def print_report(results: Dict[str, Dict[str, Any]], elapsed: float, title: str = "сценарий") -> None:
+    width = max([16] + [len(name) + 2 for name in results])
+    header = f"{title:<{width}}{'запросов':>10}{'ошибок':>8}{'rps':>9}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'max, мс':>10}"
+    print(header)
+    print("-" * len(header))
+    for name, result in results.items():
+        errors = sum(result["errors"].values())
+        row = [result["p50_ms"], result["p95_ms"], result["p99_ms"], result["max_ms"]]
+        cells = "".join(f"{value if value is not None else '-':>10}" for value in row)
+        print(f"{name:<{width}}{result['requests']:>10}{errors:>8}{result['throughput']:>9}{cells}")
+        if "ttfb_p50_ms" in result:
+            print(f"{'':<{width}}первый фрагмент: p50 {result['ttfb_p50_ms']} мс, p95 {result['ttfb_p95_ms']} мс")
+        if result["errors"]:
+            print(f"{'':<{width}}ошибки: {result['errors']}")
+    total_ok = sum(result["ok"] for result in results.values())
+    print(f"\nВсего: {total_ok} успешных запросов за {elapsed:.1f} с, {total_ok / elapsed:.1f} запросов/с")
+
+def print_comparison(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any]) -> None:
+    """Изменение пропускной способности и перцентилей относительно сохраненного запуска"""
+    print(f"\nСравнение с {baseline.get('commit') or 'предыдущим запуском'} ({baseline.get('started_at')}):")
+    for name, result in results.items():
+        before = baseline.get("results", {}).get(name)
+        if not before:
+            print(f"  {name}: нет в базовом запуске")
+            continue
+        changes = []
+        for key in ("throughput", "p50_ms", "p95_ms", "p99_ms"):
+            old, new = before.get(key), result.get(key)
+            if old and new is not None:
+                changes.append(f"{key} {old} -> {new} ({(new - old) / old * 100:+.1f}%)")
+        print(f"  {name}: " + "; ".join(changes))
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест сервиса на локальной замене GigaChat API")
+    parser.add_argument("--scenarios", default="enhance=1,ask=1",
+                        help=f"Сценарии с весами, доступны: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=int, default=16, help="Число одновременных клиентов")
+    parser.add_argument("--requests", type=int, default=500, help="Число запросов (без прогрева)")
+    parser.add_argument("--duration", type=float, default=None, help="Длительность теста в секундах вместо --requests")
+    parser.add_argument("--warmup", type=int, default=20, help="Число запросов прогрева, не входящих в результаты")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="Доля повторяющихся текстов (попадания в кэш)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Таймаут запроса к сервису, секунды")
+    parser.add_argument("--seed", type=int, default=1, help="Зерно генератора запросов и замены API")
+    parser.add_argument("--app-url", default=None, help="Адрес уже запущенного сервиса (замена API и сервис не запускаются)")
+    parser.add_argument("--workers", type=int, default=1, help="Число воркеров uvicorn запускаемого сервиса")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Переменная окружения сервиса (можно указать несколько раз)")
+    parser.add_argument("--latency", default="lognormal:0.8,0.5", help="Распределение времени ответа замены API")
+    parser.add_argument("--tail", default="0:20", help="Доля и задержка «зависших» ответов замены API")
+    parser.add_argument("--errors", default="", help="Вероятности ошибок замены API, например 429=0.05,500=0.01")
+    parser.add_argument("--token-ttl", type=float, default=1800.0, help="Срок жизни токена замены API, секунды")
+    parser.add_argument("--stream-interval", type=float, default=0.02, help="Пауза между фрагментами потока, секунды")
+    parser.add_argument("--output", default=None, help="Файл для сохранения результатов в JSON")
+    parser.add_argument("--compare", default=None, help="JSON с результатами предыдущего запуска для сравнения")
+    return parser
+
+def main() -> None:
+    args = build_parser().parse_args()
+    weights = parse_weights(args.scenarios)
+    stand = None
+    app_url = args.app_url
+    if app_url is None:
+        stand = Stand(args)
+        print(f"Запуск замены GigaChat API и сервиса (журналы в {stand.workdir})...")
+        stand.start()
+        app_url = stand.app_url
+
+    try:
+        print(f"Нагрузка: {args.concurrency} клиентов, сценарии {weights}")
+        stats, elapsed = asyncio.run(run_load(
+            app_url, weights, args.concurrency, args.requests, args.duration,
+            args.warmup, args.repeat_ratio, args.timeout, args.seed
+        ))
+        mock_stats = stand.mock_stats() if stand is not None else None
+    finally:
+        if stand is not None:
+            stand.stop()
+
+    results = {name: scenario_stats.summary(elapsed) for name, scenario_stats in stats.items()}
+    print()
+    print_report(results, elapsed)
+    if mock_stats:
+        print(f"Замена API: {mock_stats}")
+
+    report = {
+        "commit": git_commit(),
+        "started_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "elapsed": round(elapsed, 3),
+        "results": results,
+        "mock": mock_stats
+    }
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            print_comparison(results, json.load(file))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены в {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+"""
+Локальная замена GigaChat API для нагрузочного тестирования
+
+Реализует получение токена (/api/v2/oauth) и эндпоинты /api/v1/chat/completions
+(в том числе потоковый режим), /api/v1/embeddings, /api/v1/tokens/count и
+/api/v1/models. Форма ответов соответствует OpenAPI-описанию GigaChat API
+(файл «документация»). Задержка ответа, «зависшие» запросы, ошибки 401/429/5xx
+и срок жизни токена задаются при запуске и меняются во время работы через
+POST /mock/config; счетчики запросов доступны в GET /mock/stats, а выданные
+токены отзываются через POST /mock/tokens/revoke.
+
+Примеры:
+    python -m tools.mock_gigachat --port 9100
+    python -m tools.mock_gigachat --latency lognormal:1.5,0.6 --tail 0.01:30 --errors 429=0.05,500=0.01
+    curl -X POST localhost:9100/mock/config -H "Content-Type: application/json" -d '{"token_ttl": 5}'
+
+Сервис подключается к замене через переменные окружения:
+    GIGACHAT_AUTH_URL=http://127.0.0.1:9100/api/v2/oauth
+    GIGACHAT_API_BASE_URL=http://127.0.0.1:9100/api/v1
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+import uuid
+from typing import Dict, Any, List, Optional, Tuple
+
+import uvicorn
+from fastapi import FastAPI, Request, Header, Body
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, field_validator
+
+# Распределения задержки: имя -> число параметров
+DISTRIBUTIONS = {
+    "const": 1,      # const:секунды
+    "uniform": 2,    # uniform:от,до
+    "normal": 2,     # normal:среднее,отклонение
+    "lognormal": 2,  # lognormal:медиана,sigma
+    "exp": 1         # exp:среднее
+}
+
+# Примерное число символов на токен (как в оценке токенов сервиса)
+CHARS_PER_TOKEN = 3
+
+def parse_distribution(spec: str) -> Tuple[str, List[float]]:
+    """Разбирает описание распределения вида «lognormal:1.5,0.6»"""
+    name, _, params = spec.partition(":")
+    name = name.strip().lower()
+    if name not in DISTRIBUTIONS:
+        raise ValueError(f"Неизвестное распределение {name!r}, доступны: {', '.join(DISTRIBUTIONS)}")
+    values = [float(value) for value in params.split(",") if value.strip()]
+    if len(values) != DISTRIBUTIONS[name]:
+        raise ValueError(f"Распределению {name} нужно параметров: {DISTRIBUTIONS[name]}")
+    return name, values
+
+def sample_distribution(spec: str, rng: random.Random) -> float:
+    """Случайная задержка в секундах по описанию распределения"""
+    name, values = parse_distribution(spec)
+    if name == "const":
+        value = values[0]
+    elif name == "uniform":
+        value = rng.uniform(values[0], values[1])
+    elif name == "normal":
+        value = rng.gauss(values[0], values[1])
+    elif name == "lognormal":
+        value = rng.lognormvariate(math.log(max(values[0], 1e-6)), values[1])
+    else:
+        value = rng.expovariate(1 / values[0]) if values[0] > 0 else 0.0
+    return max(0.0, value)
+
+class MockSettings(BaseModel):
+    """Поведение замены GigaChat API"""
+    latency: str = Field("lognormal:0.8,0.5", description="Время генерации ответа (до первого фрагмента в потоковом режиме)")
+    tail_ratio: float = Field(0.0, ge=0, le=1, description="Доля «зависших» запросов")
+    tail_latency: float = Field(20.0, ge=0, description="Задержка «зависшего» запроса, секунды")
+    stream_interval: float = Field(0.02, ge=0, description="Пауза между фрагментами потокового ответа, секунды")
+    completion_words: int = Field(60, ge=1, description="Число слов в ответе модели")
+    oauth_latency: str = Field("const:0.05", description="Время выдачи токена")
+    token_ttl: float = Field(1800.0, gt=0, description="Срок жизни токена, секунды")
+    errors: Dict[int, float] = Field({}, description="Вероятность ответа с ошибкой по HTTP-статусу, например {429: 0.05}")
+    retry_after: Optional[int] = Field(None, description="Заголовок Retry-After для ответов 429")
+    embedding_dim: int = Field(256, ge=1, description="Размерность векторов /embeddings")
+
+    @field_validator("latency", "oauth_latency")
+    @classmethod
+    def validate_distribution(cls, value: str) -> str:
+        parse_distribution(value)
+        return value
+
+    @field_validator("errors")
+    @classmethod
+    def validate_errors(cls, value: Dict[int, float]) -> Dict[int, float]:
+        if sum(value.values()) > 1:
+            raise ValueError("Сумма вероятностей ошибок больше 1")
+        return value
+
+class MockState:
+    """Выданные токены, кэш контекста по сессиям и счетчики"""
+
+    def __init__(self, settings: MockSettings, seed: Optional[int] = None):
+        self.settings = settings
+        self.rng = random.Random(seed)
+        self.tokens: Dict[str, float] = {}
+        self.sessions: Dict[str, int] = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests: Dict[str, int] = {}
+        self.injected: Dict[str, int] = {}
+        self.tokens_issued = 0
+        self.expired_rejected = 0
+
+    def count(self, endpoint: str) -> None:
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def issue_token(self) -> Tuple[str, float]:
+        now = time.time()
+        self.tokens = {token: expires for token, expires in self.tokens.items() if expires > now}
+        token = f"mock-{uuid.uuid4().hex}"
+        expires_at = now + self.settings.token_ttl
+        self.tokens[token] = expires_at
+        self.tokens_issued += 1
+        return token, expires_at
+
+    def check_token(self, authorization: Optional[str]) -> bool:
+        if not authorization or not authorization.startswith("Bearer "):
+            return False
+        expires_at = self.tokens.get(authorization[len("Bearer "):])
+        if expires_at is None or expires_at <= time.time():
+            self.expired_rejected += 1
+            return False
+        return True
+
+    def injected_error(self) -> Optional[int]:
+        """HTTP-статус внедряемой ошибки или None"""
+        roll = self.rng.random()
+        threshold = 0.0
+        for status, probability in sorted(self.settings.errors.items()):
+            threshold += probability
+            if roll < threshold:
+                self.injected[str(status)] = self.injected.get(str(status), 0) + 1
+                return status
+        return None
+
+    def latency(self) -> float:
+        if self.settings.tail_ratio and self.rng.random() < self.settings.tail_ratio:
+            return self.settings.tail_latency
+        return sample_distribution(self.settings.latency, self.rng)
+
+def error_response(status: int, retry_after: Optional[int] = None) -> JSONResponse:
+    """Ответ с ошибкой в формате GigaChat API"""
+    messages = {
+        401: "Unauthorized",
+        429: "Too many requests",
+        500: "Internal Server Error",
+        502: "Bad Gateway",
+        503: "Service Unavailable"
+    }
+    headers = {"Retry-After": str(retry_after)} if status == 429 and retry_after is not None else None
+    return JSONResponse(
+        status_code=status,
+        content={"status": status, "message": messages.get(status, "Error")},
+        headers=headers
+    )
+
+def estimate_tokens(text: str) -> int:
+    return max(1, math.ceil(len(text) / CHARS_PER_TOKEN))
+
+def create_app(settings: Optional[MockSettings] = None, seed: Optional[int] = None) -> FastAPI:
+    """Создает приложение замены GigaChat API"""
+    app = FastAPI(title="GigaChat API (локальная замена)")
+    state = MockState(settings or MockSettings(), seed)
+    app.state.mock = state
+
+    def completion_text(messages: List[Dict[str, Any]]) -> str:
+        source = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        words = source.split() or ["ответ"]
+        count = state.settings.completion_words
+        return " ".join(words[i % len(words)] for i in range(count))
+
+    def usage(messages: List[Dict[str, Any]], completion: str, session_id: Optional[str]) -> Dict[str, int]:
+        prompt_tokens = sum(estimate_tokens(m.get("content") or "") for m in messages)
+        precached = 0
+        if session_id:
+            # Кэш контекста: совпадающее начало диалога той же сессии не тарифицируется
+            precached = min(state.sessions.get(session_id, 0), prompt_tokens)
+            state.sessions[session_id] = prompt_tokens
+        completion_tokens = estimate_tokens(completion)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "precached_prompt_tokens": precached,
+            "total_tokens": prompt_tokens + completion_tokens - precached
+        }
+
+    @app.post("/api/v2/oauth")
+    async def oauth(request: Request,
+                    authorization: Optional[str] = Header(None),
+                    rquid: Optional[str] = Header(None)):
+        state.count("oauth")
+        # Ключ авторизации передается в заголовке Basic, либо client_id и client_secret - в теле формы
+        form = await request.form()
+        if not rquid or not (authorization or form.get("client_id")):
+            return error_response(401)
+        await asyncio.sleep(sample_distribution(state.settings.oauth_latency, state.rng))
+        token, expires_at = state.issue_token()
+        return {"access_token": token, "expires_at": int(expires_at * 1000)}
+
+    @app.post("/api/v1/chat/completions")
+    async def chat_completions(request: Request,
+                               authorization: Optional[str] = Header(None),
+                               x_session_id: Optional[str] = Header(None)):
+        state.count("chat_completions")
+        if not state.check_token(authorization):
+            return error_response(401)
+        status = state.injected_error()
+        if status is not None:
+            return error_response(status, state.settings.retry_after)
+        body = await request.json()
+        messages = body.get("messages", [])
+        model = body.get("model", "GigaChat")
+        text = completion_text(messages)
+        created = int(time.time())
+
+        if not body.get("stream"):
+            state.in_flight += 1
+            state.max_in_flight = max(state.max_in_flight, state.in_flight)
+            try:
+                await asyncio.sleep(state.latency())
+            finally:
+                state.in_flight -= 1
+            return {
+                "choices": [{"message": {"role": "assistant", "content": text}, "index": 0, "finish_reason": "stop"}],
+                "created": created,
+                "model": model,
+                "usage": usage(messages, text, x_session_id),
+                "object": "chat.completion"
+            }
+
+        async def events():
+            state.in_flight += 1
+            state.max_in_flight = max(state.max_in_flight, state.in_flight)
+            try:
+                await asyncio.sleep(state.latency())
+                words = text.split(" ")
+                for i, word in enumerate(words):
+                    chunk = {
+                        "choices": [{"delta": {"role": "assistant", "content": word if i == 0 else " " + word}, "index": 0}],
+                        "created": created,
+                        "model": model,
+                        "object": "chat.completion"
+                    }
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                    await asyncio.sleep(state.settings.stream_interval)
+                final = {
+                    "choices": [{"delta": {"content": ""}, "index": 0, "finish_reason": "stop"}],
+                    "created": created,
+                    "model": model,
+                    "usage": usage(messages, text, x_session_id),
+                    "object": "chat.completion"
+                }
+                yield f"data: {json.dumps(final, ensure_ascii=False)}\n\n"
+                yield "data: [DONE]\n\n"
+            finally:
+                state.in_flight -= 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/api/v1/embeddings")
+    async def embeddings(body: Dict[str, Any] = Body(...), authorization: Optional[str] = Header(None)):
+        state.count("embeddings")
+        if not state.check_token(authorization):
+            return error_response(401)
+        status = state.injected_error()
+        if status is not None:
+            return error_response(status, state.settings.retry_after)
+        data = []
+        dim = state.settings.embedding_dim
+        for index, text in enumerate(body.get("input", [])):
+            # Детерминированный вектор: одинаковые тексты получают одинаковые векторы
+            digest = hashlib.sha256(text.encode("utf-8")).digest()
+            vector = [(digest[i % len(digest)] - 127.5) / 127.5 for i in range(dim)]
+            data.append({
+                "object": "embedding",
+                "embedding": vector,
+                "index": index,
+                "usage": {"prompt_tokens": estimate_tokens(text)}
+            })
+        return {"object": "list", "data": data, "model": body.get("model", "Embeddings")}
+
+    @app.post("/api/v1/tokens/count")
+    async def tokens_count(body: Dict[str, Any] = Body(...), authorization: Optional[str] = Header(None)):
+        state.count("tokens_count")
+        if not state.check_token(authorization):
+            return error_response(401)
+        return [
+            {"object": "tokens", "tokens": estimate_tokens(text), "characters": len(text)}
+            for text in body.get("input", [])
+        ]
+
+    @app.get("/api/v1/models")
+    async def models(authorization: Optional[str] = Header(None)):
+        state.count("models")
+        if not state.check_token(authorization):
+            return error_response(401)
+        names = ["GigaChat", "GigaChat-Pro", "GigaChat-Max", "Embeddings"]
+        return {"object": "list", "data": [{"id": name, "object": "model", "owned_by": "salutedevices"} for name in names]}
+
+    @app.get("/mock/config")
+    async def get_config():
+        return state.settings.model_dump()
+
+    @app.post("/mock/config")
+    async def update_config(changes: Dict[str, Any] = Body(...)):
+        """Меняет поведение замены (незаданные поля не меняются)"""
+        try:
+            state.settings = MockSettings(**dict(state.settings.model_dump(), **changes))
+        except ValueError as e:
+            return JSONResponse(status_code=422, content={"error": str(e)})
+        return state.settings.model_dump()
+
+    @app.post("/mock/tokens/revoke")
+    async def revoke_tokens():
+        """Отзывает выданные токены: следующие запросы получат 401"""
+        revoked = len(state.tokens)
+        state.tokens.clear()
+        return {"revoked": revoked}
+
+    @app.get("/mock/stats")
+    async def stats():
+        return {
+            "requests": state.requests,
+            "injected_errors": state.injected,
+            "tokens_issued": state.tokens_issued,
+            "expired_rejected": state.expired_rejected,
+            "in_flight": state.in_flight,
+            "max_in_flight": state.max_in_flight
+        }
+
+    return app
+
+def parse_errors(spec: str) -> Dict[int, float]:
+    """Разбирает вероятности ошибок вида «429=0.05,500=0.01»"""
+    errors = {}
+    for item in spec.split(","):
+        if item.strip():
+            status, _, probability = item.partition("=")
+            errors[int(status)] = float(probability)
+    return errors
+
+def parse_tail(spec: str) -> Tuple[float, float]:
+    """Разбирает долю и задержку «зависших» запросов вида «0.01:30»"""
+    ratio, _, latency = spec.partition(":")
+    return float(ratio), float(latency or 20)
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Локальная замена GigaChat API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", default=MockSettings().latency,
+                        help="Распределение времени ответа: const:S, uniform:A,B, normal:M,SD, lognormal:MEDIAN,SIGMA, exp:M")
+    parser.add_argument("--tail", default="0:20", help="Доля и задержка «зависших» запросов, например 0.01:30")
+    parser.add_argument("--errors", default="", help="Вероятности ошибок по статусу, например 401=0.01,429=0.05,500=0.01")
+    parser.add_argument("--retry-after", type=int, default=None, help="Retry-After для ответов 429, секунды")
+    parser.add_argument("--token-ttl", type=float, default=1800.0, help="Срок жизни токена, секунды")
+    parser.add_argument("--stream-interval", type=float, default=0.02, help="Пауза между фрагментами потока, секунды")
+    parser.add_argument("--completion-words", type=int, default=60, help="Число слов в ответе модели")
+    parser.add_argument("--seed", type=int, default=None, help="Зерно генератора случайных чисел")
+    return parser
+
+def settings_from_args(args: argparse.Namespace) -> MockSettings:
+    tail_ratio, tail_latency = parse_tail(args.tail)
+    return MockSettings(
+        latency=args.latency,
+        tail_ratio=tail_ratio,
+        tail_latency=tail_latency,
+        errors=parse_errors(args.errors),
+        retry_after=args.retry_after,
+        token_ttl=args.token_ttl,
+        stream_interval=args.stream_interval,
+        completion_words=args.completion_words
+    )
+
+def main() -> None:
+    args = build_parser().parse_args()
+    app = create_app(settings_from_args(args), args.seed)
+    print(f"Замена GigaChat API: http://{args.host}:{args.port}/api/v1 (OAuth: /api/v2/oauth)")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
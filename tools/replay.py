@@ -0,0 +1,177 @@
+"""
+Воспроизведение записанного трафика (журнал CAPTURE_PATH) на указанном сервисе
+
+Запросы из журнала отправляются в исходном порядке и с исходными паузами,
+ускоренными в --speed раз (--speed 0 - без пауз, с ограничением
+--concurrency). По каждому эндпоинту выводятся пропускная способность и
+перцентили задержки, а также сравнение с задержками из журнала. Результаты
+сохраняются в JSON (--output) и сравниваются с предыдущим запуском (--compare).
+
+Примеры:
+    python -m tools.replay logs/capture.jsonl* --target http://localhost:8000
+    python -m tools.replay logs/capture.jsonl --speed 5 --endpoints /api/assistant --cache bypass
+    python -m tools.replay logs/capture.jsonl --speed 0 --concurrency 32 --limit 1000 --output replay.json
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import httpx
+
+from tools.benchmark import Scenario, ScenarioStats, run_request, print_report, print_comparison, git_commit
+
+def load_records(paths: List[str], endpoints: List[str], limit: Optional[int]) -> Tuple[List[Dict[str, Any]], int]:
+    """Записи журнала, пригодные для воспроизведения, по времени; второе значение - число пропущенных"""
+    records = []
+    skipped = 0
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    skipped += 1
+                    continue
+                # Без параметров (CAPTURE_PAYLOADS=False) или с отброшенным телом запрос не повторить
+                if "params" not in record or record.get("body_truncated"):
+                    skipped += 1
+                    continue
+                if endpoints and not record.get("endpoint", "").startswith(tuple(endpoints)):
+                    continue
+                records.append(record)
+    records.sort(key=lambda record: record["ts"])
+    if limit is not None:
+        records = records[:limit]
+    return records, skipped
+
+def build_request(record: Dict[str, Any], cache_mode: Optional[str]) -> Tuple[Scenario, Dict[str, Any]]:
+    """Эндпоинт и аргументы httpx-запроса для записи журнала"""
+    scenario = Scenario(record["method"], record["path"], record["endpoint"].endswith("/stream"))
+    params = dict(record["params"])
+    body = record.get("body")
+    kwargs: Dict[str, Any] = {}
+    if isinstance(body, (dict, list)):
+        if cache_mode and isinstance(body, dict) and "cache" in body:
+            body = dict(body, cache=cache_mode)
+        kwargs["json"] = body
+    elif isinstance(body, str):
+        kwargs["content"] = body.encode("utf-8")
+        kwargs["headers"] = {"Content-Type": record.get("content_type") or "text/plain; charset=utf-8"}
+    if cache_mode and "json" not in kwargs:
+        params["cache"] = cache_mode
+    if params:
+        kwargs["params"] = params
+    return scenario, kwargs
+
+def captured_results(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Задержки из журнала в формате результатов запуска (для сравнения)"""
+    stats: Dict[str, ScenarioStats] = {}
+    for record in records:
+        endpoint_stats = stats.setdefault(f"{record['method']} {record['endpoint']}", ScenarioStats())
+        if record["status"] >= 400:
+            endpoint_stats.errors[str(record["status"])] = endpoint_stats.errors.get(str(record["status"]), 0) + 1
+        else:
+            endpoint_stats.latencies.append(record["duration_ms"] / 1000)
+    span = records[-1]["ts"] - records[0]["ts"] if records else 0.0
+    return {
+        "commit": "журналом",
+        "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(records[0]["ts"])) if records else None,
+        "results": {name: endpoint_stats.summary(span) for name, endpoint_stats in stats.items()}
+    }
+
+async def replay(records: List[Dict[str, Any]],
+                 target: str,
+                 speed: float,
+                 concurrency: int,
+                 cache_mode: Optional[str],
+                 timeout: float) -> Tuple[Dict[str, ScenarioStats], float, float]:
+    """
+    Повторяет запросы по расписанию журнала
+
+    Возвращает статистику по эндпоинтам, время воспроизведения и
+    наибольшее отставание от расписания (если сервис или --concurrency
+    не успевают за исходным темпом).
+    """
+    stats: Dict[str, ScenarioStats] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    first_ts = records[0]["ts"] if records else 0.0
+    max_lag = 0.0
+
+    async with httpx.AsyncClient(base_url=target, timeout=timeout, limits=limits) as client:
+        started_at = time.perf_counter()
+
+        async def send(record: Dict[str, Any], scheduled: float) -> None:
+            nonlocal max_lag
+            scenario, kwargs = build_request(record, cache_mode)
+            endpoint_stats = stats.setdefault(f"{record['method']} {record['endpoint']}", ScenarioStats())
+            async with semaphore:
+                max_lag = max(max_lag, time.perf_counter() - scheduled)
+                await run_request(client, scenario, kwargs, endpoint_stats)
+
+        tasks = []
+        for record in records:
+            offset = (record["ts"] - first_ts) / speed if speed > 0 else 0.0
+            scheduled = started_at + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(record, scheduled)))
+        await asyncio.gather(*tasks)
+        return stats, time.perf_counter() - started_at, max_lag
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Воспроизведение записанного трафика на указанном сервисе")
+    parser.add_argument("paths", nargs="+", help="Файлы журнала запросов (в том числе ротированные .1, .2 ...)")
+    parser.add_argument("--target", default="http://localhost:8000", help="Адрес сервиса")
+    parser.add_argument("--speed", type=float, default=1.0, help="Ускорение относительно исходного темпа (0 - без пауз)")
+    parser.add_argument("--concurrency", type=int, default=64, help="Максимум одновременных запросов")
+    parser.add_argument("--endpoints", default="", help="Только эндпоинты с указанными началами путей, через запятую")
+    parser.add_argument("--limit", type=int, default=None, help="Воспроизвести только первые N запросов")
+    parser.add_argument("--cache", default=None, choices=("use", "bypass", "refresh"),
+                        help="Заменить режим кэша в запросах (например, bypass - каждый запрос идет в GigaChat)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Таймаут запроса к сервису, секунды")
+    parser.add_argument("--output", default=None, help="Файл для сохранения результатов в JSON")
+    parser.add_argument("--compare", default=None, help="JSON с результатами предыдущего запуска для сравнения")
+    return parser
+
+def main() -> None:
+    args = build_parser().parse_args()
+    endpoints = [path.strip() for path in args.endpoints.split(",") if path.strip()]
+    records, skipped = load_records(args.paths, endpoints, args.limit)
+    if not records:
+        raise SystemExit("В журнале нет запросов для воспроизведения")
+    span = records[-1]["ts"] - records[0]["ts"]
+    print(f"Воспроизведение {len(records)} запросов за {span:.1f} с журнала (пропущено {skipped}), "
+          f"ускорение {args.speed or 'без пауз'}, цель {args.target}")
+
+    stats, elapsed, max_lag = asyncio.run(replay(
+        records, args.target, args.speed, args.concurrency, args.cache, args.timeout
+    ))
+    results = {name: endpoint_stats.summary(elapsed) for name, endpoint_stats in sorted(stats.items())}
+    print()
+    print_report(results, elapsed, title="эндпоинт")
+    if args.speed > 0 and max_lag > 1.0:
+        print(f"Отставание от расписания журнала до {max_lag:.1f} с: увеличьте --concurrency или уменьшите --speed")
+
+    print_comparison(results, captured_results(records))
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            print_comparison(results, json.load(file))
+    if args.output:
+        report = {
+            "commit": git_commit(),
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+            "elapsed": round(elapsed, 3),
+            "max_lag": round(max_lag, 3),
+            "results": results
+        }
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены в {args.output}")
+
+if __name__ == "__main__":
+    main()